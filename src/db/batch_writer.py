@@ -0,0 +1,72 @@
+import asyncio
+import traceback
+from typing import Any, Dict
+
+
+class BatchWriter:
+    """
+    Base dos writers em lote do worker (previsões da Tarefa 1, cache de recomendações da
+    Tarefa 2). As entradas ficam em `_buffer`, chaveadas pela linha de destino: se a mesma chave
+    entrar duas vezes no lote, a última vence, já que um único upsert não pode tocar a mesma
+    linha duas vezes. Depois de enfileirar, as subclasses chamam `_flush_if_full()`; o resto do
+    buffer é gravado em `flush()` ou `close()` (ou `async with`).
+
+    Subclasses implementam:
+      - `_write_batch(batch)`: grava o lote retornado por `_take_batch()`.
+      - `_batch_failed(batch, err)`: contabiliza e registra um lote que falhou.
+      - `summary()`: linha de resumo impressa em `close()`.
+    Quem tem buffers além de `_buffer` estende `_take_batch()`, `_is_full()` e `_has_pending()`.
+    `_take_batch()` roda sob o lock e antes de qualquer await, então add() concorrentes enchem
+    o próximo lote.
+    """
+    def __init__(self, batch_size: int):
+        self.batch_size = max(1, batch_size)
+        self._buffer: Dict[tuple, Any] = {}
+        self._flush_lock = asyncio.Lock()
+        self.batches = 0
+        self.failed = 0
+
+    async def _flush_if_full(self):
+        if self._is_full():
+            await self.flush()
+
+    def _is_full(self) -> bool:
+        return len(self._buffer) >= self.batch_size
+
+    def _has_pending(self) -> bool:
+        return bool(self._buffer)
+
+    def _take_batch(self) -> Any:
+        batch, self._buffer = self._buffer, {}
+        return batch
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._has_pending():
+                return
+            batch = self._take_batch()
+            try:
+                await self._write_batch(batch)
+                self.batches += 1
+            except Exception as db_err:
+                self._batch_failed(batch, db_err)
+                traceback.print_exc()
+
+    async def _write_batch(self, batch: Any):
+        raise NotImplementedError
+
+    def _batch_failed(self, batch: Any, err: Exception):
+        raise NotImplementedError
+
+    def summary(self) -> str:
+        raise NotImplementedError
+
+    async def close(self):
+        await self.flush()
+        print(self.summary())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
@@ -0,0 +1,137 @@
+import datetime
+import hashlib
+from typing import Dict, List, Optional
+
+from src.db import queries as worker_queries
+from src.db.batch_writer import BatchWriter
+from src.services.forecast_store import ForecastStore
+from src.utils.config import RECOMMENDATION_CACHE_BATCH_SIZE, RECOMMENDATION_PAYLOAD_VERSION
+from src.utils.utils import JSON_ENCODER, dumps_json_bytes
+
+
+class RecommendationCacheWriter(BatchWriter):
+    """
+    Acumula os payloads de recomendação da Tarefa 2 e os grava em lotes com
+    `save_recommendation_cache_batch` (COPY + um único upsert), no mesmo padrão de
+    `insert_forecast_data`. Use `close()` (ou `async with`) para gravar o que restar no buffer.
+
+    Os payloads chegam do DailyBestRanker referenciando cada hora vencedora por
+    (spot_id, best_hour_utc). A cada lote, as linhas completas dessas horas que ainda não foram
+    vistas no ciclo são buscadas com `get_forecast_rows` e viram as condições da hora: no
+    payload v1 são anexadas a cada sessão como forecast_conditions; no v2 são gravadas em
+    forecast_conditions_snapshot, sempre antes do lote de cache que as referencia. Horas que
+    sumiram do banco no meio do ciclo caem nas colunas de `forecast_store`, se informado.
+
+    Se `known_hashes` ({(user_id, cache_key): hash} já gravado) for informado, payloads cujo
+    hash não mudou desde o último ciclo não são regravados; só o created_at dessas entradas é
+    atualizado, em um UPDATE por lote, para marcar que continuam valendo neste ciclo.
+    """
+    def __init__(self, batch_size: int = RECOMMENDATION_CACHE_BATCH_SIZE, known_hashes: Optional[Dict[tuple, str]] = None,
+                 payload_version: int = RECOMMENDATION_PAYLOAD_VERSION, forecast_store: Optional[ForecastStore] = None):
+        super().__init__(batch_size)
+        self.known_hashes = known_hashes or {}
+        self.payload_version = payload_version
+        self.forecast_store = forecast_store
+        self._pending_conditions = set()
+        self._conditions: Dict[tuple, Dict] = {} # (spot_id, best_hour_utc) -> condições já carregadas no ciclo
+        self.conditions_written = 0
+        self.skipped = 0
+        self.written = 0
+        self.failed_users = set()
+
+    async def add(self, user_id: str, cache_key: str, payload: List[Dict]):
+        for day in payload:
+            for session in day['ranked_spots']:
+                ref = (session['spot_id'], session['best_hour_utc'])
+                if ref not in self._conditions:
+                    self._pending_conditions.add(ref)
+        # Serialized at flush time: v1 payloads only get their conditions once the batch is loaded
+        self._buffer[(user_id, cache_key)] = payload
+        await self._flush_if_full()
+
+    def _is_full(self) -> bool:
+        return super()._is_full() or len(self._pending_conditions) >= self.batch_size
+
+    def _has_pending(self) -> bool:
+        return super()._has_pending() or bool(self._pending_conditions)
+
+    def _take_batch(self) -> tuple:
+        refs, self._pending_conditions = self._pending_conditions, set()
+        return super()._take_batch(), refs
+
+    async def _write_batch(self, batch: tuple):
+        payloads, refs = batch
+        refs = refs - self._conditions.keys()
+        if refs:
+            conditions = await self._load_conditions(refs)
+            # Conditions first, so no stored payload ever references a missing row
+            if self.payload_version >= 2:
+                await self._save_conditions(conditions)
+            self._conditions.update(conditions)
+
+        records, unchanged = [], []
+        for (user_id, cache_key), payload in payloads.items():
+            if self.payload_version < 2:
+                payload = self._with_conditions(payload)
+            payload_bytes = dumps_json_bytes(payload)
+            payload_hash = hashlib.sha256(payload_bytes).hexdigest()
+            if self.known_hashes.get((user_id, cache_key)) == payload_hash:
+                unchanged.append((user_id, cache_key)) # Same content as the stored entry: skip the write
+                continue
+            records.append((user_id, cache_key, payload_bytes.decode('utf-8'), payload_hash, self.payload_version))
+        if records:
+            self.written += await worker_queries.save_recommendation_cache_batch(records)
+            for user_id, cache_key, _, payload_hash, _ in records:
+                self.known_hashes[(user_id, cache_key)] = payload_hash
+        if unchanged:
+            # Skipped entries are still confirmed for this cycle, so retention keeps them
+            await worker_queries.refresh_recommendation_cache_entries(unchanged)
+            self.skipped += len(unchanged)
+        print(f"    -> Lote de cache gravado: {len(records)} entradas, {len(unchanged)} inalteradas confirmadas.")
+
+    def _batch_failed(self, batch: tuple, err: Exception):
+        payloads, _ = batch
+        self.failed += len(payloads)
+        self.failed_users.update(user_id for user_id, _ in payloads)
+        print(f"    -> ERRO ao gravar lote de {len(payloads)} entradas de cache: {err}")
+
+    async def _load_conditions(self, refs: set) -> Dict[tuple, Dict]:
+        """Condições das horas `refs` como entram nos payloads: a linha completa, com timestamp_utc em ISO 8601."""
+        keys = [(spot_id, datetime.datetime.fromisoformat(best_hour_utc)) for spot_id, best_hour_utc in refs]
+        rows = await worker_queries.get_forecast_rows(keys)
+        conditions = {}
+        for spot_id, timestamp_utc in keys:
+            row = rows.get((spot_id, timestamp_utc))
+            if row is not None:
+                conditions[(spot_id, timestamp_utc.isoformat())] = {**row, 'timestamp_utc': timestamp_utc.isoformat()}
+                continue
+            index = self.forecast_store.index_of(spot_id, timestamp_utc) if self.forecast_store else None
+            if index is not None:
+                conditions[(spot_id, timestamp_utc.isoformat())] = self.forecast_store.payload_conditions(spot_id, index)
+        return conditions
+
+    async def _save_conditions(self, conditions: Dict[tuple, Dict]):
+        records = [
+            (spot_id, datetime.datetime.fromisoformat(best_hour_utc), dumps_json_bytes(row).decode('utf-8'))
+            for (spot_id, best_hour_utc), row in conditions.items()
+        ]
+        self.conditions_written += await worker_queries.save_forecast_conditions_snapshot(records)
+
+    def _with_conditions(self, payload: List[Dict]) -> List[Dict]:
+        """Cópia do payload com forecast_conditions em cada sessão (payload v1)."""
+        with_conditions = []
+        for day in payload:
+            ranked_spots = []
+            for session in day['ranked_spots']:
+                conditions = self._conditions.get((session['spot_id'], session['best_hour_utc']))
+                ranked_spots.append(session if conditions is None else {**session, 'forecast_conditions': conditions})
+            with_conditions.append({**day, 'ranked_spots': ranked_spots})
+        return with_conditions
+
+    def summary(self) -> str:
+        summary = (f"Cache de recomendações (payload v{self.payload_version}, encoder {JSON_ENCODER}): {self.written} entradas gravadas em {self.batches} lotes, "
+                   f"{self.skipped} inalteradas confirmadas sem regravar, {self.failed} com erro.")
+        summary += f"\nCondições de previsão referenciadas: {len(self._conditions)} horas"
+        if self.payload_version >= 2:
+            summary += f", {self.conditions_written} gravadas em forecast_conditions_snapshot"
+        return summary + "."
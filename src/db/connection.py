@@ -1,5 +1,5 @@
 import asyncpg
-from src.utils.config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
+from src.utils.config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, DB_POOL_MAX_SIZE
 
 _async_pool = None
 
@@ -13,7 +13,7 @@ async def init_async_db_pool():
 			port=DB_PORT,
 			database=DB_NAME,
 			min_size=1,
-			max_size=10
+			max_size=DB_POOL_MAX_SIZE
 		)
 	return _async_pool
 
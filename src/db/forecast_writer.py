@@ -0,0 +1,66 @@
+import datetime
+from typing import Dict, List, Optional
+
+from src.db import queries as worker_queries
+from src.db.batch_writer import BatchWriter
+from src.utils.config import FORECAST_INSERT_BATCH_SIZE
+
+
+class ForecastWriter(BatchWriter):
+    """
+    Acumula as linhas de previsão de todos os spots da Tarefa 1 e as grava em lotes com
+    `insert_forecast_rows_batch` (uma tabela de staging + um único upsert por lote, em transação).
+    O lote é gravado assim que enche, então os spots que terminam de buscar primeiro não
+    esperam pelo mais lento. Use `close()` (ou `async with`) para gravar o que restar no buffer.
+
+    `spot_counts` acumula {spot_id: {'inserted', 'updated', 'unchanged'}} dos lotes gravados.
+    """
+    def __init__(self, batch_size: int = FORECAST_INSERT_BATCH_SIZE):
+        super().__init__(batch_size)
+        self._fetch_states: Dict[int, tuple] = {}
+        self.spot_counts: Dict[int, Dict[str, int]] = {}
+
+    async def add(self, spot_id: int, rows: List[tuple], window_fetched_at: Optional[datetime.datetime] = None):
+        """
+        `rows` são tuplas de merge_stormglass_rows (ordem de FORECAST_COLUMNS sem o spot_id).
+        `window_fetched_at` é o horário da busca quando ela cobriu a janela desde o início
+        (None para buscas só da cauda); é gravado em forecast_fetch_state junto com o lote.
+        """
+        if not rows:
+            return
+        self._fetch_states[spot_id] = (spot_id, window_fetched_at, max(row[0] for row in rows))
+        for row in rows:
+            self._buffer[(spot_id, row[0])] = (spot_id, *row)
+        await self._flush_if_full()
+
+    def _take_batch(self) -> tuple:
+        fetch_states, self._fetch_states = self._fetch_states, {}
+        return super()._take_batch(), fetch_states
+
+    async def _write_batch(self, batch: tuple):
+        rows, fetch_states = batch
+        records = list(rows.values())
+        counts = await worker_queries.insert_forecast_rows_batch(records, list(fetch_states.values()))
+        for spot_id, spot_counts in counts.items():
+            totals = self.spot_counts.setdefault(spot_id, {'inserted': 0, 'updated': 0, 'unchanged': 0})
+            for key, value in spot_counts.items():
+                totals[key] += value
+        changed_spots = sum(1 for spot_counts in counts.values() if spot_counts['inserted'] or spot_counts['updated'])
+        print(f"    -> Lote de previsões gravado: {len(records)} linhas de {len(fetch_states)} spots ({changed_spots} com mudanças).")
+
+    def _batch_failed(self, batch: tuple, err: Exception):
+        rows, fetch_states = batch
+        self.failed += len(rows)
+        print(f"    -> ERRO ao gravar lote de {len(rows)} linhas de previsão ({len(fetch_states)} spots): {err}")
+
+    def totals(self) -> Dict[str, int]:
+        totals = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        for spot_counts in self.spot_counts.values():
+            for key, value in spot_counts.items():
+                totals[key] += value
+        return totals
+
+    def summary(self) -> str:
+        totals = self.totals()
+        return (f"Previsões: {len(self.spot_counts)} spots gravados em {self.batches} lotes: {totals['inserted']} linhas inseridas, "
+                f"{totals['updated']} atualizadas, {totals['unchanged']} inalteradas, {self.failed} com erro.")
@@ -0,0 +1,77 @@
+from src.db.connection import get_async_db_connection, release_async_db_connection
+
+# Índice de cobertura da leitura da Tarefa 2. Também é recriado por partitions.partition_forecasts_table.
+# Must include every column of queries.FORECAST_SNAPSHOT_COLUMNS for an index-only scan
+FORECASTS_SCORING_INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS idx_forecasts_spot_time_scoring ON forecasts (spot_id, timestamp_utc)
+    INCLUDE (
+        swell_height_sg, swell_period_sg, swell_direction_sg, wind_speed_sg, wind_direction_sg,
+        sea_level_sg, tide_type, air_temperature_sg, water_temperature_sg, last_modified_at
+    );
+"""
+
+# Migrações idempotentes gerenciadas pelo worker, aplicadas no início de cada ciclo.
+# Cada entrada é (descrição, SQL); o SQL deve poder rodar várias vezes sem efeito colateral.
+WORKER_MIGRATIONS = [
+    (
+        "hash do payload em user_recommendation_cache",
+        "ALTER TABLE user_recommendation_cache ADD COLUMN IF NOT EXISTS payload_hash TEXT;"
+    ),
+    (
+        "minutos até o próximo extremo de maré em forecasts",
+        "ALTER TABLE forecasts ADD COLUMN IF NOT EXISTS minutes_to_next_extreme INTEGER;"
+    ),
+    (
+        "estado das buscas de previsão por spot",
+        """
+        CREATE TABLE IF NOT EXISTS forecast_fetch_state (
+            spot_id INTEGER PRIMARY KEY REFERENCES spots (spot_id) ON DELETE CASCADE,
+            window_fetched_at TIMESTAMPTZ,
+            horizon_utc TIMESTAMPTZ NOT NULL
+        );
+        """
+    ),
+    (
+        "estado do cálculo de recomendações por usuário",
+        """
+        CREATE TABLE IF NOT EXISTS user_recommendation_state (
+            user_id UUID PRIMARY KEY,
+            inputs_hash TEXT NOT NULL,
+            computed_at TIMESTAMPTZ NOT NULL
+        );
+        """
+    ),
+    ("índice de cobertura das previsões lidas pela Tarefa 2", FORECASTS_SCORING_INDEX_SQL),
+    (
+        "versão do payload em user_recommendation_cache",
+        "ALTER TABLE user_recommendation_cache ADD COLUMN IF NOT EXISTS payload_version SMALLINT NOT NULL DEFAULT 1;"
+    ),
+    (
+        "condições de previsão referenciadas pelos payloads v2",
+        """
+        CREATE TABLE IF NOT EXISTS forecast_conditions_snapshot (
+            spot_id INTEGER NOT NULL REFERENCES spots (spot_id) ON DELETE CASCADE,
+            timestamp_utc TIMESTAMPTZ NOT NULL,
+            conditions JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (spot_id, timestamp_utc)
+        );
+        """
+    ),
+    (
+        "índice de created_at em user_recommendation_cache para a retenção",
+        "CREATE INDEX IF NOT EXISTS idx_user_recommendation_cache_created_at ON user_recommendation_cache (created_at);"
+    ),
+]
+
+async def apply_worker_migrations():
+    """Aplica as migrações do worker. Falhas são registradas sem interromper o ciclo."""
+    conn = await get_async_db_connection()
+    try:
+        for description, sql in WORKER_MIGRATIONS:
+            try:
+                await conn.execute(sql)
+            except Exception as e:
+                print(f"ERRO ao aplicar migração '{description}': {e}")
+    finally:
+        await release_async_db_connection(conn)
@@ -0,0 +1,152 @@
+import datetime
+import re
+from typing import List, Optional, Tuple
+
+from src.db.connection import get_async_db_connection, release_async_db_connection
+from src.db.migrations import FORECASTS_SCORING_INDEX_SQL
+from src.utils.config import FORECAST_DAYS, FORECAST_PARTITION_INTERVAL, FORECAST_RETENTION_DAYS
+
+# Partições de forecasts por intervalo de timestamp_utc (UTC): 'day' ou 'week' (semanas começando na segunda).
+# A conversão da tabela é opt-in (--partition-forecasts); sem ela a retenção apaga as linhas em lotes.
+PARTITION_BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def _period_start(moment: datetime.datetime, interval: str) -> datetime.datetime:
+    start = moment.astimezone(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == 'week':
+        start -= datetime.timedelta(days=start.weekday())
+    return start
+
+def _period_length(interval: str) -> datetime.timedelta:
+    return datetime.timedelta(weeks=1) if interval == 'week' else datetime.timedelta(days=1)
+
+def partition_ranges(start: datetime.datetime, end: datetime.datetime, interval: str = FORECAST_PARTITION_INTERVAL) -> List[Tuple[str, datetime.datetime, datetime.datetime]]:
+    """Partições (nome, início, fim exclusivo) necessárias para cobrir [start, end]."""
+    ranges = []
+    period_start = _period_start(start, interval)
+    while period_start <= end:
+        period_end = period_start + _period_length(interval)
+        ranges.append((f"forecasts_p{period_start:%Y%m%d}", period_start, period_end))
+        period_start = period_end
+    return ranges
+
+async def forecasts_is_partitioned(conn) -> bool:
+    relkind = await conn.fetchval("SELECT relkind FROM pg_class WHERE oid = 'forecasts'::regclass")
+    return relkind == 'p'
+
+async def _create_partitions(conn, start: datetime.datetime, end: datetime.datetime, interval: str) -> int:
+    existing = await _list_partitions(conn)
+    created = 0
+    for name, lower, upper in partition_ranges(start, end, interval):
+        # Ranges already attached (possibly under another interval) are left untouched
+        if any(lo < upper and lower < up for _, lo, up in existing):
+            continue
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF forecasts FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}');"
+        )
+        created += 1
+    return created
+
+async def _list_partitions(conn) -> List[Tuple[str, datetime.datetime, datetime.datetime]]:
+    """Partições de forecasts com seus limites (nome, início, fim exclusivo)."""
+    rows = await conn.fetch("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'forecasts'::regclass;
+    """)
+    partitions = []
+    for row in rows:
+        match = PARTITION_BOUND_PATTERN.search(row['bound'] or '')
+        if not match:
+            continue # DEFAULT partition or unexpected bound: never dropped automatically
+        lower, upper = (datetime.datetime.fromisoformat(value) for value in match.groups())
+        partitions.append((row['relname'], lower, upper))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+async def ensure_forecast_partitions(days_ahead: int = FORECAST_DAYS, interval: str = FORECAST_PARTITION_INTERVAL):
+    """Cria as partições de hoje até além do horizonte de previsão. Não faz nada se forecasts não for particionada."""
+    conn = await get_async_db_connection()
+    try:
+        if not await forecasts_is_partitioned(conn):
+            return
+        now = datetime.datetime.now(datetime.timezone.utc)
+        # One extra period beyond the horizon so the next cycle's tail always has a partition
+        end = now + datetime.timedelta(days=days_ahead) + _period_length(interval)
+        created = await _create_partitions(conn, now, end, interval)
+        if created:
+            print(f"{created} novas partições de forecasts criadas até {end:%Y-%m-%d}.")
+    except Exception as e:
+        print(f"ERRO ao criar partições de forecasts: {e}")
+    finally:
+        await release_async_db_connection(conn)
+
+async def drop_old_forecast_partitions(days_to_keep: int = FORECAST_RETENTION_DAYS) -> Optional[int]:
+    """
+    Remove (DETACH + DROP) as partições inteiramente anteriores ao limite de retenção.
+    Retorna o número de partições removidas, ou None se forecasts não for particionada.
+    """
+    conn = await get_async_db_connection()
+    try:
+        if not await forecasts_is_partitioned(conn):
+            return None
+        threshold = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days_to_keep)
+        dropped = 0
+        for name, _, upper in await _list_partitions(conn):
+            if upper > threshold:
+                continue # Partitions holding any row inside the retention window are kept whole
+            async with conn.transaction():
+                await conn.execute(f"ALTER TABLE forecasts DETACH PARTITION {name};")
+                await conn.execute(f"DROP TABLE {name};")
+            dropped += 1
+        print(f"{dropped} partições de forecasts anteriores a {threshold:%Y-%m-%d} removidas.")
+        return dropped
+    finally:
+        await release_async_db_connection(conn)
+
+async def partition_forecasts_table(days_to_keep: int = FORECAST_RETENTION_DAYS, interval: str = FORECAST_PARTITION_INTERVAL):
+    """
+    Migração opt-in: converte forecasts em uma tabela particionada por intervalo de timestamp_utc.
+    Em uma única transação, renomeia a tabela atual, cria a particionada com as mesmas colunas,
+    constraints (a chave primária passa a incluir timestamp_utc), índice de cobertura da Tarefa 2
+    e sequência, copia as linhas dentro da retenção e remove a tabela antiga.
+    """
+    conn = await get_async_db_connection()
+    try:
+        if await forecasts_is_partitioned(conn):
+            print("forecasts já é particionada. Nada a fazer.")
+            return
+        now = datetime.datetime.now(datetime.timezone.utc)
+        threshold = now - datetime.timedelta(days=days_to_keep)
+        async with conn.transaction():
+            await conn.execute("LOCK TABLE forecasts IN ACCESS EXCLUSIVE MODE;")
+            sequence = await conn.fetchval("SELECT pg_get_serial_sequence('forecasts', 'forecast_id')")
+            await conn.execute("ALTER TABLE forecasts RENAME TO forecasts_unpartitioned;")
+            await conn.execute("ALTER TABLE forecasts_unpartitioned RENAME CONSTRAINT forecasts_pkey TO forecasts_unpartitioned_pkey;")
+            await conn.execute("ALTER TABLE forecasts_unpartitioned RENAME CONSTRAINT uq_forecast_spot_timestamp TO uq_forecast_unpartitioned_spot_timestamp;")
+            # Index names are per schema: free the covering index name for the new parent
+            await conn.execute("DROP INDEX IF EXISTS idx_forecasts_spot_time_scoring;")
+            await conn.execute("""
+                CREATE TABLE forecasts (LIKE forecasts_unpartitioned INCLUDING DEFAULTS)
+                PARTITION BY RANGE (timestamp_utc);
+            """)
+            await conn.execute("ALTER TABLE forecasts ADD CONSTRAINT forecasts_pkey PRIMARY KEY (forecast_id, timestamp_utc);")
+            await conn.execute("ALTER TABLE forecasts ADD CONSTRAINT uq_forecast_spot_timestamp UNIQUE (spot_id, timestamp_utc);")
+            await conn.execute("ALTER TABLE forecasts ADD CONSTRAINT fk_spot FOREIGN KEY (spot_id) REFERENCES spots (spot_id);")
+            # Created on the parent before the partitions, so every partition inherits it
+            await conn.execute(FORECASTS_SCORING_INDEX_SQL)
+            if sequence:
+                # Keep the id sequence alive when the old table is dropped
+                await conn.execute(f"ALTER SEQUENCE {sequence} OWNED BY forecasts.forecast_id;")
+
+            newest = await conn.fetchval("SELECT MAX(timestamp_utc) FROM forecasts_unpartitioned")
+            end = max(now + datetime.timedelta(days=FORECAST_DAYS) + _period_length(interval), newest or now)
+            created = await _create_partitions(conn, threshold, end, interval)
+
+            copied = await conn.execute(
+                "INSERT INTO forecasts SELECT * FROM forecasts_unpartitioned WHERE timestamp_utc >= $1",
+                _period_start(threshold, interval)
+            )
+            await conn.execute("DROP TABLE forecasts_unpartitioned;")
+        print(f"forecasts particionada por '{interval}': {created} partições criadas, {copied.split(' ')[-1]} linhas copiadas.")
+    finally:
+        await release_async_db_connection(conn)
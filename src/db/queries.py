@@ -1,70 +1,127 @@
 # src/db/queries.py
 import datetime
-import json
+from collections import defaultdict
 from typing import List, Dict, Any, Optional
 from src.db.connection import get_async_db_connection, release_async_db_connection
 
-# --- (as outras funções no topo do arquivo permanecem as mesmas) ---
+# Ordem das colunas de forecasts usada no COPY; as linhas de merge_stormglass_rows seguem
+# esta ordem sem o spot_id, que é adicionado por insert_forecast_rows.
+FORECAST_COLUMNS = [
+    'spot_id', 'timestamp_utc', 'wave_height_sg', 'wave_direction_sg', 'wave_period_sg',
+    'swell_height_sg', 'swell_direction_sg', 'swell_period_sg', 'secondary_swell_height_sg',
+    'secondary_swell_direction_sg', 'secondary_swell_period_sg', 'wind_speed_sg',
+    'wind_direction_sg', 'water_temperature_sg', 'air_temperature_sg', 'current_speed_sg',
+    'current_direction_sg', 'sea_level_sg', 'tide_type', 'minutes_to_next_extreme'
+]
+
+# Colunas lidas pela Tarefa 2: as do score, o horário e last_modified_at (detecção de mudanças).
+# Devem estar todas em idx_forecasts_spot_time_scoring (ver src/db/migrations.py).
+FORECAST_SNAPSHOT_COLUMNS = (
+    'spot_id', 'timestamp_utc',
+    'swell_height_sg', 'swell_period_sg', 'swell_direction_sg',
+    'wind_speed_sg', 'wind_direction_sg', 'sea_level_sg', 'tide_type',
+    'air_temperature_sg', 'water_temperature_sg', 'last_modified_at',
+)
+
+def _forecast_json_key(column):
+    """Nome da chave em merge_stormglass_data: 'wave_height_sg' -> 'waveHeight_sg'."""
+    if not column.endswith('_sg'):
+        return column
+    first, *rest = column[:-3].split('_')
+    return first + ''.join(part.capitalize() for part in rest) + '_sg'
+
 async def insert_forecast_data(spot_id, forecast_data):
-    #... (sem alterações aqui)
+    """Insere os dicionários camelCase de merge_stormglass_data (caminho usado pelos scripts de depuração)."""
     if not forecast_data:
         print("Nenhum dado horário para inserir.")
         return
 
-    print(f"Iniciando inserção/atualização de {len(forecast_data)} previsões horárias para o spot ID: {spot_id}...")
-    conn = await get_async_db_connection()
-    try:
-        # Usando copy_records_to_table para uma inserção em massa muito mais rápida
-        columns = [
-            'spot_id', 'timestamp_utc', 'wave_height_sg', 'wave_direction_sg', 'wave_period_sg',
-            'swell_height_sg', 'swell_direction_sg', 'swell_period_sg', 'secondary_swell_height_sg',
-            'secondary_swell_direction_sg', 'secondary_swell_period_sg', 'wind_speed_sg',
-            'wind_direction_sg', 'water_temperature_sg', 'air_temperature_sg', 'current_speed_sg',
-            'current_direction_sg', 'sea_level_sg', 'tide_type'
-        ]
-
-        data_to_insert = []
-        for entry in forecast_data:
-            record = {
-                'spot_id': spot_id,
-                'timestamp_utc': datetime.datetime.fromisoformat(entry['time']),
-                'tide_type': entry.get('tide_type')
-            }
-            # Mapeia os nomes das chaves do JSON para os nomes das colunas
-            for col in columns:
-                if col not in record:
-                    # Remove _sg e muda para camelCase para corresponder ao JSON
-                    json_key = col[:-3] + 'Sg' if col.endswith('_sg') else col
-                    # Garante que a chave exista antes de tentar acessá-la
-                    if json_key in entry:
-                         record[col] = entry.get(json_key)
-                    else:
-                        # Se a chave não existir no JSON, usa None como padrão
-                        record[col] = None
-            data_to_insert.append(record)
-
-        # Cria uma tabela temporária, insere os dados e depois faz um "upsert" na tabela principal
-        temp_table_name = f"temp_forecasts_{spot_id}"
-        await conn.execute(f"CREATE TEMP TABLE {temp_table_name} (LIKE forecasts INCLUDING DEFAULTS) ON COMMIT DROP;")
-
-        # Converte o dicionário para uma tupla na ordem correta das colunas
-        records_to_copy = [tuple(d.get(col) for col in columns) for d in data_to_insert]
-
-        await conn.copy_records_to_table(temp_table_name, records=records_to_copy, columns=columns)
-
-        # Constrói a parte SET da query de update dinamicamente
-        update_set_clause = ", ".join(f"{col} = EXCLUDED.{col}" for col in columns if col not in ['spot_id', 'timestamp_utc'])
-        update_set_clause += ", last_modified_at = NOW()"
-
-        await conn.execute(f"""
-            INSERT INTO forecasts ({', '.join(columns)})
-            SELECT {', '.join(columns)} FROM {temp_table_name}
-            ON CONFLICT (spot_id, timestamp_utc) DO UPDATE SET
-                {update_set_clause};
-        """)
+    json_keys = [_forecast_json_key(col) for col in FORECAST_COLUMNS[2:]]
+    rows = [
+        (datetime.datetime.fromisoformat(entry['time']), *(entry.get(key) for key in json_keys))
+        for entry in forecast_data
+    ]
+    await insert_forecast_rows(spot_id, rows)
+
+async def insert_forecast_rows(spot_id, rows):
+    """
+    Insere/atualiza as previsões de um spot a partir de tuplas prontas para o COPY,
+    na ordem de FORECAST_COLUMNS sem o spot_id (saída de merge_stormglass_rows).
+    """
+    if not rows:
+        print("Nenhum dado horário para inserir.")
+        return
+
+    print(f"Iniciando inserção/atualização de {len(rows)} previsões horárias para o spot ID: {spot_id}...")
+    counts = await insert_forecast_rows_batch([(spot_id, *row) for row in rows])
+    print(f"Processo de inserção/atualização para o spot {spot_id} finalizado: {counts.get(spot_id)}.")
+
+async def insert_forecast_rows_batch(records: List[tuple], fetch_states: Optional[List[tuple]] = None) -> Dict[int, Dict[str, int]]:
+    """
+    Insere/atualiza previsões de vários spots de uma vez: COPY para uma única tabela
+    temporária e um único upsert em forecasts, na mesma transação.
+    `records` são tuplas completas na ordem de FORECAST_COLUMNS (com o spot_id).
+
+    Linhas existentes só são reescritas (e só têm last_modified_at atualizado) quando algum
+    valor mudou. `fetch_states` são tuplas (spot_id, window_fetched_at, horizon_utc) gravadas em
+    forecast_fetch_state na mesma transação (window_fetched_at None = busca só da cauda).
+    Retorna {spot_id: {'inserted', 'updated', 'unchanged'}}.
+    """
+    if not records:
+        return {}
+    columns = FORECAST_COLUMNS
+    value_columns = [col for col in columns if col not in ['spot_id', 'timestamp_utc']]
+    conn = await get_async_db_connection()
+    try:
+        async with conn.transaction():
+            # Copia apenas os tipos das colunas (sem constraints) para a tabela de staging
+            await conn.execute(f"""
+                CREATE TEMP TABLE temp_forecasts ON COMMIT DROP AS
+                SELECT {', '.join(columns)} FROM forecasts WITH NO DATA;
+            """)
+            await conn.copy_records_to_table('temp_forecasts', records=records, columns=columns)
+
+            # Constrói a parte SET da query de update dinamicamente
+            update_set_clause = ", ".join(f"{col} = EXCLUDED.{col}" for col in value_columns)
+            update_set_clause += ", last_modified_at = NOW()"
+
+            # xmax = 0 identifies rows inserted by this statement; unchanged rows are not returned
+            rows = await conn.fetch(f"""
+                WITH upserted AS (
+                    INSERT INTO forecasts ({', '.join(columns)})
+                    SELECT {', '.join(columns)} FROM temp_forecasts
+                    ON CONFLICT (spot_id, timestamp_utc) DO UPDATE SET
+                        {update_set_clause}
+                    WHERE ({', '.join(f'forecasts.{col}' for col in value_columns)})
+                        IS DISTINCT FROM ({', '.join(f'EXCLUDED.{col}' for col in value_columns)})
+                    RETURNING spot_id, (xmax = 0) AS inserted
+                )
+                SELECT spot_id,
+                       COUNT(*) FILTER (WHERE inserted) AS inserted,
+                       COUNT(*) FILTER (WHERE NOT inserted) AS updated
+                FROM upserted GROUP BY spot_id;
+            """)
+
+            if fetch_states:
+                await conn.execute("""
+                    INSERT INTO forecast_fetch_state (spot_id, window_fetched_at, horizon_utc)
+                    SELECT * FROM UNNEST($1::int[], $2::timestamptz[], $3::timestamptz[])
+                    ON CONFLICT (spot_id) DO UPDATE SET
+                        window_fetched_at = COALESCE(EXCLUDED.window_fetched_at, forecast_fetch_state.window_fetched_at),
+                        horizon_utc = GREATEST(EXCLUDED.horizon_utc, forecast_fetch_state.horizon_utc);
+                """, *(list(column) for column in zip(*fetch_states)))
+
+        staged = defaultdict(int)
+        for record in records:
+            staged[record[0]] += 1
+        counts = {spot_id: {'inserted': 0, 'updated': 0, 'unchanged': total} for spot_id, total in staged.items()}
+        for row in rows:
+            spot_counts = counts[row['spot_id']]
+            spot_counts['inserted'], spot_counts['updated'] = row['inserted'], row['updated']
+            spot_counts['unchanged'] -= row['inserted'] + row['updated']
+        return counts
     finally:
         await release_async_db_connection(conn)
-    print(f"Processo de inserção/atualização para o spot {spot_id} finalizado.")
 
 
 async def get_all_spots():
@@ -93,22 +150,6 @@ async def delete_old_forecast_data(days_to_keep=7):
         await release_async_db_connection(conn)
     print("Limpeza de dados antigos finalizada.")
 
-async def get_spot_by_id(spot_id: int) -> Optional[Dict[str, Any]]:
-    conn = await get_async_db_connection()
-    try:
-        row = await conn.fetchrow("SELECT * FROM spots WHERE spot_id = $1", spot_id)
-        return dict(row) if row else None
-    finally:
-        await release_async_db_connection(conn)
-
-async def get_forecasts_for_spot(spot_id: int, start_utc: datetime.datetime, end_utc: datetime.datetime) -> List[Dict[str, Any]]:
-    conn = await get_async_db_connection()
-    try:
-        rows = await conn.fetch("SELECT * FROM forecasts WHERE spot_id = $1 AND timestamp_utc BETWEEN $2 AND $3 ORDER BY timestamp_utc;", spot_id, start_utc, end_utc)
-        return [dict(row) for row in rows]
-    finally:
-        await release_async_db_connection(conn)
-
 async def get_all_active_users_with_presets() -> List[Dict[str, Any]]:
     conn = await get_async_db_connection()
     try:
@@ -127,50 +168,271 @@ async def get_all_active_users_with_presets() -> List[Dict[str, Any]]:
     finally:
         await release_async_db_connection(conn)
 
-async def get_full_user_details(user_id: str) -> (Optional[Dict], List[Dict]):
+async def get_generic_preferences_by_level(surf_level: str) -> Dict[str, Any]:
+    if surf_level == 'iniciante':
+        return {"ideal_swell_height": 0.8, "max_swell_height": 1.2, "max_wind_speed": 4.0, "ideal_water_temperature": 24.0, "ideal_air_temperature": 26.0}
+    if surf_level == 'maroleiro':
+        return {"ideal_swell_height": 1.0, "max_swell_height": 1.5, "max_wind_speed": 5.0, "ideal_water_temperature": 23.0, "ideal_air_temperature": 25.0}
+    if surf_level == 'pro':
+        return {"ideal_swell_height": 2.2, "max_swell_height": 3.5, "max_wind_speed": 9.0, "ideal_water_temperature": 21.0, "ideal_air_temperature": 24.0}
+    return {"ideal_swell_height": 1.5, "max_swell_height": 2.2, "max_wind_speed": 7.0, "ideal_water_temperature": 22.0, "ideal_air_temperature": 25.0}
+
+
+# --- CONSULTAS EM LOTE (pré-carregamento da Tarefa 2) ---
+async def get_forecasts_for_spots(
+    spot_ids: List[int], start_utc: datetime.datetime, end_utc: datetime.datetime,
+    time_windows: Optional[List[tuple]] = None
+) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Busca a janela de previsões de vários spots em uma única consulta, agrupada por spot_id.
+    Projeta apenas FORECAST_SNAPSHOT_COLUMNS (todas no índice de cobertura, permitindo um
+    index-only scan) e, se `time_windows` [(start_time, end_time)] for informado, só as horas
+    UTC dentro de alguma das janelas.
+    """
+    conn = await get_async_db_connection()
+    try:
+        query = f"""
+            SELECT {', '.join(FORECAST_SNAPSHOT_COLUMNS)} FROM forecasts
+            WHERE spot_id = ANY($1::int[]) AND timestamp_utc BETWEEN $2 AND $3
+        """
+        args = [list(spot_ids), start_utc, end_utc]
+        if time_windows is not None:
+            query += """
+              AND EXISTS (
+                SELECT 1 FROM UNNEST($4::time[], $5::time[]) AS w(start_time, end_time)
+                WHERE (timestamp_utc AT TIME ZONE 'UTC')::time BETWEEN w.start_time AND w.end_time
+              )
+            """
+            args += [[start for start, _ in time_windows], [end for _, end in time_windows]]
+        rows = await conn.fetch(query + " ORDER BY spot_id, timestamp_utc;", *args)
+        forecasts_by_spot = {}
+        for row in rows:
+            forecasts_by_spot.setdefault(row['spot_id'], []).append(dict(row))
+        return forecasts_by_spot
+    finally:
+        await release_async_db_connection(conn)
+
+async def get_forecast_rows(keys: List[tuple]) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Linhas completas de forecasts para os pares (spot_id, timestamp_utc) pedidos, indexadas pelo
+    par. A Tarefa 2 lê só as colunas do score; as horas vencedoras, que vão com todas as colunas
+    para forecast_conditions nos payloads, são buscadas aqui pela chave única (spot_id, timestamp_utc).
+    """
+    if not keys:
+        return {}
     conn = await get_async_db_connection()
     try:
-        profile = await conn.fetchrow("SELECT * FROM profiles WHERE id = $1", user_id)
-        if not profile: return None, []
-        prefs = await conn.fetch("SELECT * FROM user_spot_preferences WHERE user_id = $1", user_id)
-        return dict(profile), [dict(p) for p in prefs]
+        rows = await conn.fetch("""
+            SELECT f.* FROM forecasts f
+            JOIN UNNEST($1::int[], $2::timestamptz[]) AS k(spot_id, timestamp_utc)
+              ON f.spot_id = k.spot_id AND f.timestamp_utc = k.timestamp_utc;
+        """, [spot_id for spot_id, _ in keys], [timestamp_utc for _, timestamp_utc in keys])
+        return {(row['spot_id'], row['timestamp_utc']): dict(row) for row in rows}
     finally:
         await release_async_db_connection(conn)
 
-async def get_spot_level_preferences(spot_id: int, surf_level: str) -> Optional[Dict[str, Any]]:
+async def get_all_spot_level_preferences() -> Dict[tuple, Dict[str, Any]]:
+    """Retorna todas as preferências por spot/nível indexadas por (spot_id, surf_level)."""
     conn = await get_async_db_connection()
     try:
-        row = await conn.fetchrow("SELECT * FROM spot_level_preferences WHERE spot_id = $1 AND surf_level = $2", spot_id, surf_level)
-        return dict(row) if row else None
+        rows = await conn.fetch("SELECT * FROM spot_level_preferences")
+        return {(row['spot_id'], row['surf_level']): dict(row) for row in rows}
     finally:
         await release_async_db_connection(conn)
 
-async def get_generic_preferences_by_level(surf_level: str) -> Dict[str, Any]:
-    if surf_level == 'iniciante':
-        return {"ideal_swell_height": 0.8, "max_swell_height": 1.2, "max_wind_speed": 4.0, "ideal_water_temperature": 24.0, "ideal_air_temperature": 26.0}
-    if surf_level == 'maroleiro':
-        return {"ideal_swell_height": 1.0, "max_swell_height": 1.5, "max_wind_speed": 5.0, "ideal_water_temperature": 23.0, "ideal_air_temperature": 25.0}
-    if surf_level == 'pro':
-        return {"ideal_swell_height": 2.2, "max_swell_height": 3.5, "max_wind_speed": 9.0, "ideal_water_temperature": 21.0, "ideal_air_temperature": 24.0}
-    return {"ideal_swell_height": 1.5, "max_swell_height": 2.2, "max_wind_speed": 7.0, "ideal_water_temperature": 22.0, "ideal_air_temperature": 25.0}
+async def get_profiles_by_ids(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Retorna os perfis dos usuários informados indexados pelo user_id (string)."""
+    conn = await get_async_db_connection()
+    try:
+        rows = await conn.fetch("SELECT * FROM profiles WHERE id = ANY($1::uuid[])", list(user_ids))
+        return {str(row['id']): dict(row) for row in rows}
+    finally:
+        await release_async_db_connection(conn)
 
+async def get_user_spot_preferences_by_user_ids(user_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Retorna as preferências por spot dos usuários informados agrupadas pelo user_id (string)."""
+    conn = await get_async_db_connection()
+    try:
+        rows = await conn.fetch("SELECT * FROM user_spot_preferences WHERE user_id = ANY($1::uuid[])", list(user_ids))
+        prefs_by_user = {}
+        for row in rows:
+            prefs_by_user.setdefault(str(row['user_id']), []).append(dict(row))
+        return prefs_by_user
+    finally:
+        await release_async_db_connection(conn)
 
-# --- FUNÇÃO CORRIGIDA ---
-async def save_recommendation_cache(user_id: str, cache_key: str, payload: List[Dict]):
-    """Salva o resultado do cálculo de recomendação na tabela de cache."""
+async def get_recommendation_cache_hashes() -> Dict[tuple, str]:
+    """Retorna o hash do payload gravado de cada entrada de cache, indexado por (user_id, cache_key)."""
     conn = await get_async_db_connection()
     try:
-        json_payload = json.dumps(payload, default=str)
-        # Query simplificada para remover a ambígua coluna 'cache_date'
-        await conn.execute(
-            """
-            INSERT INTO user_recommendation_cache (user_id, cache_key, recommendations_payload, created_at)
-            VALUES ($1, $2, $3, NOW())
-            ON CONFLICT (user_id, cache_key) DO UPDATE SET
-                recommendations_payload = EXCLUDED.recommendations_payload,
-                created_at = NOW();
-            """,
-            user_id, cache_key, json_payload
-        )
-    finally:
-        await release_async_db_connection(conn)
\ No newline at end of file
+        rows = await conn.fetch("SELECT user_id, cache_key, payload_hash FROM user_recommendation_cache WHERE payload_hash IS NOT NULL")
+        return {(str(row['user_id']), row['cache_key']): row['payload_hash'] for row in rows}
+    finally:
+        await release_async_db_connection(conn)
+
+async def save_recommendation_cache_batch(records: List[tuple]) -> int:
+    """
+    Salva várias entradas de cache de uma vez: COPY para uma tabela temporária e um único
+    upsert em user_recommendation_cache. `records` são tuplas
+    (user_id, cache_key, payload_json, payload_hash, payload_version).
+    """
+    if not records:
+        return 0
+    conn = await get_async_db_connection()
+    try:
+        async with conn.transaction():
+            # Copia apenas os tipos das colunas (sem constraints) para a tabela de staging
+            await conn.execute("""
+                CREATE TEMP TABLE temp_recommendation_cache ON COMMIT DROP AS
+                SELECT user_id, cache_key, recommendations_payload, payload_hash, payload_version FROM user_recommendation_cache WITH NO DATA;
+            """)
+            await conn.copy_records_to_table(
+                'temp_recommendation_cache', records=records,
+                columns=['user_id', 'cache_key', 'recommendations_payload', 'payload_hash', 'payload_version']
+            )
+            await conn.execute("""
+                INSERT INTO user_recommendation_cache (user_id, cache_key, recommendations_payload, payload_hash, payload_version, created_at)
+                SELECT user_id, cache_key, recommendations_payload, payload_hash, payload_version, NOW() FROM temp_recommendation_cache
+                ON CONFLICT (user_id, cache_key) DO UPDATE SET
+                    recommendations_payload = EXCLUDED.recommendations_payload,
+                    payload_hash = EXCLUDED.payload_hash,
+                    payload_version = EXCLUDED.payload_version,
+                    created_at = NOW();
+            """)
+        return len(records)
+    finally:
+        await release_async_db_connection(conn)
+
+async def refresh_recommendation_cache_entries(keys: List[tuple]) -> int:
+    """
+    Marca como confirmadas neste ciclo (created_at = NOW()) as entradas (user_id, cache_key) cujo
+    payload recalculado saiu idêntico ao gravado e por isso não foi regravado. Sem isso, uma
+    entrada viva e estável nunca teria o created_at atualizado e seria apagada pela retenção.
+    """
+    if not keys:
+        return 0
+    conn = await get_async_db_connection()
+    try:
+        result = await conn.execute("""
+            UPDATE user_recommendation_cache c SET created_at = NOW()
+            FROM UNNEST($1::uuid[], $2::text[]) AS k(user_id, cache_key)
+            WHERE c.user_id = k.user_id AND c.cache_key = k.cache_key;
+        """, [user_id for user_id, _ in keys], [cache_key for _, cache_key in keys])
+        return int(result.split(' ')[-1]) if result.startswith('UPDATE') else 0
+    finally:
+        await release_async_db_connection(conn)
+
+async def save_forecast_conditions_snapshot(records: List[tuple]) -> int:
+    """
+    Grava as condições de previsão referenciadas pelos payloads v2 em forecast_conditions_snapshot
+    (COPY + um único upsert). `records` são tuplas (spot_id, timestamp_utc, conditions_json).
+    Linhas com as mesmas condições já gravadas não são reescritas. Retorna quantas foram gravadas.
+    """
+    if not records:
+        return 0
+    conn = await get_async_db_connection()
+    try:
+        async with conn.transaction():
+            await conn.execute("""
+                CREATE TEMP TABLE temp_forecast_conditions ON COMMIT DROP AS
+                SELECT spot_id, timestamp_utc, conditions FROM forecast_conditions_snapshot WITH NO DATA;
+            """)
+            await conn.copy_records_to_table(
+                'temp_forecast_conditions', records=records, columns=['spot_id', 'timestamp_utc', 'conditions']
+            )
+            result = await conn.execute("""
+                INSERT INTO forecast_conditions_snapshot (spot_id, timestamp_utc, conditions, updated_at)
+                SELECT spot_id, timestamp_utc, conditions, NOW() FROM temp_forecast_conditions
+                ON CONFLICT (spot_id, timestamp_utc) DO UPDATE SET
+                    conditions = EXCLUDED.conditions,
+                    updated_at = NOW()
+                WHERE forecast_conditions_snapshot.conditions IS DISTINCT FROM EXCLUDED.conditions;
+            """)
+        return int(result.split(' ')[-1])
+    finally:
+        await release_async_db_connection(conn)
+
+async def get_user_recommendation_states() -> Dict[str, Dict[str, Any]]:
+    """Estado do último cálculo de recomendações de cada usuário: {user_id: {'inputs_hash', 'computed_at'}}."""
+    conn = await get_async_db_connection()
+    try:
+        rows = await conn.fetch("SELECT user_id, inputs_hash, computed_at FROM user_recommendation_state")
+        return {str(row['user_id']): {'inputs_hash': row['inputs_hash'], 'computed_at': row['computed_at']} for row in rows}
+    finally:
+        await release_async_db_connection(conn)
+
+async def save_user_recommendation_states(records: List[tuple]) -> int:
+    """Grava o estado do cálculo de vários usuários. `records` são tuplas (user_id, inputs_hash, computed_at)."""
+    if not records:
+        return 0
+    conn = await get_async_db_connection()
+    try:
+        user_ids, inputs_hashes, computed_ats = (list(column) for column in zip(*records))
+        await conn.execute("""
+            INSERT INTO user_recommendation_state (user_id, inputs_hash, computed_at)
+            SELECT * FROM UNNEST($1::uuid[], $2::text[], $3::timestamptz[])
+            ON CONFLICT (user_id) DO UPDATE SET
+                inputs_hash = EXCLUDED.inputs_hash,
+                computed_at = EXCLUDED.computed_at;
+        """, user_ids, inputs_hashes, computed_ats)
+        return len(records)
+    finally:
+        await release_async_db_connection(conn)
+
+async def get_forecast_freshness(spot_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Para cada spot, retorna em uma única consulta quando a janela de previsão foi buscada por
+    completo pela última vez (window_fetched_at) e até onde as previsões vão (horizon_utc).
+    """
+    conn = await get_async_db_connection()
+    try:
+        rows = await conn.fetch("""
+            SELECT spot_id, window_fetched_at, horizon_utc
+            FROM forecast_fetch_state
+            WHERE spot_id = ANY($1::int[]);
+        """, list(spot_ids))
+        return {row['spot_id']: dict(row) for row in rows}
+    finally:
+        await release_async_db_connection(conn)
+
+async def insert_extreme_tides_data(spot_id: int, tide_data: List[Dict[str, Any]],
+                                    start_utc: Optional[datetime.datetime] = None,
+                                    end_utc: Optional[datetime.datetime] = None):
+    """
+    Grava os extremos de maré (high/low) de um spot em tides_forecast com COPY e um único upsert.
+    Com `start_utc`/`end_utc`, os extremos antigos da janela são apagados antes, na mesma
+    transação, para que extremos que mudaram de horário na nova previsão não fiquem duplicados.
+    """
+    records = [
+        (spot_id, datetime.datetime.fromisoformat(entry['time']), entry['type'], entry['height'])
+        for entry in tide_data
+        if entry.get('time') and entry.get('type') in ('high', 'low') and entry.get('height') is not None
+    ]
+    if not records:
+        print(f"Nenhum extremo de maré para inserir no spot ID: {spot_id}.")
+        return
+
+    conn = await get_async_db_connection()
+    try:
+        async with conn.transaction():
+            if start_utc is not None and end_utc is not None:
+                await conn.execute(
+                    "DELETE FROM tides_forecast WHERE spot_id = $1 AND timestamp_utc BETWEEN $2 AND $3;",
+                    spot_id, start_utc, end_utc
+                )
+            await conn.execute("""
+                CREATE TEMP TABLE temp_tides_forecast ON COMMIT DROP AS
+                SELECT spot_id, timestamp_utc, tide_type, height FROM tides_forecast WITH NO DATA;
+            """)
+            await conn.copy_records_to_table(
+                'temp_tides_forecast', records=records,
+                columns=['spot_id', 'timestamp_utc', 'tide_type', 'height']
+            )
+            await conn.execute("""
+                INSERT INTO tides_forecast (spot_id, timestamp_utc, tide_type, height)
+                SELECT spot_id, timestamp_utc, tide_type, height FROM temp_tides_forecast
+                ON CONFLICT (spot_id, timestamp_utc, tide_type) DO UPDATE SET height = EXCLUDED.height;
+            """)
+    finally:
+        await release_async_db_connection(conn)
+    print(f"{len(records)} extremos de maré inseridos/atualizados para o spot ID: {spot_id}.")
@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+from src.db.connection import get_async_db_connection, release_async_db_connection
+from src.db.partitions import drop_old_forecast_partitions
+from src.utils.config import (
+    FORECAST_RETENTION_DAYS, RECOMMENDATION_CACHE_RETENTION_DAYS,
+    RETENTION_DELETE_CHUNK_SIZE, RETENTION_DELETE_SLEEP_SECONDS
+)
+
+# Tabelas limpas pelo job de retenção: tabela -> (coluna de agrupamento, coluna de tempo). Cada
+# lote é uma faixa de tempo dentro de um grupo, lida pelo índice (grupo, tempo) da tabela; sem
+# agrupamento, pelo índice da coluna de tempo. Os nomes entram no SQL diretamente, então só
+# valores desta lista devem ser usados.
+RETENTION_TARGETS = {
+    'forecasts': ('spot_id', 'timestamp_utc'),  # uq_forecast_spot_timestamp
+    'tides_forecast': ('spot_id', 'timestamp_utc'),  # uq_tide_spot_timestamp_type
+    'forecast_conditions_snapshot': ('spot_id', 'timestamp_utc'),  # chave primária
+    'user_recommendation_cache': (None, 'created_at'),  # idx_user_recommendation_cache_created_at
+}
+RETENTION_START = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+async def _delete_range_in_chunks(delete_chunk: Callable[[datetime.datetime], Awaitable[Tuple[int, Optional[datetime.datetime]]]],
+                                  chunk_size: int, sleep_seconds: float) -> Tuple[int, int]:
+    """
+    Chama `delete_chunk(cursor)` até um lote vir incompleto. Cada lote apaga até `chunk_size`
+    linhas com tempo >= cursor, em ordem, e retorna (apagadas, maior tempo apagado); o próximo
+    lote começa desse tempo, então nenhum lote reabre o trecho do índice já apagado.
+    Retorna (linhas apagadas, lotes executados).
+    """
+    cursor, deleted_total, chunks = RETENTION_START, 0, 0
+    while True:
+        deleted, last = await delete_chunk(cursor)
+        deleted_total += deleted
+        chunks += 1
+        if deleted < chunk_size or last is None:
+            return deleted_total, chunks
+        cursor = last
+        await asyncio.sleep(sleep_seconds)
+
+async def delete_in_chunks(table: str, threshold: datetime.datetime,
+                           chunk_size: int = RETENTION_DELETE_CHUNK_SIZE,
+                           sleep_seconds: float = RETENTION_DELETE_SLEEP_SECONDS) -> int:
+    """
+    Apaga as linhas de `table` anteriores a `threshold` em lotes de até `chunk_size` linhas,
+    cada lote em sua própria transação curta, com uma pausa entre os lotes para limitar locks
+    e picos de WAL. Tabelas agrupadas por spot são percorridas spot a spot, sempre por faixas
+    do índice (spot_id, tempo). Retorna o total de linhas apagadas.
+    """
+    group_column, time_column = RETENTION_TARGETS[table]
+    group_filter = f"{group_column} = $4 AND " if group_column else ""
+    # ctid = ANY(ARRAY(...)) lets the planner use a TID scan for the rows picked through the index
+    chunk_sql = f"""
+        WITH deleted AS (
+            DELETE FROM {table}
+            WHERE ctid = ANY(ARRAY(
+                SELECT ctid FROM {table}
+                WHERE {group_filter}{time_column} >= $1 AND {time_column} < $2
+                ORDER BY {time_column}
+                LIMIT $3
+            ))
+            RETURNING {time_column}
+        )
+        SELECT COUNT(*) AS deleted, MAX({time_column}) AS last FROM deleted;
+    """
+    chunk_size = max(1, chunk_size)
+    deleted_total, chunks = 0, 0
+    started = time.perf_counter()
+    conn = await get_async_db_connection()
+    try:
+        groups = [row['spot_id'] for row in await conn.fetch("SELECT spot_id FROM spots ORDER BY spot_id")] if group_column else [None]
+
+        async def delete_chunk(cursor, group):
+            args = (cursor, threshold, chunk_size) + ((group,) if group_column else ())
+            row = await conn.fetchrow(chunk_sql, *args)
+            return row['deleted'], row['last']
+
+        for group in groups:
+            deleted, group_chunks = await _delete_range_in_chunks(
+                lambda cursor: delete_chunk(cursor, group), chunk_size, sleep_seconds
+            )
+            deleted_total += deleted
+            chunks += group_chunks
+    finally:
+        await release_async_db_connection(conn)
+
+    elapsed = time.perf_counter() - started
+    rate = deleted_total / elapsed if elapsed > 0 else 0.0
+    print(f"{deleted_total} registros anteriores a {threshold:%Y-%m-%d} removidos de '{table}' "
+          f"em {chunks} lotes ({elapsed:.1f}s, {rate:.0f} linhas/s).")
+    return deleted_total
+
+async def run_retention_job(days_to_keep: int = FORECAST_RETENTION_DAYS,
+                            cache_days_to_keep: int = RECOMMENDATION_CACHE_RETENTION_DAYS):
+    """
+    Limpeza de dados antigos do ciclo: previsões, extremos de maré e condições dos payloads v2
+    além da retenção, e entradas de cache de recomendações não confirmadas há
+    `cache_days_to_keep` dias. A virada do dia força o recálculo de todo usuário ativo, e o
+    RecommendationCacheWriter atualiza o created_at de toda entrada recalculada: regravando-a
+    ou, quando o payload saiu idêntico e a gravação é pulada pelo hash, com um UPDATE só do
+    created_at. As entradas que ficam para trás são de presets renomeados, usuários sem preset
+    ou configs que deixaram de ter recomendações. Com forecasts particionada, as partições
+    vencidas são removidas inteiras em vez de apagadas em lotes.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    threshold = now - datetime.timedelta(days=days_to_keep)
+    print(f"\nIniciando limpeza de dados anteriores a {threshold:%Y-%m-%d}...")
+    try:
+        if await drop_old_forecast_partitions(days_to_keep) is None:
+            await delete_in_chunks('forecasts', threshold)
+    except Exception as e:
+        print(f"Erro durante a limpeza de 'forecasts': {e}")
+
+    for table, table_threshold in (
+        ('tides_forecast', threshold),
+        ('forecast_conditions_snapshot', threshold),
+        ('user_recommendation_cache', now - datetime.timedelta(days=cache_days_to_keep)),
+    ):
+        try:
+            await delete_in_chunks(table, table_threshold)
+        except Exception as e:
+            print(f"Erro durante a limpeza de '{table}': {e}")
+    print("Limpeza de dados antigos finalizada.")
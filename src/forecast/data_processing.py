@@ -1,6 +1,8 @@
 # bryanads/thecheck-worker/thecheck-worker-5d2c32562db70fa8dd5be23d1229053a0125233a/src/forecast/data_processing.py
 from src.utils.config import REQUEST_DIR, TREATED_DIR # Mantido caso precise no futuro
-from src.utils.utils import load_json_data, save_json_data, determine_tide_phase
+import datetime
+from src.utils.utils import load_json_data, save_json_data, determine_tide_phase, label_tide_phases_from_extremes
+from src.db.queries import FORECAST_COLUMNS
 
 def filter_forecast_time(data):
     """Filtra os dados para manter apenas as horas de interesse (ex: 5h às 17h)."""
@@ -20,11 +22,20 @@ def filter_forecast_time(data):
             filtered.append(entry) # Adiciona mesmo se houver erro na extração da hora
     return filtered
 
+def _label_sea_level(sea_level_list, tide_extremes_data):
+    """Calcula o tide_type de cada hora: pelos extremos quando disponíveis, senão pela heurística."""
+    tide_extremes_list = (tide_extremes_data or {}).get('data')
+    if isinstance(tide_extremes_list, list) and tide_extremes_list:
+        return label_tide_phases_from_extremes(sea_level_list, tide_extremes_list)
+    return determine_tide_phase(sea_level_list)
+
 # --- FUNÇÃO CORRIGIDA ---
-def merge_stormglass_data(weather_data: dict, sea_level_data: dict, output_filename: str = None):
+def merge_stormglass_data(weather_data: dict, sea_level_data: dict, output_filename: str = None, tide_extremes_data: dict = None):
     """
     Mescla os dados de tempo e nível do mar (recebidos como dicionários),
     e calcula o tipo de maré. Opcionalmente salva em arquivo.
+    Com `tide_extremes_data` (resposta do endpoint de extremos), a fase da maré vem dos
+    extremos previstos e cada hora ganha 'minutes_to_next_extreme'.
     """
     # REMOVIDO: Não carrega mais de arquivos
     # weather_data = load_json_data(weather_filename, REQUEST_DIR)
@@ -40,7 +51,7 @@ def merge_stormglass_data(weather_data: dict, sea_level_data: dict, output_filen
     if not isinstance(sea_level_list, list):
          print(f"ERRO: 'data' em sea_level_data não é uma lista. Tipo: {type(sea_level_list)}")
          return None
-    sea_level_with_tide_type = determine_tide_phase(sea_level_list)
+    sea_level_with_tide_type = _label_sea_level(sea_level_list, tide_extremes_data)
 
 
     # 2. Cria dicionários para um merge eficiente
@@ -86,7 +97,8 @@ def merge_stormglass_data(weather_data: dict, sea_level_data: dict, output_filen
             'currentSpeed_sg': get_nested(weather, ['currentSpeed', 'sg']),
             'currentDirection_sg': get_nested(weather, ['currentDirection', 'sg']),
             'seaLevel_sg': sea_level_entry.get('sg'), # Já está no nível superior
-            'tide_type': sea_level_entry.get('tide_type') # Campo calculado
+            'tide_type': sea_level_entry.get('tide_type'), # Campo calculado
+            'minutes_to_next_extreme': sea_level_entry.get('minutes_to_next_extreme') # Apenas com extremos
         })
 
     # Ordena pelo timestamp antes de retornar
@@ -101,4 +113,63 @@ def merge_stormglass_data(weather_data: dict, sea_level_data: dict, output_filen
              print(f"Erro ao salvar dados mesclados em {output_filename}: {e}")
              # Continua mesmo se salvar falhar, pois o worker precisa dos dados merged
 
-    return merged # Retorna a lista de dicionários mesclados
\ No newline at end of file
+    return merged # Retorna a lista de dicionários mesclados
+
+def _stormglass_param(column):
+    """Nome do parâmetro da Stormglass para uma coluna de forecasts: 'wave_height_sg' -> 'waveHeight'."""
+    first, *rest = column[:-3].split('_')
+    return first + ''.join(part.capitalize() for part in rest)
+
+# Parâmetros lidos de cada hora, na ordem de FORECAST_COLUMNS entre timestamp_utc e sea_level_sg
+WEATHER_COLUMN_PARAMS = tuple(
+    _stormglass_param(column) for column in FORECAST_COLUMNS[2:FORECAST_COLUMNS.index('sea_level_sg')]
+)
+
+def _sg_value(weather, param):
+    """Valor 'sg' de um parâmetro da hora, ou None se ausente/malformado."""
+    try:
+        return weather[param]['sg']
+    except (KeyError, TypeError):
+        return None
+
+def _last_of_each_time(entries):
+    """Entradas com 'time' ordenadas por tempo; em horários repetidos fica a última (como no merge por dicionário)."""
+    entries = sorted((entry for entry in entries if 'time' in entry), key=lambda entry: entry['time'])
+    return [entry for i, entry in enumerate(entries) if i + 1 == len(entries) or entries[i + 1]['time'] != entry['time']]
+
+def merge_stormglass_rows(weather_data: dict, sea_level_data: dict, tide_extremes_data: dict = None):
+    """
+    Mesmo merge de merge_stormglass_data, mas devolve tuplas prontas para o COPY
+    (ordem de FORECAST_COLUMNS sem o spot_id) em vez de dicionários camelCase.
+    As duas séries, ordenadas por tempo, são percorridas com dois ponteiros.
+    """
+    if not weather_data or 'hours' not in weather_data or not sea_level_data or 'data' not in sea_level_data:
+        print("Dados de tempo ou nível do mar inválidos para o merge.")
+        return None
+
+    sea_level_list = sea_level_data.get('data', [])
+    weather_hours_list = weather_data.get('hours', [])
+    if not isinstance(sea_level_list, list) or not isinstance(weather_hours_list, list):
+        print("ERRO: 'data' em sea_level_data ou 'hours' em weather_data não é uma lista.")
+        return None
+
+    sea_levels = _last_of_each_time(_label_sea_level(sea_level_list, tide_extremes_data))
+    weather_hours = _last_of_each_time(weather_hours_list)
+
+    rows = []
+    j, sea_count = 0, len(sea_levels)
+    for weather in weather_hours:
+        time_str = weather['time']
+        # Advance the sea level pointer up to the current hour (left join on the weather hours)
+        while j < sea_count and sea_levels[j]['time'] < time_str:
+            j += 1
+        sea_level_entry = sea_levels[j] if j < sea_count and sea_levels[j]['time'] == time_str else None
+
+        rows.append((
+            datetime.datetime.fromisoformat(time_str),
+            *[_sg_value(weather, param) for param in WEATHER_COLUMN_PARAMS],
+            sea_level_entry.get('sg') if sea_level_entry else None,
+            sea_level_entry.get('tide_type') if sea_level_entry else None,
+            sea_level_entry.get('minutes_to_next_extreme') if sea_level_entry else None,
+        ))
+    return rows
@@ -0,0 +1,83 @@
+import datetime
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from src.utils.config import (
+    FORECAST_TTL_HOURS, FORECAST_HORIZON_TOLERANCE_HOURS, FORECAST_COORDINATE_PRECISION
+)
+
+
+@dataclass
+class SpotFetchPlan:
+    """Janela que deve ser buscada na Stormglass para um spot e o motivo da busca."""
+    spot: Dict[str, Any]
+    start_utc: datetime.datetime
+    end_utc: datetime.datetime
+    reason: str # 'novo', 'expirado' ou 'cauda'
+
+
+@dataclass
+class FetchGroup:
+    """Spots da mesma célula da grade: uma única busca nas coordenadas do primeiro spot."""
+    spots: List[Dict[str, Any]]
+    latitude: Any
+    longitude: Any
+    start_utc: datetime.datetime
+    end_utc: datetime.datetime
+
+
+def plan_forecast_fetches(
+    spots: List[Dict[str, Any]], freshness: Dict[int, Dict[str, Any]],
+    start_utc: datetime.datetime, end_utc: datetime.datetime, now: datetime.datetime,
+    ttl_hours: float = FORECAST_TTL_HOURS,
+    horizon_tolerance_hours: float = FORECAST_HORIZON_TOLERANCE_HOURS,
+) -> Tuple[List[SpotFetchPlan], List[Dict[str, Any]]]:
+    """
+    Decide quais spots precisam ser buscados com base em `get_forecast_freshness`:
+    - nunca buscados, ou cuja janela completa foi buscada há mais que o TTL: janela completa;
+    - dados recentes, mas horizonte aquém do alvo: apenas a cauda que falta, a partir da
+      meia-noite UTC do primeiro dia incompleto (a fase da maré é calculada por dia);
+    - caso contrário o spot é pulado.
+    Retorna (planos, spots pulados).
+    """
+    stale_before = now - datetime.timedelta(hours=ttl_hours)
+    min_horizon = end_utc - datetime.timedelta(hours=horizon_tolerance_hours)
+    plans, skipped = [], []
+
+    for spot in spots:
+        state = freshness.get(spot.get('spot_id'))
+        if not state or state.get('horizon_utc') is None:
+            plans.append(SpotFetchPlan(spot, start_utc, end_utc, 'novo'))
+        elif state.get('window_fetched_at') is None or state['window_fetched_at'] < stale_before:
+            plans.append(SpotFetchPlan(spot, start_utc, end_utc, 'expirado'))
+        elif state['horizon_utc'] < min_horizon:
+            first_missing = state['horizon_utc'] + datetime.timedelta(hours=1)
+            tail_start = max(start_utc, first_missing.replace(hour=0, minute=0, second=0, microsecond=0))
+            plans.append(SpotFetchPlan(spot, tail_start, end_utc, 'cauda'))
+        else:
+            skipped.append(spot)
+    return plans, skipped
+
+
+def coalesce_fetch_plans(plans: List[SpotFetchPlan], precision: int = FORECAST_COORDINATE_PRECISION) -> List[FetchGroup]:
+    """
+    Agrupa os planos por coordenadas arredondadas em `precision` casas decimais.
+    Cada grupo busca a união das janelas dos seus spots (menor início, maior fim),
+    e o resultado é gravado para cada spot_id do grupo.
+    """
+    groups: Dict[Tuple[float, float], FetchGroup] = {}
+    for plan in plans:
+        latitude, longitude = plan.spot.get('latitude'), plan.spot.get('longitude')
+        if latitude is None or longitude is None:
+            # Without coordinates the spot stays alone so process_forecast_group can report it
+            groups[('sem coordenadas', plan.spot.get('spot_id'))] = FetchGroup([plan.spot], latitude, longitude, plan.start_utc, plan.end_utc)
+            continue
+        cell = (round(float(latitude), precision), round(float(longitude), precision))
+        group = groups.get(cell)
+        if group is None:
+            groups[cell] = FetchGroup([plan.spot], latitude, longitude, plan.start_utc, plan.end_utc)
+        else:
+            group.spots.append(plan.spot)
+            group.start_utc = min(group.start_utc, plan.start_utc)
+            group.end_utc = max(group.end_utc, plan.end_utc)
+    return list(groups.values())
@@ -0,0 +1,72 @@
+import json
+from typing import Any, Dict, NamedTuple, Optional
+
+import aiohttp
+
+from src.utils.config import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_CONNECTIONS_PER_HOST
+)
+
+
+class HttpResult(NamedTuple):
+    status: int                # Código HTTP (0 quando a requisição nem chegou a ser respondida)
+    data: Optional[Any]        # JSON decodificado, ou None
+    text: str = ""             # Corpo bruto (truncado) para logs de erro
+
+
+class StormglassHttpClient:
+    """
+    Cliente HTTP assíncrono com pool de conexões keep-alive compartilhado entre todas as
+    requisições da Tarefa 1. Limita conexões totais e por host, separa os timeouts de
+    conexão (só o handshake, sem contar a espera por uma conexão livre do pool) e de leitura
+    e aceita respostas gzip. Deve ser usado com `async with`.
+    """
+    def __init__(
+        self,
+        limit: int = HTTP_MAX_CONNECTIONS,
+        limit_per_host: int = HTTP_MAX_CONNECTIONS_PER_HOST,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        # sock_connect covers only the TCP/TLS handshake; waiting for a free pooled connection
+        # (limit_per_host) stays unbounded so queued requests never time out just by waiting
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers={'Accept-Encoding': 'gzip', 'Accept': 'application/json'},
+            auto_decompress=True,
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def get_json(self, url: str, params: Dict, api_key: str) -> HttpResult:
+        """
+        Faz um GET e decodifica o JSON. Erros HTTP não levantam exceção: o status volta no
+        resultado. Timeouts e falhas de conexão levantam asyncio.TimeoutError / aiohttp.ClientError.
+        """
+        if self._session is None:
+            raise RuntimeError("StormglassHttpClient não inicializado. Use 'async with StormglassHttpClient()'.")
+        # aiohttp só aceita str/int/float na query string (latitude/longitude chegam como Decimal)
+        query = {k: v if isinstance(v, (str, int, float)) else str(v) for k, v in params.items()}
+        async with self._session.get(url, params=query, headers={'Authorization': api_key}) as response:
+            body = await response.read()
+            text = body.decode('utf-8', errors='replace')
+            if response.status == 204 or not body:
+                return HttpResult(response.status, None, "")
+            try:
+                data = json.loads(text)
+            except json.JSONDecodeError:
+                data = None
+            return HttpResult(response.status, data, text[:500])
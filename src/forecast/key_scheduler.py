@@ -0,0 +1,120 @@
+import asyncio
+import time
+from typing import Dict, Iterable, List, Optional
+
+from src.utils.config import (
+    STORMGLASS_DAILY_QUOTA, STORMGLASS_KEY_REQUESTS_PER_SECOND, STORMGLASS_KEY_BURST
+)
+
+# Status com que a Stormglass sinaliza cota diária esgotada / excesso de requisições
+QUOTA_EXHAUSTED_STATUSES = (402, 429)
+# Chave inválida ou revogada: não adianta tentar de novo no mesmo ciclo
+AUTH_ERROR_STATUSES = (401, 403)
+
+
+class TokenBucket:
+    """Token bucket simples: `rate` tokens por segundo, acumulando no máximo `capacity`."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def seconds_until_available(self) -> float:
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class _KeyState:
+    def __init__(self, key: str, daily_quota: Optional[int], rate: float, burst: float):
+        self.key = key
+        self.bucket = TokenBucket(rate, burst)
+        self.daily_quota = daily_quota
+        self.remaining = daily_quota # None = cota desconhecida até a primeira resposta
+        self.in_flight = 0
+        self.used = 0
+        self.failures = 0
+        self.disabled_status: Optional[int] = None
+
+    def headroom(self) -> float:
+        if self.disabled_status is not None:
+            return 0
+        remaining = float('inf') if self.remaining is None else self.remaining
+        return remaining - self.in_flight
+
+
+class ApiKeyScheduler:
+    """
+    Distribui as requisições entre as chaves da Stormglass. Cada chave tem um token bucket
+    (requisições por segundo) e uma estimativa da cota diária restante, atualizada a partir de
+    `meta.requestCount`/`meta.dailyQuota` de cada resposta. Cada requisição vai para a chave
+    com mais folga; chaves sem cota ou recusadas na autenticação deixam de ser usadas até o
+    próximo ciclo.
+    """
+    def __init__(
+        self, keys: Iterable[str],
+        daily_quota: Optional[int] = STORMGLASS_DAILY_QUOTA,
+        requests_per_second: float = STORMGLASS_KEY_REQUESTS_PER_SECOND,
+        burst: float = STORMGLASS_KEY_BURST,
+    ):
+        self._states: Dict[str, _KeyState] = {
+            key: _KeyState(key, daily_quota, requests_per_second, burst) for key in keys
+        }
+
+    def _candidates(self, exclude: Iterable[str]) -> List[_KeyState]:
+        excluded = set(exclude)
+        return [s for s in self._states.values() if s.key not in excluded and s.headroom() > 0]
+
+    async def acquire(self, exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        Reserva uma requisição na chave com mais folga, esperando o token bucket se necessário.
+        Retorna None quando nenhuma chave (fora de `exclude`) tem cota restante.
+        """
+        while True:
+            candidates = self._candidates(exclude)
+            if not candidates:
+                return None
+            # Most quota headroom first; among ties, the least busy key
+            candidates.sort(key=lambda s: (s.headroom(), -s.in_flight, -s.used), reverse=True)
+            for state in candidates:
+                if state.bucket.seconds_until_available() == 0:
+                    state.bucket.consume()
+                    state.in_flight += 1
+                    state.used += 1
+                    return state.key
+            await asyncio.sleep(min(s.bucket.seconds_until_available() for s in candidates))
+
+    def record_response(self, key: str, status: int, data: Optional[Dict]):
+        """Libera a reserva da chave e atualiza a cota com o status e o `meta` da resposta."""
+        state = self._states[key]
+        state.in_flight = max(0, state.in_flight - 1)
+        meta = data.get('meta') if isinstance(data, dict) else None
+        if isinstance(meta, dict) and meta.get('dailyQuota') is not None and meta.get('requestCount') is not None:
+            state.daily_quota = int(meta['dailyQuota'])
+            state.remaining = max(0, int(meta['dailyQuota']) - int(meta['requestCount']))
+        elif state.remaining is not None:
+            state.remaining = max(0, state.remaining - 1)
+        if status in QUOTA_EXHAUSTED_STATUSES:
+            state.remaining = 0
+        if status in AUTH_ERROR_STATUSES and state.disabled_status is None:
+            state.disabled_status = status
+            print(f"AVISO: Chave '...{key[:4]}' recusada com HTTP {status}. Desativada até o próximo ciclo.")
+        if status == 0 or status >= 400:
+            state.failures += 1
+
+    def summary(self) -> str:
+        parts = []
+        for state in self._states.values():
+            remaining = '?' if state.remaining is None else state.remaining
+            disabled = f", desativada (HTTP {state.disabled_status})" if state.disabled_status is not None else ""
+            parts.append(f"...{state.key[:4]}: {state.used} req, {state.failures} falhas, cota restante {remaining}{disabled}")
+        return "; ".join(parts)
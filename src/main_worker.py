@@ -1,89 +1,104 @@
+import argparse
 import asyncio
 import datetime
-import json
-import requests
-from collections import defaultdict
-from typing import List, Dict, Any, Optional
+import math
+import time
+import aiohttp
+from collections import Counter
+from typing import List, Dict, Optional
 import traceback # Import traceback for detailed error logging
 
 # --- Importações ---
 from src.db.connection import init_async_db_pool, close_db_pool
+from src.db.migrations import apply_worker_migrations
+from src.db.partitions import ensure_forecast_partitions, partition_forecasts_table
+from src.db.retention import run_retention_job
 from src.db import queries as worker_queries
-from src.services.scoring_service import calculate_overall_score
-from src.forecast.data_processing import merge_stormglass_data # A função corrigida será usada aqui
+from src.db.cache_writer import RecommendationCacheWriter
+from src.db.forecast_writer import ForecastWriter
+from src.services.recommendation_data import RecommendationSnapshot, preload_recommendation_snapshot
+from src.services.recommendation_service import (
+    build_user_recommendations, build_recommendations_in_process_pool, select_users_for_recompute
+)
+from src.services.scoring_service import ScoreCache
+from src.forecast.http_client import StormglassHttpClient
+from src.forecast.key_scheduler import ApiKeyScheduler
+from src.forecast.fetch_planner import FetchGroup, coalesce_fetch_plans, plan_forecast_fetches
+from src.forecast.data_processing import merge_stormglass_rows # Merge direto para tuplas do COPY
 from src.utils.config import (
     STORMGLASS_API_KEYS, FORECAST_DAYS, WEATHER_API_URL,
-    TIDE_SEA_LEVEL_API_URL, PARAMS_WEATHER_API
+    TIDE_SEA_LEVEL_API_URL, TIDE_EXTREMES_API_URL, PARAMS_WEATHER_API, SCORING_PROCESSES,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
 )
 
 # --- Funções Auxiliares e de Requisição ---
-async def fetch_data_async(api_url: str, params: Dict, api_key: str, label: str) -> Optional[Dict]:
-    print(f"Buscando dados de {label} com a chave terminada em '...{api_key[:4]}'")
-    headers = {'Authorization': api_key}
-    loop = asyncio.get_event_loop()
-    try:
-        # Increased timeout to 30 seconds
-        response = await loop.run_in_executor(
-            None, lambda: requests.get(api_url, headers=headers, params=params, timeout=30)
-        )
-        response.raise_for_status()
+# Respostas que dependem da chave usada: a requisição é reenviada com outra chave
+RETRY_WITH_ANOTHER_KEY_STATUSES = (401, 402, 403, 429)
+# Extremes are fetched with a margin so every hour of the window is bracketed by a high/low (half cycle ~6h12)
+TIDE_EXTREMES_PADDING = datetime.timedelta(hours=12)
+
+async def fetch_data_async(http_client: StormglassHttpClient, key_scheduler: ApiKeyScheduler,
+                           api_url: str, params: Dict, label: str) -> Optional[Dict]:
+    tried_keys = []
+    while True:
+        api_key = await key_scheduler.acquire(exclude=tried_keys)
+        if api_key is None:
+            print(f"ERRO: Nenhuma chave de API com cota disponível para {label}.")
+            return None
+        tried_keys.append(api_key)
+        print(f"Buscando dados de {label} com a chave terminada em '...{api_key[:4]}'")
+
+        try:
+            result = await http_client.get_json(api_url, params, api_key)
+        except asyncio.TimeoutError:
+            key_scheduler.record_response(api_key, 0, None)
+            print(f"ERRO: Timeout ao buscar dados de {label} (conexão {HTTP_CONNECT_TIMEOUT}s / leitura {HTTP_READ_TIMEOUT}s). Tentando outra chave.")
+            continue
+        except aiohttp.ClientError as e:
+            key_scheduler.record_response(api_key, 0, None)
+            print(f"ERRO ao buscar dados de {label}: {e}. Tentando outra chave.")
+            continue
+        except Exception as general_err: # Catch any other unexpected errors
+            key_scheduler.record_response(api_key, 0, None)
+            print(f"ERRO inesperado ao buscar dados de {label}: {general_err}")
+            traceback.print_exc() # Print full traceback for unexpected errors
+            return None
+
+        key_scheduler.record_response(api_key, result.status, result.data)
         # Handle potential empty response body for non-200 but ok statuses (like 204)
-        if response.status_code == 204:
+        if result.status == 204:
             print(f"AVISO: Recebido status 204 (No Content) de {label}. Retornando None.")
             return None
-        # Attempt to parse JSON, handle potential errors
-        try:
-            return response.json()
-        except json.JSONDecodeError as json_err:
-            print(f"ERRO ao decodificar JSON de {label}: {json_err}. Conteúdo: {response.text[:500]}") # Log first 500 chars
+        if result.status in RETRY_WITH_ANOTHER_KEY_STATUSES or result.status >= 500:
+            print(f"AVISO: HTTP {result.status} ao buscar {label} com a chave '...{api_key[:4]}'. Tentando outra chave.")
+            continue
+        if result.status >= 400:
+            # Log more details about the request error
+            print(f"ERRO ao buscar dados de {label}: HTTP {result.status}")
+            print(f"Response Body: {result.text}") # Log first 500 chars
+            return None
+        if result.data is None:
+            print(f"ERRO ao decodificar JSON de {label}. Conteúdo: {result.text}") # Log first 500 chars
             return None
-    except requests.exceptions.Timeout:
-        print(f"ERRO: Timeout ao buscar dados de {label} após 30 segundos.")
-        return None
-    except requests.exceptions.RequestException as e:
-        # Log more details about the request error
-        print(f"ERRO ao buscar dados de {label}: {e}")
-        if e.response is not None:
-            print(f"Status Code: {e.response.status_code}")
-            print(f"Response Body: {e.response.text[:500]}") # Log first 500 chars
-        return None
-    except Exception as general_err: # Catch any other unexpected errors
-        print(f"ERRO inesperado ao buscar dados de {label}: {general_err}")
-        traceback.print_exc() # Print full traceback for unexpected errors
-        return None
-
-
-async def get_preferences_for_user_and_spot(user_id: str, spot_id: int, user_profile: Dict, user_prefs_list: List[Dict]) -> Dict[str, Any]:
-    surf_level = user_profile.get('surf_level', 'intermediario')
-    # Start with generic level preferences
-    final_prefs = await worker_queries.get_generic_preferences_by_level(surf_level)
-    # Layer spot-specific level preferences (overrides generic level prefs)
-    spot_level_prefs = await worker_queries.get_spot_level_preferences(spot_id, surf_level)
-    if spot_level_prefs:
-        final_prefs.update({k: v for k, v in spot_level_prefs.items() if v is not None})
-    # Layer user's specific preferences for this spot (overrides level prefs if active)
-    user_spot_prefs = next((p for p in user_prefs_list if p['spot_id'] == spot_id and p.get('is_active')), None)
-    if user_spot_prefs:
-        final_prefs.update({k: v for k, v in user_spot_prefs.items() if v is not None and k != 'is_active'}) # Exclude is_active itself
-    return final_prefs
+        return result.data
+
 
 # --- Tarefa 1: Atualização de Previsões ---
-async def process_spot_forecast(spot_details: Dict, api_key: str):
+async def process_forecast_group(http_client: StormglassHttpClient, key_scheduler: ApiKeyScheduler,
+                                 forecast_writer: ForecastWriter, group: FetchGroup,
+                                 window_start_utc: datetime.datetime):
     # Ensure required spot details are present
-    spot_id = spot_details.get('spot_id')
-    spot_name = spot_details.get('name', f"Spot Desconhecido (ID: {spot_id})")
-    latitude = spot_details.get('latitude')
-    longitude = spot_details.get('longitude')
-
-    if not all([spot_id, latitude, longitude]):
-        print(f"ERRO: Detalhes incompletos para o spot: {spot_details}. Pulando.")
+    spot_ids = [spot.get('spot_id') for spot in group.spots]
+    spot_name = ", ".join(spot.get('name', f"Spot Desconhecido (ID: {spot.get('spot_id')})") for spot in group.spots)
+    latitude = group.latitude
+    longitude = group.longitude
+    start_utc, end_utc = group.start_utc, group.end_utc
+
+    if not all(spot_ids) or not all([latitude, longitude]):
+        print(f"ERRO: Detalhes incompletos para o(s) spot(s): {group.spots}. Pulando.")
         return
 
-    print(f"\n{'='*20} PROCESSANDO: {spot_name} (ID: {spot_id}) {'='*20}")
-
-    # Define start and end times in UTC
-    start_utc = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    end_utc = start_utc + datetime.timedelta(days=FORECAST_DAYS)
+    print(f"\n{'='*20} PROCESSANDO: {spot_name} (IDs: {spot_ids}) {start_utc:%d/%m %H:%M} -> {end_utc:%d/%m %H:%M} {'='*20}")
 
     # Prepare parameters for API calls
     weather_params = {
@@ -99,11 +114,19 @@ async def process_spot_forecast(spot_details: Dict, api_key: str):
         'start': int(start_utc.timestamp()),
         'end': int(end_utc.timestamp())
     }
+    extremes_start_utc, extremes_end_utc = start_utc - TIDE_EXTREMES_PADDING, end_utc + TIDE_EXTREMES_PADDING
+    tide_extremes_params = {
+        'lat': latitude,
+        'lng': longitude,
+        'start': int(extremes_start_utc.timestamp()),
+        'end': int(extremes_end_utc.timestamp())
+    }
 
     # Fetch data concurrently
-    weather_data, sea_level_data = await asyncio.gather(
-        fetch_data_async(WEATHER_API_URL, weather_params, api_key, f"Tempo para {spot_name}"),
-        fetch_data_async(TIDE_SEA_LEVEL_API_URL, sea_level_params, api_key, f"Nível do mar para {spot_name}")
+    weather_data, sea_level_data, tide_extremes_data = await asyncio.gather(
+        fetch_data_async(http_client, key_scheduler, WEATHER_API_URL, weather_params, f"Tempo para {spot_name}"),
+        fetch_data_async(http_client, key_scheduler, TIDE_SEA_LEVEL_API_URL, sea_level_params, f"Nível do mar para {spot_name}"),
+        fetch_data_async(http_client, key_scheduler, TIDE_EXTREMES_API_URL, tide_extremes_params, f"Extremos de maré para {spot_name}")
     )
 
     # Validate fetched data before merging
@@ -114,21 +137,33 @@ async def process_spot_forecast(spot_details: Dict, api_key: str):
         print(f"ERRO: Dados de nível do mar inválidos ou ausentes para {spot_name}. Pulando merge e inserção.")
         return
 
-    # Merge the data (using the corrected function that accepts dicts)
-    # No output_filename needed here as we process in memory
-    merged = merge_stormglass_data(weather_data, sea_level_data)
+    # Without extremes the tide phase falls back to the hourly sea level heuristic
+    if not tide_extremes_data or not isinstance(tide_extremes_data.get('data'), list):
+        print(f"Aviso: Extremos de maré indisponíveis para {spot_name}. Usando a heurística do nível do mar.")
+        tide_extremes_data = None
+
+    # Merge the data straight into COPY-ready tuples (merge_stormglass_data keeps the dict output for debug files)
+    merged = merge_stormglass_rows(weather_data, sea_level_data, tide_extremes_data=tide_extremes_data)
 
     if not merged:
         print(f"ERRO: Falha ao mesclar dados para {spot_name}. Pulando inserção.")
         return
 
-    # Insert merged data into the database
-    try:
-        await worker_queries.insert_forecast_data(spot_id, merged)
-        print(f"--- SUCESSO: Dados para {spot_name} (ID: {spot_id}) processados e inseridos. ---")
-    except Exception as db_err:
-        print(f"ERRO ao inserir dados no banco para {spot_name} (ID: {spot_id}): {db_err}")
-        traceback.print_exc()
+    # A fetch starting at the window start refreshes the whole window; tail fetches only extend the horizon
+    fetched_at = datetime.datetime.now(datetime.timezone.utc)
+    covers_window = start_utc <= window_start_utc
+
+    # Fan the merged rows out to every spot of the grid cell; the writer flushes multi-spot batches as they fill
+    for spot in group.spots:
+        spot_id = spot['spot_id']
+        try:
+            await forecast_writer.add(spot_id, merged, window_fetched_at=fetched_at if covers_window else None)
+            if tide_extremes_data:
+                await worker_queries.insert_extreme_tides_data(spot_id, tide_extremes_data['data'], extremes_start_utc, extremes_end_utc)
+            print(f"--- SUCESSO: Dados para {spot.get('name', spot_id)} (ID: {spot_id}) processados e enfileirados para gravação. ---")
+        except Exception as db_err:
+            print(f"ERRO ao inserir dados no banco para {spot.get('name', spot_id)} (ID: {spot_id}): {db_err}")
+            traceback.print_exc()
 
 
 async def update_all_forecasts():
@@ -148,175 +183,152 @@ async def update_all_forecasts():
         print("Nenhum spot encontrado no banco de dados. Abortando Tarefa 1.")
         return
 
-    print(f"Encontrados {len(all_spots)} spots para atualizar usando {len(STORMGLASS_API_KEYS)} chaves.")
-    # Create tasks for processing each spot
-    tasks = []
-    for i, spot in enumerate(all_spots):
-        api_key = STORMGLASS_API_KEYS[i % len(STORMGLASS_API_KEYS)] # Rotate API keys
-        tasks.append(process_spot_forecast(spot, api_key))
+    # Define start and end times in UTC
+    now_utc = datetime.datetime.now(datetime.timezone.utc)
+    start_utc = now_utc.replace(hour=0, minute=0, second=0, microsecond=0)
+    end_utc = start_utc + datetime.timedelta(days=FORECAST_DAYS)
+
+    # Skip spots whose stored forecast is still fresh and fetch only the missing tail of the others
+    try:
+        freshness = await worker_queries.get_forecast_freshness([spot['spot_id'] for spot in all_spots])
+    except Exception as e:
+        print(f"Aviso: não foi possível verificar o frescor das previsões ({e}). Buscando todos os spots.")
+        freshness = {}
+    fetch_plans, fresh_spots = plan_forecast_fetches(all_spots, freshness, start_utc, end_utc, now_utc)
+    reasons = Counter(plan.reason for plan in fetch_plans)
+    print(f"Planejamento: {len(fetch_plans)} spots para buscar ({dict(reasons)}), {len(fresh_spots)} pulados por estarem frescos.")
+    if not fetch_plans:
+        print("\n--- TAREFA 1 CONCLUÍDA: NENHUM SPOT PRECISAVA DE ATUALIZAÇÃO ---")
+        return
+
+    # Spots in the same grid cell share one set of requests (weather, sea level, extremes)
+    fetch_groups = coalesce_fetch_plans(fetch_plans)
+    saved_calls = 3 * (len(fetch_plans) - len(fetch_groups))
+    print(f"Encontrados {len(fetch_plans)} spots em {len(fetch_groups)} células da grade para atualizar usando {len(STORMGLASS_API_KEYS)} chaves ({saved_calls} chamadas à API economizadas).")
+    # Requests are routed per key by quota headroom and rate limit instead of a fixed rotation
+    key_scheduler = ApiKeyScheduler(STORMGLASS_API_KEYS)
+    # One keep-alive connection pool shared by every request of this task
+    async with StormglassHttpClient() as http_client, ForecastWriter() as forecast_writer:
+        # Create tasks for processing each spot
+        tasks = [process_forecast_group(http_client, key_scheduler, forecast_writer, group, start_utc) for group in fetch_groups]
 
-    # Run tasks concurrently
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Run tasks concurrently
+        results = await asyncio.gather(*tasks, return_exceptions=True)
 
     # Log any exceptions that occurred during task execution
     for i, result in enumerate(results):
         if isinstance(result, Exception):
-            spot_name = all_spots[i].get('name', f"Spot ID {all_spots[i].get('spot_id')}")
+            spot_name = ", ".join(spot.get('name', f"Spot ID {spot.get('spot_id')}") for spot in fetch_groups[i].spots)
             print(f"ERRO durante o processamento do spot {spot_name}: {result}")
             # Optionally log the full traceback for exceptions
             # traceback.print_exception(type(result), result, result.__traceback__)
 
+    print(f"\nUso das chaves de API: {key_scheduler.summary()}")
     print("\n--- TAREFA 1 CONCLUÍDA: TODAS AS PREVISÕES FORAM ATUALIZADAS (ou tentativas foram feitas) ---")
 
 
 # --- Tarefa 2: Cálculo de Scores Personalizados ---
 
-async def calculate_and_save_for_config(
-    user_id: str, user_profile: Dict, user_prefs_list: List[Dict],
-    spot_ids: List[int], day_offsets: List[int], time_window: tuple,
-    cache_key: str
-):
-    """Calcula e salva recomendações para uma configuração específica (preset, hoje, amanhã)."""
-    print(f"  - Calculando para config: '{cache_key}' (Dias: {day_offsets}, Spots: {spot_ids})...")
-
-    # Validate inputs
-    if not spot_ids:
-        print(f"    -> Aviso: Lista de spot_ids vazia para '{cache_key}'. Pulando.")
-        return
-    if not day_offsets:
-        print(f"    -> Aviso: Lista de day_offsets vazia para '{cache_key}'. Pulando.")
-        return
-    if not isinstance(time_window, tuple) or len(time_window) != 2 or not all(isinstance(t, datetime.time) for t in time_window):
-         print(f"    -> ERRO: time_window inválido para '{cache_key}'. Esperado (time, time), recebido: {time_window}. Pulando.")
-         return
-
-
-    start_utc = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    try:
-        # Calculate end_utc based on the maximum offset required
-        end_utc = start_utc + datetime.timedelta(days=(max(day_offsets) + 1))
-    except ValueError: # Handle empty day_offsets case although checked above
-         print(f"    -> ERRO: Lista de day_offsets inválida ou vazia para '{cache_key}'. Pulando.")
-         return
-
+async def _save_user_payloads(user_id: str, payloads: Dict[str, List[Dict]], cache_writer: RecommendationCacheWriter):
+    for cache_key, final_response in payloads.items():
+        # Queue for the batched cache write if recommendations were found
+        if final_response:
+            await cache_writer.add(user_id, cache_key, final_response)
+            print(f"    -> Cache para '{cache_key}' enfileirado para gravação ({len(final_response)} dias).")
+        else:
+            print(f"    -> Nenhuma recomendação encontrada para '{cache_key}'. Cache não salvo.")
+
+
+def _resolve_preset_offsets(user_job: Dict) -> List[int]:
+    """Converte a seleção de dias do preset em offsets de dia a partir de hoje (UTC)."""
+    preset_name = user_job.get('name', 'Preset Desconhecido')
+    # --- CORRIGIDA: LÓGICA DE WEEKDAYS PARA OFFSETS ---
+    day_selection_type = user_job.get('day_selection_type')
+    day_selection_values = user_job.get('day_selection_values', [])
+    preset_offsets = []
+
+    if day_selection_type == 'offsets':
+        # Filter for valid non-negative integer offsets
+        preset_offsets = [int(v) for v in day_selection_values if isinstance(v, (int, float)) and v >= 0]
+    elif day_selection_type == 'weekdays':
+         # Convert frontend weekdays (0=Sun) to Python's weekday() standard (0=Mon, 6=Sun)
+         # Frontend 0 (Sun) -> Python 6
+         # Frontend 1 (Mon) -> Python 0
+         # ...
+         # Frontend 6 (Sat) -> Python 5
+        python_weekdays = { (d - 1 + 7) % 7 if d > 0 else 6 for d in day_selection_values if isinstance(d, int) and 0 <= d <= 6 } # Use set for efficiency
+
+        if not python_weekdays:
+             print(f"  -> Aviso: Valores de weekdays inválidos para preset '{preset_name}'. Usando offset 0.")
+        else:
+            today_utc_weekday = datetime.datetime.now(datetime.timezone.utc).weekday() # 0 = Mon, ..., 6 = Sun
+            for i in range(7): # Check next 7 days (0 to 6)
+                future_day_weekday = (today_utc_weekday + i) % 7
+                if future_day_weekday in python_weekdays:
+                    preset_offsets.append(i) # Add the offset if the future day matches selected weekdays
+    else:
+         print(f"  -> Aviso: day_selection_type inválido ('{day_selection_type}') para preset '{preset_name}'. Usando offset 0.")
 
-    daily_options = defaultdict(list)
-    processed_spots = 0
 
-    # Fetch forecasts and calculate scores for each spot
-    for spot_id in spot_ids:
-        try:
-            spot_details, spot_forecasts = await asyncio.gather(
-                worker_queries.get_spot_by_id(spot_id),
-                worker_queries.get_forecasts_for_spot(spot_id, start_utc, end_utc)
-            )
+    # Ensure preset_offsets has at least today if calculation failed or resulted empty
+    if not preset_offsets:
+        print(f"  -> Aviso: Nenhum dia válido após cálculo para preset '{preset_name}'. Usando offset 0 (hoje).")
+        preset_offsets = [0]
+    # --- FIM DA CORREÇÃO ---
+    return preset_offsets
 
-            # Get combined preferences for this user/spot
-            user_prefs = await get_preferences_for_user_and_spot(user_id, spot_id, user_profile, user_prefs_list)
-
-            if not spot_details:
-                print(f"    -> Aviso: Detalhes não encontrados para spot ID {spot_id}. Pulando.")
-                continue
-            if not spot_forecasts:
-                # print(f"    -> Info: Nenhuma previsão encontrada para spot ID {spot_id} no período solicitado.")
-                continue # It's normal not to have forecasts for all days requested
-
-            processed_spots += 1
-            spot_name = spot_details.get('name', f"Spot {spot_id}")
-
-            # Iterate through hourly forecasts for the spot
-            for forecast in spot_forecasts:
-                forecast_dt_utc = forecast.get('timestamp_utc')
-                if not forecast_dt_utc:
-                    print(f"    -> Aviso: Previsão sem timestamp_utc para spot {spot_id}. Pulando hora.")
-                    continue
-
-                forecast_date = forecast_dt_utc.date()
-                forecast_time_utc = forecast_dt_utc.time()
-                current_day_offset = (forecast_date - start_utc.date()).days
-
-                # Check if the forecast falls within the desired days and time window
-                if current_day_offset in day_offsets and time_window[0] <= forecast_time_utc <= time_window[1]:
-
-                    # Calculate scores for this specific hour
-                    try:
-                        score_data = await calculate_overall_score(forecast, user_prefs, spot_details, user_profile)
-                    except Exception as score_err:
-                        print(f"    -> ERRO ao calcular score para {spot_name} às {forecast_dt_utc}: {score_err}")
-                        traceback.print_exc()
-                        continue # Skip this hour if scoring fails
-
-                    # Add to potential recommendations if score is above threshold
-                    if score_data.get('overall_score', 0) > 30:
-                        daily_options[forecast_date].append({
-                            "spot_id": spot_id,
-                            "spot_name": spot_name,
-                            "timestamp_utc": forecast_dt_utc,
-                            "forecast_conditions": forecast, # Include full forecast data
-                            **score_data # Includes overall_score and detailed_scores
-                        })
-
-        except Exception as spot_proc_err:
-            print(f"    -> ERRO ao processar spot ID {spot_id} para '{cache_key}': {spot_proc_err}")
-            traceback.print_exc()
-            continue # Continue to the next spot if one fails
-
-    print(f"    -> Processados forecasts para {processed_spots}/{len(spot_ids)} spots.")
-
-    # --- FORMAT AND SAVE RESULTS ---
-    final_response = []
-    # Sort dates to ensure consistent order in cache
-    for date in sorted(daily_options.keys()):
-        hourly_recs = daily_options[date]
-        if not hourly_recs: continue # Skip if no valid recs for this date
-
-        # Find the best hour for each spot on this date
-        best_spot_sessions = {}
-        for rec in hourly_recs:
-            sid = rec['spot_id']
-            # If spot not seen yet, or current hour has better score, update best session
-            if sid not in best_spot_sessions or rec['overall_score'] > best_spot_sessions[sid]['best_overall_score']:
-                best_spot_sessions[sid] = {
-                    "spot_id": sid,
-                    "spot_name": rec['spot_name'],
-                    "best_hour_utc": rec['timestamp_utc'], # Store the timestamp object directly
-                    "best_overall_score": rec['overall_score'],
-                    "detailed_scores": rec['detailed_scores'],
-                    "forecast_conditions": rec['forecast_conditions'] # Store conditions for the best hour
-                }
-
-        if not best_spot_sessions: continue # Skip day if no spots had valid scores
-
-        # Rank spots for the day based on their best score
-        ranked_spots = sorted(best_spot_sessions.values(), key=lambda x: x['best_overall_score'], reverse=True)
-
-        # Convert datetime objects to ISO strings *before* saving to cache
-        for spot_summary in ranked_spots:
-             if isinstance(spot_summary['best_hour_utc'], datetime.datetime):
-                 spot_summary['best_hour_utc'] = spot_summary['best_hour_utc'].isoformat()
-             # Convert forecast conditions timestamps too
-             fc = spot_summary.get('forecast_conditions', {})
-             if fc and isinstance(fc.get('timestamp_utc'), datetime.datetime):
-                  fc['timestamp_utc'] = fc['timestamp_utc'].isoformat()
-
-
-        # Format date as string for JSON compatibility
-        final_response.append({"date": date.isoformat(), "ranked_spots": ranked_spots})
-
-    # Save to cache if recommendations were found
-    if final_response:
-        try:
-            await worker_queries.save_recommendation_cache(user_id, cache_key, final_response)
-            print(f"    -> Cache para '{cache_key}' salvo com sucesso ({len(final_response)} dias).")
-        except Exception as cache_err:
-            print(f"    -> ERRO ao salvar cache para '{cache_key}': {cache_err}")
-            traceback.print_exc()
-    else:
-        print(f"    -> Nenhuma recomendação encontrada para '{cache_key}'. Cache não salvo.")
 
-
-async def calculate_all_user_recommendations():
+async def process_user_recommendations(
+    user_job: Dict, preset_offsets: List[int],
+    score_cache: ScoreCache, snapshot: RecommendationSnapshot,
+    cache_writer: RecommendationCacheWriter
+) -> bool:
+    """Calcula e salva as recomendações de um único usuário. Retorna True se o usuário foi processado."""
+    try:
+        payloads = build_user_recommendations(user_job, preset_offsets, score_cache, snapshot)
+        if payloads is None:
+            return False
+        await _save_user_payloads(user_job['user_id'], payloads, cache_writer)
+        return True
+
+    except Exception as user_proc_err:
+        print(f"  -> ERRO CRÍTICO ao processar usuário {user_job['user_id']} (Preset: '{user_job.get('name', 'Preset Desconhecido')}'): {user_proc_err}")
+        traceback.print_exc()
+        # Continue to the next user even if one fails
+        return False
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil pelo método nearest-rank sobre uma lista já ordenada."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+async def _run_users(user_jobs: List[Dict], preset_offsets_by_user: Dict[str, List[int]],
+                     score_cache: ScoreCache, snapshot: RecommendationSnapshot,
+                     cache_writer: RecommendationCacheWriter) -> tuple:
+    """
+    Processa os usuários em sequência. O cálculo é CPU puro e segura o GIL, então vários
+    workers no mesmo loop não se sobrepõem; o paralelismo da Tarefa 2 vem de SCORING_PROCESSES
+    e as gravações já saem em lotes pelo cache_writer.
+    Retorna (ids dos usuários processados, latências em segundos).
+    """
+    latencies = []
+    processed_user_ids = []
+    for user_job in user_jobs:
+        started = time.perf_counter()
+        if await process_user_recommendations(user_job, preset_offsets_by_user[user_job['user_id']], score_cache, snapshot, cache_writer):
+            processed_user_ids.append(user_job['user_id'])
+        latencies.append(time.perf_counter() - started)
+    return processed_user_ids, latencies
+
+
+async def calculate_all_user_recommendations(scoring_processes: int = SCORING_PROCESSES, full: bool = False):
     print("\n--- INICIANDO TAREFA 2: CÁLCULO DE SCORES PERSONALIZADOS ---")
+    # Forecast changes after this instant are picked up by the next cycle
+    computed_at = datetime.datetime.now(datetime.timezone.utc)
     try:
         users_to_process = await worker_queries.get_all_active_users_with_presets()
     except Exception as e:
@@ -329,124 +341,116 @@ async def calculate_all_user_recommendations():
         return
     print(f"Encontrados {len(users_to_process)} usuários ativos com presets para processar.")
 
-    processed_user_count = 0
-    # Process recommendations for each user
+    # Resolve every preset's day offsets up front so the preload covers the widest window
+    preset_offsets_by_user = {}
+    for user_job in users_to_process:
+        if user_job.get('user_id'):
+            preset_offsets_by_user[user_job['user_id']] = _resolve_preset_offsets(user_job)
+    max_offset = max([1, *(max(offsets) for offsets in preset_offsets_by_user.values())])
+
+    start_utc = computed_at.replace(hour=0, minute=0, second=0, microsecond=0)
+    end_utc = start_utc + datetime.timedelta(days=(max_offset + 1))
+    try:
+        snapshot = await preload_recommendation_snapshot(
+            user_ids=preset_offsets_by_user.keys(),
+            spot_ids=(spot_id for user_job in users_to_process for spot_id in (user_job.get('spot_ids') or [])),
+            start_utc=start_utc,
+            end_utc=end_utc,
+            time_windows=[(user_job.get('start_time'), user_job.get('end_time')) for user_job in users_to_process]
+        )
+    except Exception as e:
+        print(f"ERRO ao pré-carregar dados para o cálculo de recomendações: {e}")
+        traceback.print_exc()
+        return
+
+    # Hashes of the stored payloads, used to skip rewriting unchanged cache entries
+    try:
+        known_hashes = await worker_queries.get_recommendation_cache_hashes()
+    except Exception as e:
+        print(f"AVISO: Não foi possível carregar os hashes do cache ({e}). Todas as entradas serão regravadas.")
+        known_hashes = {}
+
+    score_cache = ScoreCache() # Shared by every user and config during this cycle
+    user_jobs = []
     for user_job in users_to_process:
-        user_id = user_job.get('user_id')
-        preset_name = user_job.get('name', 'Preset Desconhecido')
-        if not user_id:
+        if not user_job.get('user_id'):
              print("  - Aviso: Encontrado job de usuário sem user_id. Pulando.")
              continue
+        user_jobs.append(user_job)
 
-        print(f"\nProcessando recomendações para o usuário: {user_id} (Preset: '{preset_name}')")
+    # Only users whose inputs, dates or forecasts changed since their last computation are recomputed
+    try:
+        states = {} if full else await worker_queries.get_user_recommendation_states()
+    except Exception as e:
+        print(f"AVISO: Não foi possível carregar o estado do último cálculo ({e}). Todos os usuários serão recalculados.")
+        states = {}
+    user_jobs, reasons = select_users_for_recompute(user_jobs, preset_offsets_by_user, snapshot, states, full=full)
+    print(f"Usuários a recalcular: {len(user_jobs)} ({dict(Counter(reasons.values()))}); "
+          f"{len(users_to_process) - len(user_jobs)} sem mudanças desde o último cálculo.")
+    if not user_jobs:
+        print("\n--- TAREFA 2 CONCLUÍDA: NENHUM USUÁRIO PRECISAVA DE RECÁLCULO ---")
+        return
 
-        try:
-            # Fetch user profile and preferences list
-            user_profile, user_prefs_list = await worker_queries.get_full_user_details(user_id)
-            if not user_profile:
-                print(f"  - Aviso: Perfil não encontrado para usuário {user_id}. Pulando.")
-                continue
-
-            # --- CORRIGIDA: LÓGICA DE WEEKDAYS PARA OFFSETS ---
-            day_selection_type = user_job.get('day_selection_type')
-            day_selection_values = user_job.get('day_selection_values', [])
-            preset_offsets = []
-
-            if day_selection_type == 'offsets':
-                # Filter for valid non-negative integer offsets
-                preset_offsets = [int(v) for v in day_selection_values if isinstance(v, (int, float)) and v >= 0]
-            elif day_selection_type == 'weekdays':
-                 # Convert frontend weekdays (0=Sun) to Python's weekday() standard (0=Mon, 6=Sun)
-                 # Frontend 0 (Sun) -> Python 6
-                 # Frontend 1 (Mon) -> Python 0
-                 # ...
-                 # Frontend 6 (Sat) -> Python 5
-                python_weekdays = { (d - 1 + 7) % 7 if d > 0 else 6 for d in day_selection_values if isinstance(d, int) and 0 <= d <= 6 } # Use set for efficiency
-
-                if not python_weekdays:
-                     print(f"  -> Aviso: Valores de weekdays inválidos para preset '{preset_name}'. Usando offset 0.")
-                else:
-                    today_utc_weekday = datetime.datetime.now(datetime.timezone.utc).weekday() # 0 = Mon, ..., 6 = Sun
-                    for i in range(7): # Check next 7 days (0 to 6)
-                        future_day_weekday = (today_utc_weekday + i) % 7
-                        if future_day_weekday in python_weekdays:
-                            preset_offsets.append(i) # Add the offset if the future day matches selected weekdays
-            else:
-                 print(f"  -> Aviso: day_selection_type inválido ('{day_selection_type}') para preset '{preset_name}'. Usando offset 0.")
-
-
-            # Ensure preset_offsets has at least today if calculation failed or resulted empty
-            if not preset_offsets:
-                print(f"  -> Aviso: Nenhum dia válido após cálculo para preset '{preset_name}'. Usando offset 0 (hoje).")
-                preset_offsets = [0]
-            # --- FIM DA CORREÇÃO ---
-
-            # Validate spot_ids and time_window
-            spot_ids = user_job.get('spot_ids', [])
-            start_time = user_job.get('start_time')
-            end_time = user_job.get('end_time')
-
-            if not spot_ids:
-                 print(f"  -> Aviso: Nenhum spot_id encontrado para preset '{preset_name}'. Pulando cálculo para este preset.")
-                 continue
-            if not isinstance(start_time, datetime.time) or not isinstance(end_time, datetime.time):
-                 print(f"  -> ERRO: start_time ou end_time inválidos para preset '{preset_name}'. Recebido start: {start_time}, end: {end_time}. Pulando.")
-                 continue
-
-            # Define configurations to calculate (today, tomorrow, and the user's default preset)
-            configs = {
-                "today": {"day_offsets": [0]},
-                "tomorrow": {"day_offsets": [1]},
-                preset_name: {"day_offsets": preset_offsets} # Use calculated offsets for the preset
-            }
-
-            # Calculate and save for each configuration
-            config_tasks = []
-            for key, config in configs.items():
-                # Ensure day_offsets is not empty before creating the task
-                if config['day_offsets']:
-                    config_tasks.append(
-                        calculate_and_save_for_config(
-                            user_id, user_profile, user_prefs_list,
-                            spot_ids=spot_ids,
-                            day_offsets=config['day_offsets'],
-                            time_window=(start_time, end_time),
-                            cache_key=key
-                        )
-                    )
-                else:
-                     print(f"    -> Aviso: Configuração '{key}' pulada devido a day_offsets vazio.")
-
-
-            if config_tasks:
-                await asyncio.gather(*config_tasks)
-            else:
-                print(f"  -> Nenhuma configuração válida para calcular para o usuário {user_id}.")
-
-            processed_user_count += 1
-
-        except Exception as user_proc_err:
-            print(f"  -> ERRO CRÍTICO ao processar usuário {user_id} (Preset: '{preset_name}'): {user_proc_err}")
-            traceback.print_exc()
-            # Continue to the next user even if one fails
+    # Payloads are buffered and written in batches; the writer flushes what is left on exit
+    async with RecommendationCacheWriter(
+        known_hashes=known_hashes, payload_version=snapshot.payload_version, forecast_store=snapshot.forecast_store
+    ) as cache_writer:
+        if scoring_processes > 1:
+            # Shard the CPU-bound scoring across processes; only ranked payloads come back to be written here
+            print(f"Calculando recomendações em {scoring_processes} processos.")
+            results = await build_recommendations_in_process_pool(
+                user_jobs, preset_offsets_by_user, snapshot, scoring_processes, score_cache
+            )
+            latencies = [seconds for _, _, seconds in results]
+            for user_id, payloads, _ in results:
+                if payloads is not None:
+                    await _save_user_payloads(user_id, payloads, cache_writer)
+            processed_user_ids = [user_id for user_id, payloads, _ in results if payloads is not None]
+        else:
+            processed_user_ids, latencies = await _run_users(
+                user_jobs, preset_offsets_by_user, score_cache, snapshot, cache_writer
+            )
+
+    # Record the computation only for users whose cache entries were all written
+    jobs_by_user = {user_job['user_id']: user_job for user_job in user_jobs}
+    state_records = [
+        (user_id, snapshot.user_inputs_fingerprint(jobs_by_user[user_id]), computed_at)
+        for user_id in processed_user_ids if user_id not in cache_writer.failed_users
+    ]
+    try:
+        await worker_queries.save_user_recommendation_states(state_records)
+    except Exception as e:
+        print(f"ERRO ao gravar o estado do cálculo de recomendações: {e}")
+        traceback.print_exc()
 
-    print(f"\n--- TAREFA 2 CONCLUÍDA: Recomendações processadas para {processed_user_count}/{len(users_to_process)} usuários ---")
+    if latencies:
+        latencies.sort()
+        print(f"Latência por usuário: p50={_percentile(latencies, 50) * 1000:.1f}ms "
+              f"p90={_percentile(latencies, 90) * 1000:.1f}ms p99={_percentile(latencies, 99) * 1000:.1f}ms "
+              f"max={latencies[-1] * 1000:.1f}ms")
+    print(f"Cache de scores: {score_cache.summary()}")
+    print(f"\n--- TAREFA 2 CONCLUÍDA: Recomendações processadas para {len(processed_user_ids)}/{len(user_jobs)} usuários selecionados ({len(users_to_process)} ativos) ---")
 
 
 # --- Orquestrador Principal (main) ---
-async def main():
+async def main(scoring_processes: int = SCORING_PROCESSES, full: bool = False, partition_forecasts: bool = False):
     start_time = datetime.datetime.now()
     print(f"[{start_time.strftime('%Y-%m-%d %H:%M:%S')}] Iniciando ciclo do TheCheck Worker...")
     try:
         await init_async_db_pool()
         print("Pool de conexões inicializado.")
+        await apply_worker_migrations()
+        if partition_forecasts:
+            await partition_forecasts_table()
+        # Partitions must exist up to the forecast horizon before Task 1 writes into them
+        await ensure_forecast_partitions()
 
         # Executa as tarefas principais
         await update_all_forecasts()
-        await calculate_all_user_recommendations()
+        await calculate_all_user_recommendations(scoring_processes, full)
 
         # Limpeza de dados antigos (executa mesmo se as tarefas anteriores falharem)
-        await worker_queries.delete_old_forecast_data(7)
+        await run_retention_job()
 
     except Exception as e:
         print(f"\nERRO CRÍTICO NO WORKER (ciclo principal): {e}")
@@ -458,6 +462,23 @@ async def main():
         duration = end_time - start_time
         print(f"[{end_time.strftime('%Y-%m-%d %H:%M:%S')}] Ciclo do worker concluído. Duração: {duration}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ciclo do TheCheck Worker (previsões, recomendações e limpeza).")
+    parser.add_argument(
+        "--workers", type=int, default=SCORING_PROCESSES,
+        help="Processos usados no cálculo das recomendações (0 ou 1 = processo único). Padrão: SCORING_PROCESSES."
+    )
+    parser.add_argument(
+        "--full", action="store_true",
+        help="Recalcula as recomendações de todos os usuários, ignorando o estado do último cálculo."
+    )
+    parser.add_argument(
+        "--partition-forecasts", action="store_true",
+        help="Converte forecasts em tabela particionada por FORECAST_PARTITION_INTERVAL antes do ciclo (migração única)."
+    )
+    return parser.parse_args()
+
 if __name__ == "__main__":
     # Roda o ciclo principal do worker
-    asyncio.run(main())
\ No newline at end of file
+    args = parse_args()
+    asyncio.run(main(scoring_processes=args.workers, full=args.full, partition_forecasts=args.partition_forecasts))
\ No newline at end of file
@@ -0,0 +1,251 @@
+import datetime
+import math
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from src.services.scoring_service import SCORING_COLUMN_DEFAULTS, TIDE_TYPE_CODES
+
+# Medidas ficam em float64: o score vetorizado já trabalha em float64 (float(Decimal)), e
+# guardar em float32 mudaria os scores e os payloads gravados no cache.
+TIDE_TYPES_BY_CODE = {code: tide_type for tide_type, code in TIDE_TYPE_CODES.items()}
+NO_TIMESTAMP = np.iinfo(np.int64).min
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _epoch_seconds(moment: datetime.datetime) -> int:
+    return (moment - EPOCH) // datetime.timedelta(seconds=1)
+
+def _epoch_microseconds(moment: datetime.datetime) -> int:
+    return (moment - EPOCH) // datetime.timedelta(microseconds=1)
+
+def _column_kind(values: List[Any]) -> Tuple[str, Optional[int]]:
+    """
+    Escolhe como guardar uma coluna: ('decimal', casas), ('float', None), ('datetime', None),
+    ('tide', None) ou ('object', None) quando a conversão não for reversível sem perdas.
+    """
+    present = [value for value in values if value is not None]
+    if not present:
+        return 'object', None
+    if all(isinstance(value, Decimal) and value.is_finite() for value in present):
+        scales = {value.as_tuple().exponent for value in present}
+        if len(scales) == 1 and next(iter(scales)) <= 0:
+            return 'decimal', -next(iter(scales))
+    elif all(isinstance(value, float) and math.isfinite(value) for value in present):
+        return 'float', None
+    elif all(isinstance(value, datetime.datetime) and value.tzinfo == datetime.timezone.utc for value in present):
+        return 'datetime', None
+    elif all(isinstance(value, str) and value in TIDE_TYPE_CODES for value in present):
+        return 'tide', None
+    return 'object', None
+
+
+@dataclass
+class SpotForecasts:
+    """Janela de previsões de um spot em colunas contíguas, ordenadas por timestamp_utc."""
+    spot_id: int
+    timestamps: np.ndarray  # int64, segundos desde a época
+    columns: Dict[str, Any]  # nome -> np.ndarray ou lista (colunas 'object')
+    kinds: Dict[str, Tuple[str, Optional[int]]]
+    column_order: Tuple[str, ...]
+    hour_starts: Optional[np.ndarray] = None  # hour_starts[h]: primeira linha com ts >= origem + h horas
+    scoring_columns: Dict[str, np.ndarray] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.timestamps, *self.columns.values(), *self.scoring_columns.values()]
+        if self.hour_starts is not None:
+            arrays.append(self.hour_starts)
+        # Scoring columns reuse the stored arrays; count each one once
+        unique = {id(array): array for array in arrays if isinstance(array, np.ndarray)}
+        return sum(array.nbytes for array in unique.values())
+
+
+class ForecastStore:
+    """
+    Previsões da Tarefa 2 em formato colunar, carregadas uma vez por ciclo. Cada spot guarda
+    timestamps int64 (segundos desde a época), medidas float64, fases de maré uint8 e um índice
+    por hora a partir de `origin_utc`, que resolve em O(1) a fatia de linhas de um
+    (spot, dia, janela de horário). As linhas em dict só são remontadas para as horas que
+    entram nos payloads (`conditions`).
+    """
+
+    def __init__(self, origin_utc: datetime.datetime, spots: Optional[Dict[int, SpotForecasts]] = None):
+        # Day offsets count from midnight UTC, like the dates compared in the recommendation loop
+        self.origin_utc = origin_utc.astimezone(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.origin = _epoch_seconds(self.origin_utc)
+        self.spots: Dict[int, SpotForecasts] = spots or {}
+
+    @classmethod
+    def from_rows(cls, forecasts_by_spot: Mapping[int, Iterable[Mapping[str, Any]]], origin_utc: datetime.datetime) -> 'ForecastStore':
+        """Monta o store a partir das linhas {spot_id: [linha, ...]} retornadas pelo banco."""
+        store = cls(origin_utc)
+        for spot_id, rows in forecasts_by_spot.items():
+            rows = sorted(rows, key=lambda row: row['timestamp_utc'])
+            if rows:
+                store.spots[spot_id] = store._build_spot(spot_id, rows)
+        return store
+
+    def _build_spot(self, spot_id: int, rows: List[Mapping[str, Any]]) -> SpotForecasts:
+        column_order = tuple(rows[0].keys())
+        timestamps = np.array([_epoch_seconds(row['timestamp_utc']) for row in rows], dtype=np.int64)
+        columns, kinds = {}, {}
+        for column in column_order:
+            if column in ('spot_id', 'timestamp_utc'):
+                continue
+            values = [row.get(column) for row in rows]
+            kind = _column_kind(values)
+            if kind[0] in ('decimal', 'float'):
+                columns[column] = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+            elif kind[0] == 'datetime':
+                columns[column] = np.array([NO_TIMESTAMP if v is None else _epoch_microseconds(v) for v in values], dtype=np.int64)
+            elif kind[0] == 'tide':
+                columns[column] = np.array([TIDE_TYPE_CODES.get(v, 0) for v in values], dtype=np.uint8)
+            else:
+                columns[column] = values
+            kinds[column] = kind
+
+        spot = SpotForecasts(spot_id, timestamps, columns, kinds, column_order)
+        spot.scoring_columns = self._scoring_columns(spot, rows)
+        offsets = timestamps - self.origin
+        if len(timestamps) and np.all(offsets % 3600 == 0):
+            hours = max(0, int(offsets[-1]) // 3600) + 2
+            spot.hour_starts = np.searchsorted(timestamps, self.origin + np.arange(hours, dtype=np.int64) * 3600, side='left')
+        return spot
+
+    @staticmethod
+    def _scoring_columns(spot: SpotForecasts, rows: List[Mapping[str, Any]]) -> Dict[str, np.ndarray]:
+        """Colunas no formato de forecasts_to_columns, reaproveitando os arrays já guardados."""
+        scoring = {}
+        for column, default in SCORING_COLUMN_DEFAULTS.items():
+            if spot.kinds.get(column, ('',))[0] in ('decimal', 'float'):
+                scoring[column] = spot.columns[column]
+            elif column not in spot.column_order:
+                scoring[column] = np.full(len(rows), float(default), dtype=np.float64)
+            else:
+                values = [row.get(column, default) for row in rows]
+                scoring[column] = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+        if spot.kinds.get('tide_type', ('',))[0] == 'tide':
+            scoring['tide_type'] = spot.columns['tide_type']
+        else:
+            scoring['tide_type'] = np.array([TIDE_TYPE_CODES.get(row.get('tide_type', ''), 0) for row in rows], dtype=np.uint8)
+        return scoring
+
+    # --- Leitura ---
+    def spot_columns(self, spot_id: int) -> Dict[str, np.ndarray]:
+        """Colunas usadas pelo score vetorizado (as mesmas de forecasts_to_columns)."""
+        return self.spots[spot_id].scoring_columns
+
+    def row_count(self, spot_id: int) -> int:
+        spot = self.spots.get(spot_id)
+        return len(spot) if spot else 0
+
+    def window_slice(self, spot_id: int, day_offset: int, time_window: Tuple[datetime.time, datetime.time]) -> slice:
+        """
+        Fatia das linhas do spot no dia `day_offset` (contado a partir de origin_utc) com horário
+        UTC em [start_time, end_time], inclusive nas duas pontas.
+        """
+        spot = self.spots.get(spot_id)
+        if spot is None:
+            return slice(0, 0)
+        start_time, end_time = time_window
+        day_start = day_offset * 86400
+        # Timestamps are whole seconds: round the lower bound up and the upper bound down
+        lower = day_start + start_time.hour * 3600 + start_time.minute * 60 + start_time.second + (1 if start_time.microsecond else 0)
+        upper = day_start + end_time.hour * 3600 + end_time.minute * 60 + end_time.second
+        if lower > upper:
+            return slice(0, 0)
+        if spot.hour_starts is not None and lower >= 0:
+            last = len(spot.hour_starts) - 1
+            lo = spot.hour_starts[min(-(-lower // 3600), last)]
+            hi = spot.hour_starts[min(upper // 3600 + 1, last)]
+            return slice(int(lo), int(max(lo, hi)))
+        lo = np.searchsorted(spot.timestamps, self.origin + lower, side='left')
+        hi = np.searchsorted(spot.timestamps, self.origin + upper, side='right')
+        return slice(int(lo), int(max(lo, hi)))
+
+    def index_of(self, spot_id: int, timestamp_utc: datetime.datetime) -> Optional[int]:
+        """Índice da linha do spot com exatamente esse timestamp_utc, ou None."""
+        spot = self.spots.get(spot_id)
+        if spot is None:
+            return None
+        seconds = _epoch_seconds(timestamp_utc)
+        index = int(np.searchsorted(spot.timestamps, seconds, side='left'))
+        return index if index < len(spot) and spot.timestamps[index] == seconds else None
+
+    def timestamp(self, spot_id: int, index: int) -> datetime.datetime:
+        return EPOCH + datetime.timedelta(seconds=int(self.spots[spot_id].timestamps[index]))
+
+    def conditions(self, spot_id: int, index: int) -> Dict[str, Any]:
+        """Remonta a linha original (mesmas chaves, ordem e valores) de uma hora do spot."""
+        spot = self.spots[spot_id]
+        row = {}
+        for column in spot.column_order:
+            if column == 'spot_id':
+                row[column] = spot_id
+                continue
+            if column == 'timestamp_utc':
+                row[column] = self.timestamp(spot_id, index)
+                continue
+            kind, scale = spot.kinds[column]
+            value = spot.columns[column][index]
+            if kind == 'decimal':
+                row[column] = None if np.isnan(value) else Decimal(f"{value:.{scale}f}")
+            elif kind == 'float':
+                row[column] = None if np.isnan(value) else float(value)
+            elif kind == 'datetime':
+                row[column] = None if value == NO_TIMESTAMP else EPOCH + datetime.timedelta(microseconds=int(value))
+            elif kind == 'tide':
+                row[column] = TIDE_TYPES_BY_CODE.get(int(value))
+            else:
+                row[column] = value
+        return row
+
+    def payload_conditions(self, spot_id: int, index: int) -> Dict[str, Any]:
+        """Condições de uma hora como entram nos payloads (timestamp_utc em ISO 8601)."""
+        row = self.conditions(spot_id, index)
+        row['timestamp_utc'] = row['timestamp_utc'].isoformat()
+        return row
+
+    def latest_changes(self, column: str = 'last_modified_at') -> Dict[tuple, datetime.datetime]:
+        """Maior valor de `column` por (spot_id, dia UTC de timestamp_utc), ignorando nulos."""
+        latest = {}
+        for spot_id, spot in self.spots.items():
+            if spot.kinds.get(column, ('',))[0] != 'datetime':
+                continue
+            modified = spot.columns[column]
+            present = modified != NO_TIMESTAMP
+            days = spot.timestamps[present] // 86400
+            for day, value in zip(*self._max_by_day(days, modified[present])):
+                date = (EPOCH + datetime.timedelta(days=int(day))).date()
+                latest[(spot_id, date)] = EPOCH + datetime.timedelta(microseconds=int(value))
+        return latest
+
+    @staticmethod
+    def _max_by_day(days: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if not len(days):
+            return days, values
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        maxima = np.full(len(unique_days), NO_TIMESTAMP, dtype=np.int64)
+        np.maximum.at(maxima, inverse, values)
+        return unique_days, maxima
+
+    # --- Relatórios ---
+    @property
+    def total_rows(self) -> int:
+        return sum(len(spot) for spot in self.spots.values())
+
+    @property
+    def nbytes(self) -> int:
+        return sum(spot.nbytes for spot in self.spots.values())
+
+    def memory_report(self) -> str:
+        rows = self.total_rows
+        per_row = self.nbytes / rows if rows else 0.0
+        return (f"ForecastStore: {rows} horas de {len(self.spots)} spots em "
+                f"{self.nbytes / 1024:.1f} KiB de arrays ({per_row:.0f} bytes/hora).")
@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Iterable, Optional
+
+from src.db import queries as worker_queries
+from src.services.forecast_store import ForecastStore
+from src.services.scoring_service import DirectionTables
+from src.utils.config import RECOMMENDATION_PAYLOAD_VERSION
+
+
+@dataclass
+class RecommendationSnapshot:
+    """
+    Dados pré-carregados para a Tarefa 2. Todos os índices são montados com um punhado de
+    consultas em lote, de modo que o número de idas ao banco não depende do número de usuários.
+    """
+    start_utc: datetime.datetime
+    end_utc: datetime.datetime
+    spots_by_id: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    forecast_store: Optional[ForecastStore] = None
+    spot_level_prefs: Dict[tuple, Dict[str, Any]] = field(default_factory=dict)
+    generic_prefs_by_level: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    profiles_by_user: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    user_prefs_by_user: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    direction_tables: Optional[DirectionTables] = None # Sem tabelas, as direções são calculadas diretamente
+    payload_version: int = 1 # Formato dos payloads gravados (ver RecommendationCacheWriter)
+
+    def __post_init__(self):
+        if self.forecast_store is None:
+            self.forecast_store = ForecastStore(self.start_utc)
+
+    def to_compact(self) -> Dict[str, Any]:
+        """
+        Forma enviada aos processos do pool. As previsões já estão em arrays NumPy no
+        ForecastStore, que são serializados como blocos contíguos.
+        """
+        return {
+            'start_utc': self.start_utc,
+            'end_utc': self.end_utc,
+            'spots_by_id': self.spots_by_id,
+            'forecast_store': self.forecast_store,
+            'spot_level_prefs': self.spot_level_prefs,
+            'generic_prefs_by_level': self.generic_prefs_by_level,
+            'profiles_by_user': self.profiles_by_user,
+            'user_prefs_by_user': self.user_prefs_by_user,
+            'direction_tables': self.direction_tables,
+            'payload_version': self.payload_version,
+        }
+
+    @classmethod
+    def from_compact(cls, compact: Dict[str, Any]) -> 'RecommendationSnapshot':
+        return cls(**compact)
+
+    def get_preferences_for_user_and_spot(self, spot_id: int, user_profile: Dict, user_prefs_list: List[Dict]) -> Dict[str, Any]:
+        surf_level = user_profile.get('surf_level', 'intermediario')
+        # Start with generic level preferences
+        final_prefs = dict(self.generic_prefs_by_level[surf_level])
+        # Layer spot-specific level preferences (overrides generic level prefs)
+        spot_level_prefs = self.spot_level_prefs.get((spot_id, surf_level))
+        if spot_level_prefs:
+            final_prefs.update({k: v for k, v in spot_level_prefs.items() if v is not None})
+        # Layer user's specific preferences for this spot (overrides level prefs if active)
+        user_spot_prefs = next((p for p in user_prefs_list if p['spot_id'] == spot_id and p.get('is_active')), None)
+        if user_spot_prefs:
+            final_prefs.update({k: v for k, v in user_spot_prefs.items() if v is not None and k != 'is_active'}) # Exclude is_active itself
+        return final_prefs
+
+    def user_inputs_fingerprint(self, user_job: Dict[str, Any]) -> str:
+        """
+        Hash de tudo o que, além das previsões, determina o payload de um usuário: o preset,
+        o perfil, as preferências do usuário, os dados/preferências de nível dos seus spots e
+        a versão do payload.
+        """
+        user_id = user_job['user_id']
+        surf_level = (self.profiles_by_user.get(user_id) or {}).get('surf_level')
+        spot_ids = user_job.get('spot_ids') or []
+        inputs = {
+            'preset': {key: user_job.get(key) for key in ('name', 'spot_ids', 'start_time', 'end_time', 'day_selection_type', 'day_selection_values')},
+            'surf_level': surf_level,
+            'generic_prefs': self.generic_prefs_by_level.get(surf_level),
+            'user_prefs': sorted(self.user_prefs_by_user.get(user_id, []), key=lambda p: json.dumps(p, sort_keys=True, default=str)),
+            'spots': [self.spots_by_id.get(spot_id) for spot_id in spot_ids],
+            'spot_level_prefs': [self.spot_level_prefs.get((spot_id, surf_level)) for spot_id in spot_ids],
+            'payload_version': self.payload_version,
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def latest_forecast_changes(self) -> Dict[tuple, datetime.datetime]:
+        """Maior last_modified_at das previsões carregadas, por (spot_id, dia UTC)."""
+        return self.forecast_store.latest_changes('last_modified_at')
+
+
+def merge_time_windows(time_windows: Iterable[tuple]) -> List[tuple]:
+    """
+    União das janelas de horário (start_time, end_time) dos presets, como uma lista ordenada
+    de intervalos disjuntos. Janelas inválidas ou invertidas são ignoradas, como no cálculo.
+    """
+    valid = sorted(
+        (start, end) for start, end in time_windows
+        if isinstance(start, datetime.time) and isinstance(end, datetime.time) and start <= end
+    )
+    merged = []
+    for start, end in valid:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+async def preload_recommendation_snapshot(
+    user_ids: Iterable[str], spot_ids: Iterable[int],
+    start_utc: datetime.datetime, end_utc: datetime.datetime,
+    time_windows: Optional[Iterable[tuple]] = None,
+    payload_version: int = RECOMMENDATION_PAYLOAD_VERSION
+) -> RecommendationSnapshot:
+    """
+    Carrega spots, previsões, preferências e perfis necessários para a Tarefa 2. Com
+    `time_windows`, só são lidas as horas dentro da união das janelas dos presets.
+    """
+    user_ids = sorted(set(user_ids))
+    spot_ids = sorted(set(spot_ids))
+    merged_windows = merge_time_windows(time_windows) if time_windows is not None else None
+
+    all_spots, forecasts_by_spot, spot_level_prefs, profiles_by_user, user_prefs_by_user = await asyncio.gather(
+        worker_queries.get_all_spots(),
+        worker_queries.get_forecasts_for_spots(spot_ids, start_utc, end_utc, merged_windows),
+        worker_queries.get_all_spot_level_preferences(),
+        worker_queries.get_profiles_by_ids(user_ids),
+        worker_queries.get_user_spot_preferences_by_user_ids(user_ids),
+    )
+
+    snapshot = RecommendationSnapshot(
+        start_utc=start_utc,
+        end_utc=end_utc,
+        spots_by_id={spot['spot_id']: spot for spot in all_spots},
+        forecast_store=ForecastStore.from_rows(forecasts_by_spot, start_utc),
+        spot_level_prefs=spot_level_prefs,
+        profiles_by_user=profiles_by_user,
+        user_prefs_by_user=user_prefs_by_user,
+        payload_version=payload_version,
+    )
+    # Direction score tables for the spots in use, shared by spots with the same ideal directions
+    snapshot.direction_tables = DirectionTables.for_spots(
+        snapshot.spots_by_id[spot_id] for spot_id in spot_ids if spot_id in snapshot.spots_by_id
+    )
+    for profile in profiles_by_user.values():
+        surf_level = profile.get('surf_level', 'intermediario')
+        if surf_level not in snapshot.generic_prefs_by_level:
+            snapshot.generic_prefs_by_level[surf_level] = await worker_queries.get_generic_preferences_by_level(surf_level)
+
+    print(f"Pré-carregados {len(snapshot.spots_by_id)} spots, {snapshot.forecast_store.total_rows} previsões horárias de {len(snapshot.forecast_store.spots)} spots, "
+          f"{len(profiles_by_user)} perfis e {len(spot_level_prefs)} preferências por nível.")
+    print(snapshot.forecast_store.memory_report())
+    print(f"Tabelas de direção: {snapshot.direction_tables.summary()}.")
+    return snapshot
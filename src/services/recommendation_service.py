@@ -0,0 +1,307 @@
+import asyncio
+import datetime
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.services.forecast_store import ForecastStore
+from src.services.recommendation_data import RecommendationSnapshot
+from src.services.scoring_service import (
+    ScoreCache, calculate_overall_scores_batch, preferences_fingerprint, score_data_at
+)
+from src.utils.config import RECOMMENDATION_TOP_K_SPOTS
+
+
+class DailyBestRanker:
+    """
+    Ranqueamento em streaming: conforme os scores chegam, guarda só a melhor hora de cada
+    (dia, spot) — a primeira, em caso de empate — sem acumular a lista de horas. As sessões
+    só são montadas para as horas vencedoras, e cada dia pode ser limitado aos `top_k`
+    melhores spots (0 = sem limite).
+
+    As sessões não trazem forecast_conditions: o store só tem as colunas do score, e a linha
+    completa de cada (spot_id, best_hour_utc) é buscada pelo RecommendationCacheWriter, que a
+    anexa aos payloads v1 ou a grava em forecast_conditions_snapshot para os payloads v2.
+    """
+    def __init__(self, forecast_store: ForecastStore, top_k: int = RECOMMENDATION_TOP_K_SPOTS):
+        self.forecast_store = forecast_store
+        self.top_k = max(0, top_k)
+        self._best: Dict[datetime.date, Dict[int, tuple]] = {}
+        self._sessions: Dict[tuple, Dict] = {}
+
+    def offer(self, forecast_date: datetime.date, spot_id: int, spot_name: str, hour_index: int, score_data: Dict):
+        best_by_spot = self._best.setdefault(forecast_date, {})
+        current = best_by_spot.get(spot_id)
+        # Strictly greater: on ties the earliest hour stays, as in the original ranking
+        if current is None or score_data['overall_score'] > current[0]:
+            best_by_spot[spot_id] = (score_data['overall_score'], spot_name, hour_index, score_data)
+
+    def _session(self, forecast_date: datetime.date, spot_id: int) -> Dict:
+        key = (forecast_date, spot_id)
+        if key not in self._sessions:
+            overall_score, spot_name, hour_index, score_data = self._best[forecast_date][spot_id]
+            self._sessions[key] = {
+                "spot_id": spot_id,
+                "spot_name": spot_name,
+                "best_hour_utc": self.forecast_store.timestamp(spot_id, hour_index).isoformat(),
+                "best_overall_score": overall_score,
+                "detailed_scores": score_data['detailed_scores'],
+            }
+        return self._sessions[key]
+
+    def ranked(self, dates: Iterable[datetime.date]) -> List[Dict]:
+        """Payload ranqueado ({date, ranked_spots} por dia, em ordem de data) dos dias pedidos."""
+        final_response = []
+        for forecast_date in sorted(set(dates) & self._best.keys()):
+            best_by_spot = self._best[forecast_date]
+            # Stable sort keeps first-seen order among equal scores
+            spot_ids = sorted(best_by_spot, key=lambda spot_id: best_by_spot[spot_id][0], reverse=True)
+            if self.top_k:
+                spot_ids = spot_ids[:self.top_k]
+            ranked_spots = [self._session(forecast_date, spot_id) for spot_id in spot_ids]
+            final_response.append({"date": forecast_date.isoformat(), "ranked_spots": ranked_spots})
+        return final_response
+
+
+def compute_config_payloads(
+    user_profile: Dict, user_prefs_list: List[Dict],
+    spot_ids: List[int], configs: Dict[str, List[int]], time_window: tuple,
+    score_cache: ScoreCache, snapshot: RecommendationSnapshot
+) -> Dict[str, List[Dict]]:
+    """
+    Calcula as recomendações de várias configurações (preset, hoje, amanhã) de uma vez.
+    Cada (spot, hora) é avaliado uma única vez e o resultado é projetado no filtro de dias
+    de cada cache_key. Retorna {cache_key: payload ranqueado}.
+    """
+    for cache_key, day_offsets in configs.items():
+        print(f"  - Calculando para config: '{cache_key}' (Dias: {day_offsets}, Spots: {spot_ids})...")
+
+    # Validate inputs
+    if not spot_ids:
+        print("    -> Aviso: Lista de spot_ids vazia. Pulando.")
+        return {}
+    if not isinstance(time_window, tuple) or len(time_window) != 2 or not all(isinstance(t, datetime.time) for t in time_window):
+         print(f"    -> ERRO: time_window inválido. Esperado (time, time), recebido: {time_window}. Pulando.")
+         return {}
+    configs = {key: set(day_offsets) for key, day_offsets in configs.items() if day_offsets}
+    if not configs:
+        print("    -> Aviso: Nenhuma configuração com day_offsets válidos. Pulando.")
+        return {}
+
+
+    store = snapshot.forecast_store
+    start_date = store.origin_utc.date()
+    day_offsets_in_use = sorted(set().union(*configs.values()))
+    # The best hour of a (date, spot) is the same for every config that includes the date
+    ranker = DailyBestRanker(store)
+    processed_spots = 0
+
+    # Read forecasts from the preloaded store and calculate scores for each spot
+    for spot_id in spot_ids:
+        try:
+            spot_details = snapshot.spots_by_id.get(spot_id)
+
+            if not spot_details:
+                print(f"    -> Aviso: Detalhes não encontrados para spot ID {spot_id}. Pulando.")
+                continue
+            if not store.row_count(spot_id):
+                # print(f"    -> Info: Nenhuma previsão encontrada para spot ID {spot_id} no período solicitado.")
+                continue # It's normal not to have forecasts for all days requested
+
+            # Get combined preferences for this user/spot
+            user_prefs = snapshot.get_preferences_for_user_and_spot(spot_id, user_profile, user_prefs_list)
+
+            processed_spots += 1
+            spot_name = spot_details.get('name', f"Spot {spot_id}")
+
+            # Score every hour of the spot's window in a single vectorized pass,
+            # reusing the result of any user/config with the same effective inputs
+            score_key = (spot_id, preferences_fingerprint(user_prefs, user_profile))
+            batch_scores = score_cache.get_or_compute(
+                score_key,
+                lambda: calculate_overall_scores_batch(
+                    store.spot_columns(spot_id), user_prefs, spot_details, user_profile,
+                    snapshot.direction_tables
+                )
+            )
+
+            # Only the hours of the requested days inside the time window, via the store's hour index
+            for day_offset in day_offsets_in_use:
+                forecast_date = start_date + datetime.timedelta(days=day_offset)
+                hours = store.window_slice(spot_id, day_offset, time_window)
+
+                for hour_index in range(hours.start, hours.stop):
+                    # Pick the precomputed scores for this specific hour
+                    if not batch_scores['valid'][hour_index]:
+                        print(f"    -> ERRO ao calcular score para {spot_name} às {store.timestamp(spot_id, hour_index)}: valores nulos na previsão.")
+                        continue # Skip this hour if scoring fails
+                    score_data = score_data_at(batch_scores, hour_index)
+
+                    # Keep the hour only if it beats the running best of its (date, spot)
+                    if score_data.get('overall_score', 0) > 30:
+                        ranker.offer(forecast_date, spot_id, spot_name, hour_index, score_data)
+
+        except Exception as spot_proc_err:
+            print(f"    -> ERRO ao processar spot ID {spot_id}: {spot_proc_err}")
+            traceback.print_exc()
+            continue # Continue to the next spot if one fails
+
+    print(f"    -> Processados forecasts para {processed_spots}/{len(spot_ids)} spots.")
+
+    # --- FORMAT RESULTS ---
+    return {
+        cache_key: ranker.ranked(start_date + datetime.timedelta(days=offset) for offset in day_offsets)
+        for cache_key, day_offsets in configs.items()
+    }
+
+
+def build_user_recommendations(
+    user_job: Dict, preset_offsets: List[int],
+    score_cache: ScoreCache, snapshot: RecommendationSnapshot
+) -> Optional[Dict[str, List[Dict]]]:
+    """
+    Calcula as recomendações de um único usuário sem tocar no banco.
+    Retorna {cache_key: payload} ou None se o usuário não pôde ser processado.
+    """
+    user_id = user_job['user_id']
+    preset_name = user_job.get('name', 'Preset Desconhecido')
+    print(f"\nProcessando recomendações para o usuário: {user_id} (Preset: '{preset_name}')")
+
+    # Read user profile and preferences list from the snapshot
+    user_profile = snapshot.profiles_by_user.get(user_id)
+    user_prefs_list = snapshot.user_prefs_by_user.get(user_id, [])
+    if not user_profile:
+        print(f"  - Aviso: Perfil não encontrado para usuário {user_id}. Pulando.")
+        return None
+
+    # Validate spot_ids and time_window
+    spot_ids = user_job.get('spot_ids', [])
+    start_time = user_job.get('start_time')
+    end_time = user_job.get('end_time')
+
+    if not spot_ids:
+         print(f"  -> Aviso: Nenhum spot_id encontrado para preset '{preset_name}'. Pulando cálculo para este preset.")
+         return None
+    if not isinstance(start_time, datetime.time) or not isinstance(end_time, datetime.time):
+         print(f"  -> ERRO: start_time ou end_time inválidos para preset '{preset_name}'. Recebido start: {start_time}, end: {end_time}. Pulando.")
+         return None
+
+    # Define configurations to calculate (today, tomorrow, and the user's default preset)
+    configs = {
+        "today": [0],
+        "tomorrow": [1],
+        preset_name: preset_offsets # Use calculated offsets for the preset
+    }
+
+    # Score each spot/hour once and project it into every configuration
+    return compute_config_payloads(
+        user_profile, user_prefs_list,
+        spot_ids=spot_ids,
+        configs=configs,
+        time_window=(start_time, end_time),
+        score_cache=score_cache,
+        snapshot=snapshot
+    )
+
+
+def select_users_for_recompute(
+    user_jobs: List[Dict], preset_offsets_by_user: Dict[str, List[int]],
+    snapshot: RecommendationSnapshot, states: Dict[str, Dict], full: bool = False
+) -> Tuple[List[Dict], Dict[str, str]]:
+    """
+    Escolhe quais usuários precisam ter o cache recalculado neste ciclo, a partir do estado
+    gravado no último cálculo de cada um ({user_id: {'inputs_hash', 'computed_at'}}):
+    - sem estado, ou calculado antes de hoje (UTC): 'today'/'tomorrow' e os offsets mudaram de data;
+    - preset, perfil ou preferências diferentes (hash das entradas);
+    - alguma previsão de um dos seus spots, em um dos seus dias, alterada depois do cálculo.
+    Retorna (jobs selecionados, {user_id: motivo}).
+    """
+    if full:
+        return list(user_jobs), {user_job['user_id']: 'completo' for user_job in user_jobs}
+
+    today = snapshot.start_utc.date()
+    latest_changes = snapshot.latest_forecast_changes()
+    selected, reasons = [], {}
+    for user_job in user_jobs:
+        user_id = user_job['user_id']
+        state = states.get(user_id)
+        if not state or state.get('computed_at') is None:
+            reason = 'sem estado'
+        elif state['computed_at'].astimezone(datetime.timezone.utc).date() < today:
+            reason = 'virada do dia'
+        elif state.get('inputs_hash') != snapshot.user_inputs_fingerprint(user_job):
+            reason = 'preferências alteradas'
+        else:
+            days = {today + datetime.timedelta(days=offset) for offset in {0, 1, *preset_offsets_by_user[user_id]}}
+            changed = any(
+                latest_changes.get((spot_id, day)) is not None and latest_changes[(spot_id, day)] > state['computed_at']
+                for spot_id in user_job.get('spot_ids') or [] for day in days
+            )
+            if not changed:
+                continue
+            reason = 'previsões alteradas'
+        selected.append(user_job)
+        reasons[user_id] = reason
+    return selected, reasons
+
+
+# --- Backend multiprocesso ---
+# Cada processo recebe o snapshot compacto uma única vez (no initializer) e mantém o
+# próprio ScoreCache; apenas os payloads ranqueados voltam para o processo principal.
+_worker_snapshot: Optional[RecommendationSnapshot] = None
+_worker_score_cache: Optional[ScoreCache] = None
+
+def _init_scoring_worker(compact_snapshot: Dict):
+    global _worker_snapshot, _worker_score_cache
+    _worker_snapshot = RecommendationSnapshot.from_compact(compact_snapshot)
+    _worker_score_cache = ScoreCache()
+
+def _build_shard(shard: List[Tuple[Dict, List[int]]]) -> Tuple[List[Tuple[str, Optional[Dict], float]], int, int]:
+    """Calcula os payloads de um lote de usuários dentro de um processo do pool."""
+    results = []
+    hits_before, misses_before = _worker_score_cache.hits, _worker_score_cache.misses
+    for user_job, preset_offsets in shard:
+        started = time.perf_counter()
+        try:
+            payloads = build_user_recommendations(user_job, preset_offsets, _worker_score_cache, _worker_snapshot)
+        except Exception as user_proc_err:
+            print(f"  -> ERRO CRÍTICO ao processar usuário {user_job['user_id']}: {user_proc_err}")
+            traceback.print_exc()
+            payloads = None
+        results.append((user_job['user_id'], payloads, time.perf_counter() - started))
+    return results, _worker_score_cache.hits - hits_before, _worker_score_cache.misses - misses_before
+
+async def build_recommendations_in_process_pool(
+    user_jobs: List[Dict], preset_offsets_by_user: Dict[str, List[int]],
+    snapshot: RecommendationSnapshot, workers: int, score_cache: Optional[ScoreCache] = None
+) -> List[Tuple[str, Optional[Dict], float]]:
+    """
+    Distribui os usuários entre `workers` processos e retorna, na ordem de `user_jobs`,
+    tuplas (user_id, payloads ou None, segundos de cálculo).
+    """
+    # Round-robin keeps shards balanced when users are sorted by any attribute
+    shards = [[] for _ in range(workers)]
+    for i, user_job in enumerate(user_jobs):
+        shards[i % workers].append((user_job, preset_offsets_by_user[user_job['user_id']]))
+    shards = [shard for shard in shards if shard]
+    if not shards:
+        return []
+
+    loop = asyncio.get_running_loop()
+    # 'spawn' avoids forking a process that holds the event loop, DB sockets and executor threads
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_scoring_worker, initargs=(snapshot.to_compact(),)) as executor:
+        shard_results = await asyncio.gather(*(
+            loop.run_in_executor(executor, _build_shard, shard) for shard in shards
+        ))
+
+    results_by_user = {}
+    for results, hits, misses in shard_results:
+        if score_cache is not None:
+            score_cache.hits += hits
+            score_cache.misses += misses
+        for user_id, payloads, seconds in results:
+            results_by_user[user_id] = (user_id, payloads, seconds)
+    return [results_by_user[user_job['user_id']] for user_job in user_jobs]
@@ -1,5 +1,28 @@
 import numpy as np
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+# Períodos ideais de swell por nível de surf
+IDEAL_SWELL_PERIODS = {
+    'iniciante': 8,
+    'maroleiro': 10,  # Maroleiro gosta de onda mais em pé, com mais linha
+    'intermediario': 12,
+    'pro': 15         # Pro busca o máximo de power
+}
+
+# Códigos compactos para tide_type (0 = ausente ou desconhecido pelo worker)
+TIDE_TYPE_CODES = {'rising': 1, 'falling': 2, 'high': 3, 'low': 4, 'unknown': 5}
+
+# Colunas numéricas usadas pelo score e o default aplicado quando a chave não existe na previsão
+SCORING_COLUMN_DEFAULTS = {
+    'swell_height_sg': 0,
+    'swell_period_sg': 0,
+    'swell_direction_sg': 0,
+    'wind_speed_sg': 0,
+    'wind_direction_sg': 0,
+    'sea_level_sg': 0,
+    'air_temperature_sg': 25,
+    'water_temperature_sg': 22,
+}
 
 # --- Lógica do Score de Onda (Baseado em wave_score.py) ---
 def _calculate_swell_size_score(swell_height: float, ideal_height: float, max_height: float) -> float:
@@ -16,14 +39,7 @@ def _calculate_swell_size_score(swell_height: float, ideal_height: float, max_he
         return 100 * (1 - (swell_height - ideal_height) / range_size)
 
 def _calculate_swell_period_score(swell_period: float, surf_level: str) -> float:
-    # *** DICIONÁRIO ATUALIZADO AQUI ***
-    ideal_periods = {
-        'iniciante': 8,
-        'maroleiro': 10,  # Maroleiro gosta de onda mais em pé, com mais linha
-        'intermediario': 12,
-        'pro': 15         # Pro busca o máximo de power
-    }
-    ideal_period = ideal_periods.get(surf_level, 12) # Padrão para intermediário
+    ideal_period = IDEAL_SWELL_PERIODS.get(surf_level, 12) # Padrão para intermediário
     score = np.exp(-((swell_period - ideal_period) ** 2) / ideal_period) * 100
     return score
 
@@ -154,4 +170,247 @@ async def calculate_overall_score(forecast: Dict, prefs: Dict, spot: Dict, profi
             "air_temperature_score": air_temperature_score,
             "water_temperature_score": water_temperature_score,
         }
-    }
\ No newline at end of file
+    }
+
+# --- Score Vetorizado (janela inteira de um spot) ---
+# As funções abaixo reproduzem exatamente as funções por hora acima, operando sobre
+# colunas NumPy. `np.float_power` é usado no lugar de `** 2` porque o `**` do Python
+# chama o `pow` da libc, enquanto o `**` do NumPy vira `x * x` e pode diferir no último bit.
+
+def forecasts_to_columns(forecasts: List[Dict]) -> Dict[str, np.ndarray]:
+    """
+    Converte uma lista de previsões horárias em colunas NumPy para o score vetorizado.
+    Valores nulos viram NaN (a hora correspondente é marcada como inválida no score).
+    """
+    columns = {}
+    for col, default in SCORING_COLUMN_DEFAULTS.items():
+        values = [f.get(col, default) for f in forecasts]
+        columns[col] = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    columns['tide_type'] = np.array(
+        [TIDE_TYPE_CODES.get(f.get('tide_type', ''), 0) for f in forecasts], dtype=np.uint8
+    )
+    return columns
+
+def _min_angular_diff_batch(directions: np.ndarray, ideal_directions: List[float]) -> np.ndarray:
+    diffs = np.abs(directions[:, None] - np.array(ideal_directions, dtype=np.float64)[None, :])
+    return np.minimum(np.minimum(diffs, 360 - diffs).min(axis=1), 360)
+
+def _swell_direction_scores(directions: np.ndarray, ideal_directions: List[float]) -> np.ndarray:
+    min_diff = _min_angular_diff_batch(directions, ideal_directions)
+    return np.exp(-np.float_power(min_diff, 2) / (45**2)) * 100
+
+def _wind_is_offshore(directions: np.ndarray, ideal_directions: List[float]) -> np.ndarray:
+    return _min_angular_diff_batch(directions, ideal_directions) <= 45
+
+# Tabelas de direção: uma entrada a cada 0.01° (a escala de numeric(6,2)) de 0 a 360
+DIRECTION_TABLE_STEPS = 100
+_DIRECTION_GRID = np.arange(360 * DIRECTION_TABLE_STEPS + 1) / DIRECTION_TABLE_STEPS
+
+class DirectionTables:
+    """
+    Scores de direção pré-calculados por conjunto de direções ideais (swell e vento), de modo
+    que o score de uma janela inteira vira uma indexação de array. As tabelas são compartilhadas
+    entre spots com as mesmas direções ideais. Direções fora da grade de 0.01° (ou nulas) são
+    calculadas diretamente, com o mesmo resultado.
+    """
+    def __init__(self):
+        self._swell = {}
+        self._wind = {}
+
+    @classmethod
+    def for_spots(cls, spots) -> 'DirectionTables':
+        tables = cls()
+        for spot in spots:
+            if spot.get('ideal_swell_direction'):
+                tables._table(tables._swell, spot['ideal_swell_direction'], _swell_direction_scores)
+            if spot.get('ideal_wind_direction'):
+                tables._table(tables._wind, spot['ideal_wind_direction'], _wind_is_offshore)
+        return tables
+
+    @staticmethod
+    def _table(tables: Dict[tuple, np.ndarray], ideal_directions: List, compute) -> Tuple[tuple, np.ndarray]:
+        key = tuple(float(d) for d in ideal_directions)
+        table = tables.get(key)
+        if table is None:
+            table = tables[key] = compute(_DIRECTION_GRID, list(key))
+        return key, table
+
+    @staticmethod
+    def _lookup(key: tuple, table: np.ndarray, directions: np.ndarray, compute) -> np.ndarray:
+        with np.errstate(invalid='ignore'):
+            index = np.rint(directions * DIRECTION_TABLE_STEPS)
+            on_grid = (index >= 0) & (index < len(table)) & (index / DIRECTION_TABLE_STEPS == directions)
+        result = table[np.where(on_grid, index, 0).astype(np.intp)]
+        if not on_grid.all():
+            result[~on_grid] = compute(directions[~on_grid], list(key))
+        return result
+
+    def swell_direction_scores(self, directions: np.ndarray, ideal_directions: List) -> np.ndarray:
+        key, table = self._table(self._swell, ideal_directions, _swell_direction_scores)
+        return self._lookup(key, table, directions, _swell_direction_scores)
+
+    def wind_is_offshore(self, directions: np.ndarray, ideal_directions: List) -> np.ndarray:
+        key, table = self._table(self._wind, ideal_directions, _wind_is_offshore)
+        return self._lookup(key, table, directions, _wind_is_offshore)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(table.nbytes for tables in (self._swell, self._wind) for table in tables.values())
+
+    def summary(self) -> str:
+        return (f"{len(self._swell)} tabelas de swell e {len(self._wind)} de vento "
+                f"({self.nbytes / 1024:.0f} KiB)")
+
+def _swell_size_scores_batch(swell_height: np.ndarray, ideal_height: float, max_height: float) -> np.ndarray:
+    range_size = max_height - ideal_height
+    with np.errstate(divide='ignore', invalid='ignore'):
+        below_ideal = 100 * (swell_height / ideal_height)
+        if range_size <= 0:
+            above_ideal = np.zeros_like(swell_height)
+        else:
+            above_ideal = 100 * (1 - (swell_height - ideal_height) / range_size)
+    scores = np.where(swell_height <= ideal_height, below_ideal, above_ideal)
+    scores = np.where(swell_height < (ideal_height * 0.3), 0.0, scores)
+    return np.where(swell_height > max_height, -100.0, scores)
+
+def _wave_scores_batch(columns: Dict[str, np.ndarray], prefs: Dict, spot: Dict, profile: Dict,
+                       direction_tables: Optional[DirectionTables] = None) -> np.ndarray:
+    size_scores = _swell_size_scores_batch(
+        columns['swell_height_sg'],
+        float(prefs.get('ideal_swell_height', 1.5)),
+        float(prefs.get('max_swell_height', 2.5))
+    )
+
+    ideal_period = IDEAL_SWELL_PERIODS.get(profile.get('surf_level', 'intermediario'), 12)
+    period_scores = np.exp(-np.float_power(columns['swell_period_sg'] - ideal_period, 2) / ideal_period) * 100
+
+    ideal_directions = spot.get('ideal_swell_direction', [])
+    if not ideal_directions:
+        direction_scores = np.full_like(period_scores, 50.0)
+    elif direction_tables is not None:
+        direction_scores = direction_tables.swell_direction_scores(columns['swell_direction_sg'], ideal_directions)
+    else:
+        direction_scores = _swell_direction_scores(columns['swell_direction_sg'], [float(d) for d in ideal_directions])
+
+    score_base = (size_scores * 0.70) + (period_scores * 0.15) + (direction_scores * 0.15)
+    return np.where(size_scores < 0, 0.0, np.round(np.clip(score_base, 0, 100), 2))
+
+def _wind_scores_batch(columns: Dict[str, np.ndarray], prefs: Dict, spot: Dict,
+                       direction_tables: Optional[DirectionTables] = None) -> np.ndarray:
+    wind_speed = columns['wind_speed_sg']
+    max_wind = float(prefs.get('max_wind_speed', 8.0))
+    ideal_dirs = [float(d) for d in spot.get('ideal_wind_direction', [])]
+
+    if not ideal_dirs:
+        scores = np.full_like(wind_speed, 75.0)
+    else:
+        if direction_tables is not None:
+            offshore = direction_tables.wind_is_offshore(columns['wind_direction_sg'], ideal_dirs)
+        else:
+            offshore = _wind_is_offshore(columns['wind_direction_sg'], ideal_dirs)
+        factor = np.where(offshore, 100, 75)  # Terral vs Maral/Lateral
+        scores = factor * (1 - (wind_speed / max_wind))
+    return np.where(wind_speed > max_wind, 0.0, scores)
+
+def _tide_scores_batch(columns: Dict[str, np.ndarray], spot: Dict) -> np.ndarray:
+    ideal_level = float(spot.get('ideal_sea_level', 0.5))
+    ideal_flow = spot.get('ideal_tide_flow', [])
+
+    scores = np.exp(-np.float_power(columns['sea_level_sg'] - ideal_level, 2) / 0.5) * 100
+    if ideal_flow:
+        accepted_codes = [TIDE_TYPE_CODES[t] for t in ideal_flow if t in TIDE_TYPE_CODES]
+        scores = np.where(np.isin(columns['tide_type'], accepted_codes), scores, scores * 0.8)
+    return np.round(scores, 2)
+
+def calculate_overall_scores_batch(columns: Dict[str, np.ndarray], prefs: Dict, spot: Dict, profile: Dict,
+                                   direction_tables: Optional[DirectionTables] = None) -> Dict[str, np.ndarray]:
+    """
+    Calcula o score geral e os scores detalhados de todas as horas de um spot em uma única
+    passada vetorizada. Os valores são idênticos (bit a bit) aos de `calculate_overall_score`.
+    A chave 'valid' indica as horas que o cálculo por hora conseguiria pontuar (sem nulos).
+    Com `direction_tables`, os scores de direção saem das tabelas pré-calculadas.
+    """
+    wave_scores = _wave_scores_batch(columns, prefs, spot, profile, direction_tables)
+    wind_scores = _wind_scores_batch(columns, prefs, spot, direction_tables)
+    tide_scores = _tide_scores_batch(columns, spot)
+    air_temperature_scores = np.round(
+        np.exp(-0.04 * np.float_power(columns['air_temperature_sg'] - float(prefs.get('ideal_air_temperature', 25)), 2)) * 100, 2
+    )
+    water_temperature_scores = np.round(
+        np.exp(-0.08 * np.float_power(columns['water_temperature_sg'] - float(prefs.get('ideal_water_temperature', 22)), 2)) * 100, 2
+    )
+
+    overall_scores = (
+        (wave_scores * 0.50) +
+        (wind_scores * 0.33) +
+        (tide_scores * 0.15) +
+        (air_temperature_scores * 0.01) +
+        (water_temperature_scores * 0.01)
+    )
+
+    valid = np.ones(len(overall_scores), dtype=bool)
+    for col in SCORING_COLUMN_DEFAULTS:
+        valid &= ~np.isnan(columns[col])
+
+    return {
+        "overall_score": np.round(overall_scores, 2),
+        "wave_score": wave_scores,
+        "wind_score": wind_scores,
+        "tide_score": tide_scores,
+        "air_temperature_score": air_temperature_scores,
+        "water_temperature_score": water_temperature_scores,
+        "valid": valid,
+    }
+
+def preferences_fingerprint(prefs: Dict, profile: Dict) -> tuple:
+    """
+    Resume as preferências efetivas em uma tupla hashável contendo apenas os valores que o
+    score de fato lê (já convertidos como o score os converte). Usuários sem ajustes por spot
+    compartilham o mesmo fingerprint.
+    """
+    return (
+        profile.get('surf_level', 'intermediario'),
+        float(prefs.get('ideal_swell_height', 1.5)),
+        float(prefs.get('max_swell_height', 2.5)),
+        float(prefs.get('max_wind_speed', 8.0)),
+        float(prefs.get('ideal_air_temperature', 25)),
+        float(prefs.get('ideal_water_temperature', 22)),
+    )
+
+class ScoreCache:
+    """
+    Memoiza os scores vetorizados de um spot durante um ciclo do worker, para que todos os
+    usuários e configs com as mesmas entradas reutilizem um único cálculo.
+    """
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: tuple, compute) -> Dict[str, np.ndarray]:
+        batch_scores = self._entries.get(key)
+        if batch_scores is not None:
+            self.hits += 1
+            return batch_scores
+        self.misses += 1
+        batch_scores = compute()
+        self._entries[key] = batch_scores
+        return batch_scores
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% de reaproveitamento)"
+
+def score_data_at(batch_scores: Dict[str, np.ndarray], index: int) -> dict:
+    """Monta, para uma hora do lote, o mesmo dicionário retornado por `calculate_overall_score`."""
+    return {
+        "overall_score": float(batch_scores["overall_score"][index]),
+        "detailed_scores": {
+            "wave_score": float(batch_scores["wave_score"][index]),
+            "wind_score": float(batch_scores["wind_score"][index]),
+            "tide_score": float(batch_scores["tide_score"][index]),
+            "air_temperature_score": float(batch_scores["air_temperature_score"][index]),
+            "water_temperature_score": float(batch_scores["water_temperature_score"][index]),
+        }
+    }
@@ -10,24 +10,48 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10")) # Conexões máximas do pool asyncpg
 
 # Chaves de API
 
 STORMGLASS_API_KEYS_STR = os.getenv("STORMGLASS_API_KEYS", "")
 STORMGLASS_API_KEYS = [key.strip() for key in STORMGLASS_API_KEYS_STR.split(',') if key.strip()]
+# Cota diária por chave (vazio = desconhecida até a primeira resposta, que traz meta.dailyQuota)
+STORMGLASS_DAILY_QUOTA = int(os.getenv("STORMGLASS_DAILY_QUOTA")) if os.getenv("STORMGLASS_DAILY_QUOTA") else None
+STORMGLASS_KEY_REQUESTS_PER_SECOND = float(os.getenv("STORMGLASS_KEY_REQUESTS_PER_SECOND", "5")) # Taxa sustentada por chave
+STORMGLASS_KEY_BURST = float(os.getenv("STORMGLASS_KEY_BURST", "10")) # Rajada máxima por chave
 
 # Configurações globais para as requisições
 OUTPUT_DIR = 'data' # Diretório onde os JSONs temporários serão salvos
 REQUEST_DIR = os.path.join(OUTPUT_DIR, 'requests') # Diretório para requisições
 TREATED_DIR = os.path.join(OUTPUT_DIR, 'treated') # Diretório para dados tratados
 FORECAST_DAYS = 10 # Quantidade de dias de previsão
+FORECAST_TTL_HOURS = float(os.getenv("FORECAST_TTL_HOURS", "6")) # Idade máxima das previsões antes de buscar a janela completa de novo
+FORECAST_HORIZON_TOLERANCE_HOURS = float(os.getenv("FORECAST_HORIZON_TOLERANCE_HOURS", "1")) # Folga aceita no fim da janela antes de buscar a cauda
+FORECAST_COORDINATE_PRECISION = int(os.getenv("FORECAST_COORDINATE_PRECISION", "2")) # Casas decimais usadas para agrupar spots na mesma célula da grade
+FORECAST_RETENTION_DAYS = int(os.getenv("FORECAST_RETENTION_DAYS", "7")) # Dias de previsões passadas mantidos no banco
+FORECAST_PARTITION_INTERVAL = os.getenv("FORECAST_PARTITION_INTERVAL", "day") # 'day' ou 'week': intervalo das partições de forecasts
+RECOMMENDATION_CACHE_RETENTION_DAYS = int(os.getenv("RECOMMENDATION_CACHE_RETENTION_DAYS", "2")) # Entradas de cache não confirmadas (regravadas ou com created_at atualizado) há mais dias são removidas
+RETENTION_DELETE_CHUNK_SIZE = int(os.getenv("RETENTION_DELETE_CHUNK_SIZE", "5000")) # Linhas apagadas por lote na limpeza
+RETENTION_DELETE_SLEEP_SECONDS = float(os.getenv("RETENTION_DELETE_SLEEP_SECONDS", "0.1")) # Pausa entre os lotes da limpeza
 HOURS_FILTER = list(range(5, 18)) # 5 AM to 5 PM (local time)
+SCORING_PROCESSES = int(os.getenv("SCORING_PROCESSES", "0")) # Processos para o cálculo da Tarefa 2 (0 ou 1 = processo único)
+RECOMMENDATION_CACHE_BATCH_SIZE = int(os.getenv("RECOMMENDATION_CACHE_BATCH_SIZE", "500")) # Entradas de cache por lote de gravação
+RECOMMENDATION_TOP_K_SPOTS = int(os.getenv("RECOMMENDATION_TOP_K_SPOTS", "0")) # Máximo de spots ranqueados por dia no payload (0 = sem limite)
+RECOMMENDATION_PAYLOAD_VERSION = int(os.getenv("RECOMMENDATION_PAYLOAD_VERSION", "1")) # 1 = condições embutidas no payload; 2 = referência a forecast_conditions_snapshot
+FORECAST_INSERT_BATCH_SIZE = int(os.getenv("FORECAST_INSERT_BATCH_SIZE", "5000")) # Linhas de previsão (de vários spots) por lote de gravação
 
 # StormGlass.io API endpoint URLs
 WEATHER_API_URL = "https://api.stormglass.io/v2/weather/point"
 TIDE_SEA_LEVEL_API_URL = "https://api.stormglass.io/v2/tide/sea-level/point"
 TIDE_EXTREMES_API_URL = "https://api.stormglass.io/v2/tide/extremes/point"
 
+# Cliente HTTP da Stormglass (pool de conexões keep-alive)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")) # Segundos para o handshake TCP/TLS (sem contar a espera pelo pool)
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30")) # Segundos sem receber dados da resposta
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100")) # Conexões abertas no total
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20")) # Conexões abertas por host
+
 # Parâmetros para /weather/point endpoint
 PARAMS_WEATHER_API = [
     'waveHeight', 'waveDirection', 'wavePeriod', 'swellHeight', 'swellDirection',
@@ -2,8 +2,17 @@ import arrow
 import os
 import json
 import decimal
+import datetime
+from bisect import bisect_left
 from collections import defaultdict
 
+try:
+    import orjson # Listado em requirements.txt; sem ele os payloads caem no json da stdlib
+except ImportError:
+    orjson = None
+
+JSON_ENCODER = 'orjson' if orjson is not None else 'json'
+
 def load_json_data(filename, directory):
     """
     Carrega dados JSON a partir de um arquivo localizado no diretório especificado.
@@ -33,6 +42,15 @@ def save_json_data(data, filename, directory):
         print(f"Erro ao salvar JSON em {path}: {e}")
         raise e
 
+def dumps_json_bytes(data) -> bytes:
+    """
+    Serializa em JSON compacto (UTF-8), com str() para Decimal, datetime e afins.
+    Usa orjson quando instalado; o fallback com json gera os mesmos bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, default=str, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
 def convert_to_localtime(data, timezone='America/Sao_Paulo'):
     for entry in data:
         try:
@@ -109,6 +127,72 @@ def cardinal_to_degrees(cardinal_direction_str):
     }
     return mapping.get(cardinal_direction_str.upper(), None)
     
+def _tide_date_key(time_value):
+    """Dia (YYYY-MM-DD) do timestamp, no fuso do próprio timestamp."""
+    # ISO timestamps already start with the local date; arrow is only needed for other formats
+    if isinstance(time_value, str) and len(time_value) >= 10 and time_value[4] == '-' and time_value[7] == '-':
+        return time_value[:10]
+    return arrow.get(time_value).format('YYYY-MM-DD')
+
+def _classify_tide_level(current_level, prev_level, next_level):
+    """Determina a fase da maré a partir dos níveis diferentes mais próximos antes e depois do ponto."""
+    if prev_level is not None and next_level is not None:
+        # Caso normal: temos vizinhos em ambos os lados
+        if current_level > prev_level and current_level > next_level:
+            return 'high'  # Pico
+        elif current_level < prev_level and current_level < next_level:
+            return 'low'   # Vale
+        elif current_level >= prev_level:
+            return 'rising'  # Subindo
+        else:
+            return 'falling' # Descendo
+
+    elif prev_level is None and next_level is not None:
+        # Primeiro ponto do dia
+        if current_level < next_level:
+            return 'rising'
+        elif current_level > next_level:
+            return 'falling'
+        else:
+            return 'rising'  # Mesmo nível - assume rising
+
+    elif prev_level is not None and next_level is None:
+        # Último ponto do dia
+        if current_level > prev_level:
+            return 'rising'
+        elif current_level < prev_level:
+            return 'falling'
+        else:
+            return 'falling'  # Mesmo nível - assume falling
+
+    else:
+        # Apenas um nível no dia
+        return 'unknown'
+
+def _label_daily_tide_phases(daily_data):
+    """
+    Rotula os pontos de um único dia (já ordenados por tempo) em uma passada.
+    Pontos sem nível viram 'unknown' e são ignorados na vizinhança; os demais são
+    agrupados em platôs (sequências de níveis iguais), e os vizinhos de cada ponto
+    são os níveis dos platôs anterior e posterior.
+    """
+    plateaus = [] # [nível, [pontos]]
+    for entry in daily_data:
+        level = entry.get('sg')
+        if level is None:
+            entry['tide_type'] = 'unknown'
+        elif plateaus and not level != plateaus[-1][0]:
+            plateaus[-1][1].append(entry)
+        else:
+            plateaus.append([level, [entry]])
+
+    for i, (level, entries) in enumerate(plateaus):
+        prev_level = plateaus[i - 1][0] if i > 0 else None
+        next_level = plateaus[i + 1][0] if i + 1 < len(plateaus) else None
+        tide_type = _classify_tide_level(level, prev_level, next_level)
+        for entry in entries:
+            entry['tide_type'] = tide_type
+
 def determine_tide_phase(sea_level_data):
     """
     Determina a fase da maré (e.g., 'low', 'high', 'rising', 'falling')
@@ -119,113 +203,66 @@ def determine_tide_phase(sea_level_data):
     - Picos "flats" (mesmo nível por múltiplas horas)
     - Descontinuidades entre dias (dados apenas diurnos)
     - Tendências de subida e descida
+
+    Os pontos recebem 'tide_type' no próprio dicionário e são retornados ordenados por tempo.
+    Custo linear após a ordenação: cada dia é rotulado em uma única passada.
     """
-    def _group_by_date(data):
-        """Agrupa dados por dia para tratar descontinuidades."""
-        daily_groups = defaultdict(list)
-        for entry in data:
-            date_str = arrow.get(entry['time']).format('YYYY-MM-DD')
-            daily_groups[date_str].append(entry)
-        return daily_groups
-    
-    def _find_previous_different_level(data, current_index):
-        """Encontra o índice e nível do ponto anterior com nível diferente."""
-        current_level = data[current_index].get('sg')
-        
-        for i in range(current_index - 1, -1, -1):
-            prev_level = data[i].get('sg')
-            if prev_level is not None and prev_level != current_level:
-                return i, prev_level
-        
-        return None, None
-    
-    def _find_next_different_level(data, current_index):
-        """Encontra o índice e nível do ponto posterior com nível diferente."""
-        current_level = data[current_index].get('sg')
-        
-        for i in range(current_index + 1, len(data)):
-            next_level = data[i].get('sg')
-            if next_level is not None and next_level != current_level:
-                return i, next_level
-        
-        return None, None
-    
-    def _classify_tide_point(data, index):
-        """Determina a fase da maré para um ponto específico."""
-        current_level = data[index].get('sg')
-        
-        if current_level is None:
-            return 'unknown'
-        
-        # Busca vizinhos com níveis diferentes (para tratar picos flats)
-        prev_index, prev_level = _find_previous_different_level(data, index)
-        next_index, next_level = _find_next_different_level(data, index)
-        
-        # Classifica baseado nos vizinhos encontrados
-        if prev_level is not None and next_level is not None:
-            # Caso normal: temos vizinhos em ambos os lados
-            if current_level > prev_level and current_level > next_level:
-                return 'high'  # Pico
-            elif current_level < prev_level and current_level < next_level:
-                return 'low'   # Vale
-            elif current_level >= prev_level:
-                return 'rising'  # Subindo
-            else:
-                return 'falling' # Descendo
-        
-        elif prev_level is None and next_level is not None:
-            # Primeiro ponto do dia
-            if current_level < next_level:
-                return 'rising'
-            elif current_level > next_level:
-                return 'falling'
-            else:
-                return 'rising'  # Mesmo nível - assume rising
-        
-        elif prev_level is not None and next_level is None:
-            # Último ponto do dia
-            if current_level > prev_level:
-                return 'rising'
-            elif current_level < prev_level:
-                return 'falling'
-            else:
-                return 'falling'  # Mesmo nível - assume falling
-        
-        else:
-            # Apenas um ponto
-            return 'unknown'
-    
-    def _process_daily_data(daily_data):
-        """Processa os dados de maré de um único dia."""
-        if not daily_data:
-            return []
-        
-        # Ordena os dados do dia por tempo
-        daily_data = sorted(daily_data, key=lambda x: x['time'])
-        
-        for i, entry in enumerate(daily_data):
-            tide_type = _classify_tide_point(daily_data, i)
-            entry['tide_type'] = tide_type
-        
-        return daily_data
-    
-    # Função principal
     if not sea_level_data:
         return []
 
-    # Ordena os dados por tempo
+    # Ordena os dados por tempo uma única vez; a ordem se mantém dentro de cada dia
     sorted_data = sorted(sea_level_data, key=lambda x: x['time'])
-    
+
     # Agrupa dados por dia para tratar descontinuidades
-    daily_groups = _group_by_date(sorted_data)
-    
-    result = []
-    
-    # Processa cada dia separadamente
-    for date_str in sorted(daily_groups.keys()):
-        daily_data = daily_groups[date_str]
-        processed_daily = _process_daily_data(daily_data)
-        result.extend(processed_daily)
-    
-    # Reordena o resultado final por tempo e retorna
-    return sorted(result, key=lambda x: x['time'])
\ No newline at end of file
+    daily_groups = defaultdict(list)
+    for entry in sorted_data:
+        daily_groups[_tide_date_key(entry['time'])].append(entry)
+
+    for daily_data in daily_groups.values():
+        _label_daily_tide_phases(daily_data)
+
+    return sorted_data
+
+
+def _timestamp_seconds(time_value):
+    """Converte um timestamp ISO (ou qualquer formato aceito pelo arrow) em segundos epoch."""
+    try:
+        return datetime.datetime.fromisoformat(time_value).timestamp()
+    except (TypeError, ValueError):
+        return arrow.get(time_value).timestamp()
+
+def label_tide_phases_from_extremes(sea_level_data, tide_extremes):
+    """
+    Rotula a fase da maré de cada hora a partir dos extremos (high/low) previstos pela Stormglass.
+
+    - A hora mais próxima de um extremo (extremo em (t-30min, t+30min]) recebe o tipo do extremo;
+    - entre dois extremos, a maré está 'rising' se o próximo é 'high' e 'falling' se é 'low';
+    - horas sem extremos dos dois lados mantêm o rótulo de determine_tide_phase.
+
+    Também preenche 'minutes_to_next_extreme' (None quando não há extremo posterior).
+    Cada hora custa uma busca binária: O(n log k) para n horas e k extremos.
+    """
+    sorted_data = determine_tide_phase(sea_level_data)
+    extremes = sorted(
+        (_timestamp_seconds(extreme['time']), extreme['type'])
+        for extreme in (tide_extremes or [])
+        if extreme.get('time') and extreme.get('type') in ('high', 'low')
+    )
+    extreme_times = [seconds for seconds, _ in extremes]
+
+    for entry in sorted_data:
+        if not extremes:
+            entry['minutes_to_next_extreme'] = None
+            continue
+        seconds = _timestamp_seconds(entry['time'])
+        i = bisect_left(extreme_times, seconds) # extremes[i] é o primeiro em t ou depois
+
+        entry['minutes_to_next_extreme'] = round((extreme_times[i] - seconds) / 60) if i < len(extremes) else None
+        if i < len(extremes) and extreme_times[i] <= seconds + 1800:
+            entry['tide_type'] = extremes[i][1]
+        elif i > 0 and extreme_times[i - 1] > seconds - 1800:
+            entry['tide_type'] = extremes[i - 1][1]
+        elif 0 < i < len(extremes):
+            entry['tide_type'] = 'rising' if extremes[i][1] == 'high' else 'falling'
+
+    return sorted_data
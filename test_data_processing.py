@@ -0,0 +1,37 @@
+import datetime
+import math
+import random
+
+from src.db.queries import FORECAST_COLUMNS, _forecast_json_key
+from src.forecast.data_processing import merge_stormglass_data, merge_stormglass_rows
+from src.utils.config import PARAMS_WEATHER_API
+
+
+def _stormglass_payloads(rng):
+    """Respostas sintéticas de tempo e nível do mar, embaralhadas e com lacunas."""
+    start = datetime.datetime(2025, 8, 28, tzinfo=datetime.timezone.utc)
+    times = [(start + datetime.timedelta(hours=h)).isoformat() for h in range(24 * 3)]
+    hours = [
+        {'time': t, **{param: {'sg': round(rng.uniform(0, 3), 2), 'noaa': 1.0} for param in PARAMS_WEATHER_API}}
+        for t in times if rng.random() > 0.05
+    ]
+    hours[2]['windSpeed'] = None
+    del hours[3]['swellHeight']
+    hours.append(dict(hours[5], waveHeight={'sg': 9.99})) # horário repetido: vale o último
+    sea_level = [{'time': t, 'sg': round(math.sin(h / 2), 2)} for h, t in enumerate(times) if rng.random() > 0.1]
+    rng.shuffle(hours)
+    rng.shuffle(sea_level)
+    return {'hours': hours}, {'data': sea_level}
+
+def test_row_merge_matches_dict_merge():
+    rng = random.Random(15)
+    for _ in range(10):
+        weather_data, sea_level_data = _stormglass_payloads(rng)
+        merged = merge_stormglass_data(weather_data, {'data': [dict(e) for e in sea_level_data['data']]})
+        json_keys = [_forecast_json_key(column) for column in FORECAST_COLUMNS[2:]]
+        expected = [(datetime.datetime.fromisoformat(entry['time']), *(entry.get(key) for key in json_keys)) for entry in merged]
+
+        rows = merge_stormglass_rows(weather_data, sea_level_data)
+
+        assert rows == expected
+        assert all(len(row) == len(FORECAST_COLUMNS) - 1 for row in rows)
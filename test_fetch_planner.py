@@ -0,0 +1,48 @@
+import datetime
+from decimal import Decimal
+
+from src.forecast.fetch_planner import SpotFetchPlan, coalesce_fetch_plans, plan_forecast_fetches
+
+
+def test_planner_skips_fresh_spots_and_fetches_only_the_missing_tail():
+    now = datetime.datetime(2025, 8, 28, 9, 30, tzinfo=datetime.timezone.utc)
+    start_utc = now.replace(hour=0, minute=0)
+    end_utc = start_utc + datetime.timedelta(days=10)
+    spots = [{'spot_id': i} for i in range(1, 5)]
+    freshness = {
+        1: {'window_fetched_at': now - datetime.timedelta(hours=1), 'horizon_utc': end_utc},
+        2: {'window_fetched_at': now - datetime.timedelta(hours=1), 'horizon_utc': end_utc - datetime.timedelta(hours=30)},
+        3: {'window_fetched_at': now - datetime.timedelta(hours=7), 'horizon_utc': end_utc},
+    }
+
+    plans, skipped = plan_forecast_fetches(spots, freshness, start_utc, end_utc, now, ttl_hours=6)
+
+    assert skipped == [{'spot_id': 1}]
+    by_spot = {plan.spot['spot_id']: plan for plan in plans}
+    assert by_spot[2].reason == 'cauda'
+    # A cauda começa na meia-noite do primeiro dia incompleto
+    assert by_spot[2].start_utc == end_utc - datetime.timedelta(days=2)
+    assert by_spot[2].end_utc == end_utc
+    assert (by_spot[3].reason, by_spot[3].start_utc) == ('expirado', start_utc)
+    assert (by_spot[4].reason, by_spot[4].start_utc) == ('novo', start_utc)
+
+def test_coalescer_groups_spots_in_the_same_grid_cell():
+    start_utc = datetime.datetime(2025, 8, 28, tzinfo=datetime.timezone.utc)
+    end_utc = start_utc + datetime.timedelta(days=10)
+    spots = [
+        {'spot_id': 1, 'latitude': Decimal('-22.9712'), 'longitude': Decimal('-43.1822')},
+        {'spot_id': 2, 'latitude': Decimal('-22.9741'), 'longitude': Decimal('-43.1790')},
+        {'spot_id': 3, 'latitude': Decimal('-23.0101'), 'longitude': Decimal('-43.3000')},
+    ]
+    plans = [
+        SpotFetchPlan(spots[0], start_utc, end_utc, 'novo'),
+        SpotFetchPlan(spots[1], end_utc - datetime.timedelta(days=1), end_utc, 'cauda'),
+        SpotFetchPlan(spots[2], start_utc, end_utc, 'novo'),
+    ]
+
+    groups = coalesce_fetch_plans(plans, precision=2)
+
+    assert [[spot['spot_id'] for spot in group.spots] for group in groups] == [[1, 2], [3]]
+    assert (groups[0].latitude, groups[0].longitude) == (Decimal('-22.9712'), Decimal('-43.1822'))
+    assert (groups[0].start_utc, groups[0].end_utc) == (start_utc, end_utc)
+    assert len(coalesce_fetch_plans(plans, precision=3)) == 3
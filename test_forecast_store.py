@@ -0,0 +1,79 @@
+import datetime
+import random
+from decimal import Decimal
+
+import numpy as np
+
+from src.services.forecast_store import ForecastStore
+from src.services.scoring_service import forecasts_to_columns
+
+START_UTC = datetime.datetime(2025, 8, 28, tzinfo=datetime.timezone.utc)
+
+def _rows(rng, spot_id, hours, step_minutes=60):
+    """Linhas no formato do asyncpg (numeric como Decimal, timestamptz em UTC), com alguns nulos."""
+    def dec(lo, hi):
+        return None if rng.random() < 0.05 else Decimal(f"{rng.uniform(lo, hi):.2f}")
+    return [{
+        'spot_id': spot_id,
+        'timestamp_utc': START_UTC + datetime.timedelta(minutes=step_minutes * h),
+        'swell_height_sg': dec(0.5, 2.0), 'swell_period_sg': dec(6, 16), 'swell_direction_sg': dec(90, 200),
+        'wind_speed_sg': dec(0, 6), 'wind_direction_sg': dec(0, 360), 'sea_level_sg': dec(-0.5, 1.0),
+        'tide_type': rng.choice(['rising', 'falling', 'high', 'low', 'unknown', None]),
+        'air_temperature_sg': dec(20, 30), 'water_temperature_sg': dec(18, 26),
+        'last_modified_at': START_UTC + datetime.timedelta(minutes=h, microseconds=rng.randrange(10**6)),
+    } for h in range(hours)]
+
+def test_store_rebuilds_rows_and_scoring_columns_exactly():
+    rng = random.Random(3)
+    forecasts_by_spot = {1: _rows(rng, 1, 24 * 7), 2: _rows(rng, 2, 30)}
+    store = ForecastStore.from_rows(forecasts_by_spot, START_UTC)
+
+    for spot_id, rows in forecasts_by_spot.items():
+        # repr also pins Decimal scale ('1.50') and the UTC tzinfo, which end up in the cached JSON
+        assert [repr(store.conditions(spot_id, i)) for i in range(len(rows))] == [repr(row) for row in rows]
+        expected = forecasts_to_columns(rows)
+        columns = store.spot_columns(spot_id)
+        for name, values in expected.items():
+            np.testing.assert_array_equal(columns[name], values)
+            assert columns[name].dtype == values.dtype
+    assert store.spots[1].timestamps.dtype == np.int64 and store.spots[1].columns['tide_type'].dtype == np.uint8
+    assert store.nbytes > 0 and 'ForecastStore' in store.memory_report()
+
+def test_window_slices_match_a_linear_filter():
+    rng = random.Random(5)
+    t = datetime.time
+    windows = [(t(5), t(17)), (t(0), t(23, 59)), (t(5, 30), t(6, 30)), (t(17), t(5)), (t(23), t(23)), (t(6, 0, 0, 1), t(8))]
+    for step_minutes in (60, 45):  # 45 min exercises the searchsorted fallback
+        rows = _rows(rng, 1, 24 * 5, step_minutes)
+        store = ForecastStore.from_rows({1: rows}, START_UTC)
+        for day_offset in range(-1, 9):
+            for window in windows:
+                expected = [
+                    i for i, row in enumerate(rows)
+                    if (row['timestamp_utc'].date() - START_UTC.date()).days == day_offset
+                    and window[0] <= row['timestamp_utc'].time() <= window[1]
+                ]
+                hours = store.window_slice(1, day_offset, window)
+                assert list(range(hours.start, hours.stop)) == expected, (step_minutes, day_offset, window)
+    assert store.window_slice(99, 0, windows[0]) == slice(0, 0)
+
+def test_latest_changes_per_spot_and_day():
+    rng = random.Random(9)
+    rows = _rows(rng, 4, 72)
+    rows[10]['last_modified_at'] = None
+    store = ForecastStore.from_rows({4: rows}, START_UTC)
+
+    expected = {}
+    for row in rows:
+        if row['last_modified_at'] is not None:
+            key = (4, row['timestamp_utc'].date())
+            expected[key] = max(expected.get(key, row['last_modified_at']), row['last_modified_at'])
+    assert store.latest_changes() == expected
+
+def test_window_slices_count_days_from_midnight_of_a_non_midnight_origin():
+    rng = random.Random(11)
+    rows = _rows(rng, 1, 48)
+    store = ForecastStore.from_rows({1: rows}, START_UTC.replace(hour=15, minute=20))
+    assert store.origin_utc == START_UTC
+    assert store.window_slice(1, 0, (datetime.time(5), datetime.time(17))) == slice(5, 18)
+    assert store.window_slice(1, 1, (datetime.time(5), datetime.time(17))) == slice(29, 42)
@@ -0,0 +1,61 @@
+import asyncio
+import datetime
+
+from src.db import forecast_writer
+from src.db.forecast_writer import ForecastWriter
+
+START_UTC = datetime.datetime(2025, 8, 28, tzinfo=datetime.timezone.utc)
+
+def _rows(hours, value=1.0, start_hour=0):
+    # merge_stormglass_rows tuples start with the timestamp; one measure is enough here
+    return [(START_UTC + datetime.timedelta(hours=start_hour + h), value) for h in range(hours)]
+
+def _fake_insert(monkeypatch):
+    batches = []
+
+    async def insert_forecast_rows_batch(records, fetch_states):
+        batches.append((records, fetch_states))
+        counts = {}
+        for spot_id, *_ in records:
+            counts.setdefault(spot_id, {'inserted': 0, 'updated': 0, 'unchanged': 0})['inserted'] += 1
+        return counts
+
+    monkeypatch.setattr(forecast_writer.worker_queries, 'insert_forecast_rows_batch', insert_forecast_rows_batch)
+    return batches
+
+def test_rows_are_deduplicated_by_spot_and_timestamp(monkeypatch):
+    batches = _fake_insert(monkeypatch)
+
+    async def write():
+        async with ForecastWriter(batch_size=100) as writer:
+            await writer.add(1, _rows(3, value=1.0))
+            await writer.add(1, _rows(2, value=2.0, start_hour=2))  # hour 2 is queued again
+            await writer.add(2, _rows(3, value=3.0))  # same timestamps, other spot
+        return writer
+
+    writer = asyncio.run(write())
+    assert len(batches) == 1
+    records, fetch_states = batches[0]
+    assert sorted((spot_id, ts.hour, value) for spot_id, ts, value in records) == [
+        (1, 0, 1.0), (1, 1, 1.0), (1, 2, 2.0), (1, 3, 2.0), (2, 0, 3.0), (2, 1, 3.0), (2, 2, 3.0)
+    ]
+    assert [(spot_id, horizon.hour) for spot_id, _, horizon in fetch_states] == [(1, 3), (2, 2)]
+    assert writer.totals()['inserted'] == 7 and writer.batches == 1
+
+def test_batches_flush_at_the_boundary(monkeypatch):
+    batches = _fake_insert(monkeypatch)
+
+    async def write():
+        writer = ForecastWriter(batch_size=4)
+        await writer.add(1, _rows(3))
+        assert batches == []  # 3 rows: still buffered
+        await writer.add(2, _rows(1))
+        assert len(batches) == 1 and len(batches[0][0]) == 4  # reached 4: flushed
+        await writer.add(3, _rows(2))
+        await writer.close()  # the remainder is written on close
+        return writer
+
+    writer = asyncio.run(write())
+    assert [len(records) for records, _ in batches] == [4, 2]
+    assert [[spot_id for spot_id, *_ in states] for _, states in batches] == [[1, 2], [3]]
+    assert writer.batches == 2 and writer.failed == 0
@@ -0,0 +1,77 @@
+import asyncio
+import gzip
+import json
+from decimal import Decimal
+
+from aiohttp import web
+
+from src.forecast.http_client import StormglassHttpClient
+
+
+async def _run_against_stub_server(scenario):
+    """Sobe um servidor local que imita os endpoints da Stormglass e roda o cenário contra ele."""
+    seen = {'peers': set(), 'queries': [], 'auth': []}
+
+    async def point(request):
+        seen['peers'].add(request.transport.get_extra_info('peername'))
+        seen['queries'].append(dict(request.query))
+        seen['auth'].append(request.headers.get('Authorization'))
+        body = gzip.compress(json.dumps({'hours': [{'time': '2025-08-28T00:00:00+00:00'}]}).encode())
+        return web.Response(body=body, headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/json'})
+
+    async def slow(request):
+        await asyncio.sleep(0.3)
+        return web.json_response({'hours': []})
+
+    async def quota(request):
+        return web.json_response({'errors': {'key': 'API quota exceeded'}}, status=402)
+
+    app = web.Application()
+    app.router.add_get('/v2/weather/point', point)
+    app.router.add_get('/v2/quota', quota)
+    app.router.add_get('/v2/slow', slow)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    try:
+        return await scenario(base_url), seen
+    finally:
+        await runner.cleanup()
+
+def test_client_reuses_connections_and_decodes_gzip():
+    async def scenario(base_url):
+        async with StormglassHttpClient(limit_per_host=1) as client:
+            return [
+                await client.get_json(f"{base_url}/v2/weather/point", {'lat': Decimal('-22.9712'), 'lng': -43.18}, 'key-1')
+                for _ in range(3)
+            ]
+
+    results, seen = asyncio.run(_run_against_stub_server(scenario))
+
+    assert [r.status for r in results] == [200, 200, 200]
+    assert results[0].data == {'hours': [{'time': '2025-08-28T00:00:00+00:00'}]}
+    assert len(seen['peers']) == 1  # keep-alive: uma única conexão TCP para as três requisições
+    assert seen['queries'][0] == {'lat': '-22.9712', 'lng': '-43.18'}
+    assert seen['auth'] == ['key-1'] * 3
+
+def test_client_returns_http_errors_without_raising():
+    async def scenario(base_url):
+        async with StormglassHttpClient() as client:
+            return await client.get_json(f"{base_url}/v2/quota", {}, 'key-1')
+
+    result, _ = asyncio.run(_run_against_stub_server(scenario))
+
+    assert result.status == 402
+    assert result.data == {'errors': {'key': 'API quota exceeded'}}
+
+def test_requests_waiting_for_a_pooled_connection_do_not_hit_the_connect_timeout():
+    async def scenario(base_url):
+        # One connection per host: the last request waits ~0.6s for it, well past the connect timeout
+        async with StormglassHttpClient(limit_per_host=1, connect_timeout=0.1, read_timeout=5) as client:
+            return await asyncio.gather(*(client.get_json(f"{base_url}/v2/slow", {}, 'key-1') for _ in range(3)))
+
+    results, _ = asyncio.run(_run_against_stub_server(scenario))
+
+    assert [r.status for r in results] == [200, 200, 200]
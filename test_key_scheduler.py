@@ -0,0 +1,63 @@
+import asyncio
+
+from src.forecast.key_scheduler import ApiKeyScheduler
+
+def _scheduler(keys, daily_quota=None):
+    # Large buckets keep the rate limit out of the way; these tests are about quota
+    return ApiKeyScheduler(keys, daily_quota=daily_quota, requests_per_second=1000, burst=1000)
+
+def _meta(request_count, daily_quota=10):
+    return {'meta': {'requestCount': request_count, 'dailyQuota': daily_quota}}
+
+def test_acquire_prefers_the_key_with_most_headroom():
+    scheduler = _scheduler(['aaaa1', 'bbbb2', 'cccc3'], daily_quota=10)
+
+    async def scenario():
+        for key, used in (('aaaa1', 7), ('bbbb2', 2), ('cccc3', 5)):
+            assert await scheduler.acquire(exclude=[k for k in ('aaaa1', 'bbbb2', 'cccc3') if k != key]) == key
+            scheduler.record_response(key, 200, _meta(used))
+        # Remaining: aaaa1=3, bbbb2=8, cccc3=5; each reservation in flight counts against the headroom
+        return [await scheduler.acquire() for _ in range(4)]
+
+    # bbbb2 keeps winning until its headroom (8 - 3 in flight) ties cccc3; the idler key wins the tie
+    assert asyncio.run(scenario()) == ['bbbb2', 'bbbb2', 'bbbb2', 'cccc3']
+
+def test_exhausted_keys_are_skipped_until_none_is_left():
+    scheduler = _scheduler(['aaaa1', 'bbbb2'], daily_quota=1)
+
+    async def scenario():
+        keys = [await scheduler.acquire(), await scheduler.acquire()]
+        for key in keys:
+            scheduler.record_response(key, 200, _meta(1, daily_quota=1))
+        return keys, await scheduler.acquire()
+
+    keys, exhausted = asyncio.run(scenario())
+    assert sorted(keys) == ['aaaa1', 'bbbb2'] and exhausted is None
+
+def test_quota_statuses_move_requests_to_another_key():
+    for status in (429, 402):
+        scheduler = _scheduler(['aaaa1', 'bbbb2'])
+
+        async def scenario():
+            first = await scheduler.acquire()
+            scheduler.record_response(first, status, {'errors': {'key': 'API quota exceeded'}})
+            return first, [await scheduler.acquire() for _ in range(3)]
+
+        first, following = asyncio.run(scenario())
+        assert first not in following and len(set(following)) == 1, status
+
+def test_auth_errors_disable_the_key_for_the_cycle():
+    scheduler = _scheduler(['aaaa1', 'bbbb2'], daily_quota=100)
+
+    async def scenario():
+        rejected = await scheduler.acquire(exclude=['bbbb2'])
+        # A meta block on the error response must not bring the key back
+        scheduler.record_response(rejected, 401, _meta(0, daily_quota=100))
+        following = [await scheduler.acquire() for _ in range(3)]
+        forbidden = await scheduler.acquire()
+        scheduler.record_response(forbidden, 403, None)
+        return following, await scheduler.acquire()
+
+    following, none_left = asyncio.run(scenario())
+    assert following == ['bbbb2'] * 3 and none_left is None
+    assert 'desativada (HTTP 401)' in scheduler.summary() and 'desativada (HTTP 403)' in scheduler.summary()
@@ -0,0 +1,17 @@
+import datetime
+
+from src.db.partitions import partition_ranges
+
+
+def test_partition_ranges_cover_the_window_with_aligned_periods():
+    start = datetime.datetime(2025, 8, 28, 15, 30, tzinfo=datetime.timezone.utc)  # quinta-feira
+    end = start + datetime.timedelta(days=10)
+
+    daily = partition_ranges(start, end, 'day')
+    weekly = partition_ranges(start, end, 'week')
+
+    assert daily[0] == ('forecasts_p20250828', start.replace(hour=0, minute=0), start.replace(hour=0, minute=0) + datetime.timedelta(days=1))
+    assert len(daily) == 11 and daily[-1][1] <= end < daily[-1][2]
+    assert all(previous[2] == current[1] for previous, current in zip(daily, daily[1:]))
+    assert [name for name, _, _ in weekly] == ['forecasts_p20250825', 'forecasts_p20250901']
+    assert weekly[-1][2] > end
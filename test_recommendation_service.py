@@ -0,0 +1,244 @@
+import asyncio
+import datetime
+import json
+import random
+import uuid
+from decimal import Decimal
+
+from src.db import queries as worker_queries
+from src.db.cache_writer import RecommendationCacheWriter
+from src.services.forecast_store import ForecastStore
+from src.services.recommendation_data import RecommendationSnapshot, merge_time_windows
+from src.services.recommendation_service import (
+    DailyBestRanker, build_recommendations_in_process_pool, build_user_recommendations, select_users_for_recompute
+)
+from src.services.scoring_service import ScoreCache
+from src.utils import utils
+
+GENERIC_PREFS = {
+    'iniciante': {"ideal_swell_height": 0.8, "max_swell_height": 1.2, "max_wind_speed": 4.0, "ideal_water_temperature": 24.0, "ideal_air_temperature": 26.0},
+    'intermediario': {"ideal_swell_height": 1.5, "max_swell_height": 2.2, "max_wind_speed": 7.0, "ideal_water_temperature": 22.0, "ideal_air_temperature": 25.0},
+    'pro': {"ideal_swell_height": 2.2, "max_swell_height": 3.5, "max_wind_speed": 9.0, "ideal_water_temperature": 21.0, "ideal_air_temperature": 24.0},
+}
+
+def _build_snapshot_and_jobs(rng, edit_forecasts=None):
+    """
+    Monta um snapshot sintético com o mesmo formato das linhas retornadas pelo asyncpg.
+    `edit_forecasts`, se informado, recebe {spot_id: linhas} antes da montagem do ForecastStore.
+    """
+    start_utc = datetime.datetime(2025, 8, 28, tzinfo=datetime.timezone.utc)
+    def dec(lo, hi):
+        return Decimal(f"{rng.uniform(lo, hi):.2f}")
+
+    spots_by_id, forecasts_by_spot = {}, {}
+    for spot_id in range(1, 7):
+        spots_by_id[spot_id] = {
+            'spot_id': spot_id, 'name': f"Spot {spot_id}",
+            'ideal_swell_direction': [135, 180], 'ideal_wind_direction': [0],
+            'ideal_sea_level': Decimal('0.50'), 'ideal_tide_flow': ['rising'],
+        }
+        forecasts_by_spot[spot_id] = [{
+            'spot_id': spot_id,
+            'timestamp_utc': start_utc + datetime.timedelta(hours=h),
+            'swell_height_sg': dec(0.5, 2.0), 'swell_period_sg': dec(6, 16), 'swell_direction_sg': dec(90, 200),
+            'wind_speed_sg': dec(0, 6), 'wind_direction_sg': dec(0, 360), 'sea_level_sg': dec(-0.5, 1.0),
+            'tide_type': rng.choice(['rising', 'falling', 'high', 'low']),
+            'air_temperature_sg': dec(20, 30), 'water_temperature_sg': dec(18, 26),
+        } for h in range(24 * 7)]
+    if edit_forecasts:
+        edit_forecasts(forecasts_by_spot)
+
+    user_jobs, profiles, preset_offsets = [], {}, {}
+    for i in range(12):
+        user_id = str(uuid.UUID(int=i + 1))
+        user_jobs.append({
+            'user_id': user_id, 'name': f"preset {i}", 'spot_ids': rng.sample(range(1, 7), 3),
+            'start_time': datetime.time(5), 'end_time': datetime.time(17),
+        })
+        profiles[user_id] = {'id': user_id, 'surf_level': rng.choice(list(GENERIC_PREFS))}
+        preset_offsets[user_id] = sorted(rng.sample(range(7), 3))
+
+    snapshot = RecommendationSnapshot(
+        start_utc=start_utc,
+        end_utc=start_utc + datetime.timedelta(days=7),
+        spots_by_id=spots_by_id,
+        forecast_store=ForecastStore.from_rows(forecasts_by_spot, start_utc),
+        spot_level_prefs={(2, 'pro'): {'spot_id': 2, 'surf_level': 'pro', 'max_wind_speed': Decimal('5.00')}},
+        generic_prefs_by_level=GENERIC_PREFS,
+        profiles_by_user=profiles,
+        user_prefs_by_user={user_jobs[0]['user_id']: [{'spot_id': user_jobs[0]['spot_ids'][0], 'is_active': True, 'ideal_swell_height': Decimal('1.10')}]},
+    )
+    return snapshot, user_jobs, preset_offsets, forecasts_by_spot
+
+def test_process_pool_payloads_match_single_process():
+    snapshot, user_jobs, preset_offsets, _ = _build_snapshot_and_jobs(random.Random(7))
+
+    score_cache = ScoreCache()
+    expected = [
+        build_user_recommendations(user_job, preset_offsets[user_job['user_id']], score_cache, snapshot)
+        for user_job in user_jobs
+    ]
+
+    results = asyncio.run(build_recommendations_in_process_pool(user_jobs, preset_offsets, snapshot, workers=3))
+
+    assert [user_id for user_id, _, _ in results] == [user_job['user_id'] for user_job in user_jobs]
+    assert [payloads for _, payloads, _ in results] == expected
+    assert any(payloads and any(payloads.values()) for payloads in expected)
+
+def test_only_users_touched_by_changes_are_selected_for_recompute():
+    snapshot, user_jobs, preset_offsets, _ = _build_snapshot_and_jobs(random.Random(7))
+    computed_at = snapshot.start_utc + datetime.timedelta(hours=1)
+    states = {
+        user_job['user_id']: {'inputs_hash': snapshot.user_inputs_fingerprint(user_job), 'computed_at': computed_at}
+        for user_job in user_jobs
+    }
+    assert select_users_for_recompute(user_jobs, preset_offsets, snapshot, states)[0] == []
+
+    # Previsão alterada depois do cálculo: spot 5, amanhã (offset 1 entra em todos os usuários)
+    def touch_spot_5(forecasts_by_spot):
+        for row in forecasts_by_spot[5]:
+            row['last_modified_at'] = computed_at + datetime.timedelta(minutes=5 if row['timestamp_utc'].day == 29 else -5)
+    snapshot, user_jobs, preset_offsets, _ = _build_snapshot_and_jobs(random.Random(7), touch_spot_5)
+    # Preferência alterada e cálculo feito antes da virada do dia
+    snapshot.user_prefs_by_user[user_jobs[0]['user_id']][0]['ideal_swell_height'] = Decimal('1.40')
+    states[user_jobs[1]['user_id']]['computed_at'] = snapshot.start_utc - datetime.timedelta(minutes=1)
+
+    selected, reasons = select_users_for_recompute(user_jobs, preset_offsets, snapshot, states)
+
+    expected = {user_jobs[0]['user_id']: 'preferências alteradas', user_jobs[1]['user_id']: 'virada do dia'}
+    for user_job in user_jobs[2:]:
+        if 5 in user_job['spot_ids']:
+            expected[user_job['user_id']] = 'previsões alteradas'
+    assert reasons == expected
+    assert [user_job['user_id'] for user_job in selected] == [u['user_id'] for u in user_jobs if u['user_id'] in expected]
+    assert len(select_users_for_recompute(user_jobs, preset_offsets, snapshot, states, full=True)[0]) == len(user_jobs)
+
+def test_preset_time_windows_are_merged_into_disjoint_ranges():
+    t = datetime.time
+    windows = [(t(5), t(9)), (t(14), t(17)), (t(8), t(12)), (t(12), t(13)), (None, t(10)), (t(20), t(6)), (t(14), t(15))]
+
+    assert merge_time_windows(windows) == [(t(5), t(13)), (t(14), t(17))]
+    assert merge_time_windows([]) == []
+
+def test_ranker_keeps_first_best_hour_and_caps_each_day():
+    snapshot, _, _, _ = _build_snapshot_and_jobs(random.Random(7))
+    day = snapshot.start_utc.date()
+    def score(value):
+        return {'overall_score': value, 'detailed_scores': {'wave_score': value}}
+
+    rankers = [DailyBestRanker(snapshot.forecast_store, top_k=top_k) for top_k in (0, 2)]
+    for ranker in rankers:
+        for spot_id, hour_index, value in [(1, 5, 50.0), (2, 6, 80.0), (1, 7, 80.0), (3, 8, 80.0), (2, 9, 80.0), (4, 10, 40.0)]:
+            ranker.offer(day, spot_id, f"Spot {spot_id}", hour_index, score(value))
+    full, capped = (ranker.ranked([day]) for ranker in rankers)
+
+    # Empates mantêm a primeira hora de cada spot e a ordem em que os spots apareceram
+    assert [(s['spot_id'], s['best_hour_utc'][11:13]) for s in full[0]['ranked_spots']] == [(1, '07'), (2, '06'), (3, '08'), (4, '10')]
+    assert capped[0]['ranked_spots'] == full[0]['ranked_spots'][:2]
+    # Conditions come from the full forecast rows, attached by the cache writer
+    assert all('forecast_conditions' not in session for session in full[0]['ranked_spots'])
+
+def test_payload_bytes_do_not_depend_on_the_json_encoder(monkeypatch):
+    snapshot, user_jobs, preset_offsets, _ = _build_snapshot_and_jobs(random.Random(7))
+    payloads = [
+        build_user_recommendations(user_job, preset_offsets[user_job['user_id']], ScoreCache(), snapshot)
+        for user_job in user_jobs[:4]
+    ]
+    payloads[0]['today'].append({'date': 'é', 'ranked_spots': [{'value': Decimal('1.50'), 'at': snapshot.start_utc}]})
+
+    encoded = utils.dumps_json_bytes(payloads)
+    monkeypatch.setattr(utils, 'orjson', None)
+    assert utils.dumps_json_bytes(payloads) == encoded
+
+def _serve_full_forecast_rows(monkeypatch, forecasts_by_spot):
+    """
+    Simula get_forecast_rows: as linhas do banco têm colunas que o store da Tarefa 2 não lê
+    (forecast_id, wave_height_sg...), e são elas que devem chegar às condições dos payloads.
+    """
+    full_rows = {
+        (spot_id, row['timestamp_utc']): {'forecast_id': spot_id * 1000 + i, **row, 'wave_height_sg': Decimal('1.25'), 'minutes_to_next_extreme': i % 360}
+        for spot_id, rows in forecasts_by_spot.items() for i, row in enumerate(rows)
+    }
+    lookups = []
+    async def get_forecast_rows(keys):
+        lookups.append(len(keys))
+        return {key: dict(full_rows[key]) for key in keys if key in full_rows}
+    monkeypatch.setattr(worker_queries, 'get_forecast_rows', get_forecast_rows)
+    return full_rows, lookups
+
+def test_cache_payloads_carry_full_forecast_rows_in_v1_and_v2(monkeypatch):
+    snapshot, user_jobs, preset_offsets, forecasts_by_spot = _build_snapshot_and_jobs(random.Random(7))
+    computed = [build_user_recommendations(job, preset_offsets[job['user_id']], ScoreCache(), snapshot) for job in user_jobs]
+    full_rows, lookups = _serve_full_forecast_rows(monkeypatch, forecasts_by_spot)
+
+    calls, stored, conditions = [], {}, {}
+    async def save_conditions(records):
+        calls.append(('conditions', len(records)))
+        conditions.update({(spot_id, ts.isoformat()): json.loads(js) for spot_id, ts, js in records})
+        return len(records)
+    async def save_cache(records):
+        calls.append(('cache', len(records)))
+        stored.update({(user_id, key, version): json.loads(js) for user_id, key, js, _, version in records})
+        return len(records)
+    monkeypatch.setattr(worker_queries, 'save_forecast_conditions_snapshot', save_conditions)
+    monkeypatch.setattr(worker_queries, 'save_recommendation_cache_batch', save_cache)
+
+    async def write(payload_version):
+        async with RecommendationCacheWriter(batch_size=10, payload_version=payload_version, forecast_store=snapshot.forecast_store) as writer:
+            for job, payloads in zip(user_jobs, computed):
+                for cache_key, payload in payloads.items():
+                    if payload:
+                        await writer.add(job['user_id'], cache_key, payload)
+    asyncio.run(write(1))
+    v1_lookups, calls[:] = list(lookups), []
+    asyncio.run(write(2))
+
+    assert calls[0][0] == 'conditions' and all(kind in ('conditions', 'cache') for kind, _ in calls)
+    assert sum(n for kind, n in calls if kind == 'conditions') == len(conditions)  # cada hora gravada uma única vez
+    assert sum(v1_lookups) == len(conditions)  # cada hora buscada uma única vez por ciclo
+    for job, payloads in zip(user_jobs, computed):
+        for cache_key, payload in payloads.items():
+            if not payload:
+                continue
+            v1, slim = stored[(job['user_id'], cache_key, 1)], stored[(job['user_id'], cache_key, 2)]
+            for day in v1:
+                for session in day['ranked_spots']:
+                    row = full_rows[(session['spot_id'], datetime.datetime.fromisoformat(session['best_hour_utc']))]
+                    assert session['forecast_conditions'] == json.loads(json.dumps({**row, 'timestamp_utc': session['best_hour_utc']}, default=str))
+            # Payload v2 + condições compartilhadas reconstroem exatamente o payload v1
+            for day in slim:
+                for session in day['ranked_spots']:
+                    assert 'forecast_conditions' not in session
+                    session['forecast_conditions'] = conditions[(session['spot_id'], session['best_hour_utc'])]
+            assert slim == v1
+
+def test_cache_writer_skips_payloads_whose_hash_is_unchanged(monkeypatch):
+    batches = []
+    async def save_cache(records):
+        batches.append([(user_id, key, json.loads(js)) for user_id, key, js, _, _ in records])
+        return len(records)
+    refreshed = []
+    async def refresh_cache(keys):
+        refreshed.append(list(keys))
+        return len(keys)
+    monkeypatch.setattr(worker_queries, 'save_recommendation_cache_batch', save_cache)
+    monkeypatch.setattr(worker_queries, 'refresh_recommendation_cache_entries', refresh_cache)
+    _serve_full_forecast_rows(monkeypatch, {})
+    payload = [{'date': '2025-08-28', 'ranked_spots': [{'spot_id': 1, 'best_hour_utc': '2025-08-28T07:00:00+00:00', 'score': 71.5}]}]
+    changed = [{**payload[0], 'ranked_spots': [{**payload[0]['ranked_spots'][0], 'score': 72.0}]}]
+
+    async def write(known_hashes, entries):
+        async with RecommendationCacheWriter(batch_size=10, known_hashes=known_hashes) as writer:
+            for user_id, entry in entries:
+                await writer.add(user_id, 'today', entry)
+        return writer
+
+    first = asyncio.run(write({}, [('u1', payload), ('u2', payload)]))
+    assert first.written == 2 and first.skipped == 0 and refreshed == []
+    # Next cycle: the stored hashes come back as known_hashes
+    second = asyncio.run(write(dict(first.known_hashes), [('u1', payload), ('u2', changed)]))
+    assert second.skipped == 1 and second.written == 1
+    assert batches[-1] == [('u2', 'today', changed)]
+    # The skipped entry is not rewritten, but its created_at is refreshed for retention
+    assert refreshed == [[('u1', 'today')]]
+    assert second.known_hashes[('u2', 'today')] != first.known_hashes[('u2', 'today')]
@@ -0,0 +1,73 @@
+import asyncio
+import datetime
+
+from src.db import retention
+
+START_UTC = datetime.datetime(2025, 8, 1, tzinfo=datetime.timezone.utc)
+THRESHOLD = START_UTC + datetime.timedelta(days=10)
+
+
+class FakeConnection:
+    """Simula o lote de delete_in_chunks sobre linhas {spot_id: [timestamps]} em memória."""
+    def __init__(self, rows_by_spot):
+        self.rows_by_spot = rows_by_spot
+        self.calls = []
+
+    async def fetch(self, sql):
+        return [{'spot_id': spot_id} for spot_id in sorted(self.rows_by_spot)]
+
+    async def fetchrow(self, sql, cursor, threshold, limit, spot_id):
+        self.calls.append((spot_id, cursor))
+        rows = self.rows_by_spot[spot_id]
+        doomed = sorted(ts for ts in rows if cursor <= ts < threshold)[:limit]
+        for ts in doomed:
+            rows.remove(ts)
+        return {'deleted': len(doomed), 'last': max(doomed, default=None)}
+
+def _hours(count, start=START_UTC):
+    return [start + datetime.timedelta(hours=h) for h in range(count)]
+
+def test_chunk_loop_advances_the_cursor_and_stops_on_a_short_chunk():
+    times = _hours(7)
+    cursors = []
+
+    async def delete_chunk(cursor):
+        cursors.append(cursor)
+        doomed = [ts for ts in times if ts >= cursor][:3]
+        for ts in doomed:
+            times.remove(ts)
+        return len(doomed), max(doomed, default=None)
+
+    assert asyncio.run(retention._delete_range_in_chunks(delete_chunk, 3, 0)) == (7, 3)
+    assert cursors == [retention.RETENTION_START, START_UTC + datetime.timedelta(hours=2), START_UTC + datetime.timedelta(hours=5)]
+    assert times == []
+
+    # An exact multiple of the chunk size needs one more (empty) chunk to notice the end
+    times.extend(_hours(6))
+    assert asyncio.run(retention._delete_range_in_chunks(delete_chunk, 3, 0)) == (6, 3)
+
+def test_delete_in_chunks_walks_each_spot_through_its_index_range(monkeypatch):
+    day = datetime.timedelta(days=1)
+    conn = FakeConnection({
+        1: _hours(24 * 12),  # 240 old hours, 48 kept
+        2: _hours(24, THRESHOLD),  # nothing old
+        3: _hours(5, THRESHOLD - day),
+    })
+    released = []
+
+    async def get_connection():
+        return conn
+
+    async def release_connection(connection):
+        released.append(connection)
+
+    monkeypatch.setattr(retention, 'get_async_db_connection', get_connection)
+    monkeypatch.setattr(retention, 'release_async_db_connection', release_connection)
+
+    deleted = asyncio.run(retention.delete_in_chunks('forecasts', THRESHOLD, chunk_size=100, sleep_seconds=0))
+
+    assert deleted == 245 and released == [conn]
+    assert [len(conn.rows_by_spot[spot_id]) for spot_id in (1, 2, 3)] == [48, 24, 0]
+    # Spot 1: two full chunks then a short one; spots 2 and 3 finish in one chunk each
+    assert [spot_id for spot_id, _ in conn.calls] == [1, 1, 1, 2, 3]
+    assert all(cursor < THRESHOLD for _, cursor in conn.calls)
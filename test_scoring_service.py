@@ -0,0 +1,85 @@
+import asyncio
+import random
+from decimal import Decimal
+
+import numpy as np
+
+from src.services.scoring_service import (
+    DirectionTables, calculate_overall_score, calculate_overall_scores_batch,
+    forecasts_to_columns, score_data_at
+)
+
+TIDE_TYPES = ['rising', 'falling', 'high', 'low', 'unknown', None]
+
+def _random_forecast(rng):
+    """Gera uma hora de previsão com valores no formato numeric(5,2) retornado pelo banco."""
+    def dec(lo, hi):
+        return Decimal(f"{rng.uniform(lo, hi):.2f}")
+    return {
+        'swell_height_sg': dec(0, 4),
+        'swell_period_sg': dec(2, 20),
+        'swell_direction_sg': dec(0, 360),
+        'wind_speed_sg': dec(0, 15),
+        'wind_direction_sg': dec(0, 360),
+        'sea_level_sg': dec(-1.5, 1.5),
+        'tide_type': rng.choice(TIDE_TYPES),
+        'air_temperature_sg': dec(10, 38),
+        'water_temperature_sg': dec(12, 30),
+    }
+
+def _random_case(rng):
+    level = rng.choice(['iniciante', 'maroleiro', 'intermediario', 'pro', 'desconhecido'])
+    prefs = {
+        'ideal_swell_height': Decimal(f"{rng.uniform(0.5, 2.5):.2f}"),
+        'max_swell_height': Decimal(f"{rng.uniform(1.0, 3.5):.2f}"),
+        'max_wind_speed': rng.choice([4.0, 7.0, Decimal('9.50')]),
+        'ideal_water_temperature': 22.0,
+        'ideal_air_temperature': 25.0,
+    }
+    spot = {
+        'ideal_swell_direction': rng.choice([[], [Decimal('135')], [90, 180.5, 350]]),
+        'ideal_wind_direction': rng.choice([[], [Decimal('0')], [300, 45.5]]),
+        'ideal_sea_level': Decimal(f"{rng.uniform(-0.5, 1.2):.2f}"),
+        'ideal_tide_flow': rng.choice([[], ['rising'], ['high', 'falling']]),
+    }
+    return prefs, spot, {'surf_level': level}
+
+def test_batch_scores_are_bit_identical_to_hourly_scores():
+    rng = random.Random(42)
+    for _ in range(50):
+        prefs, spot, profile = _random_case(rng)
+        forecasts = [_random_forecast(rng) for _ in range(240)]
+        forecasts[3]['swell_height_sg'] = None  # hora inválida
+        del forecasts[5]['air_temperature_sg']  # chave ausente usa o default
+
+        batch = calculate_overall_scores_batch(forecasts_to_columns(forecasts), prefs, spot, profile)
+
+        for i, forecast in enumerate(forecasts):
+            try:
+                expected = asyncio.run(calculate_overall_score(forecast, prefs, spot, profile))
+            except TypeError:
+                assert not batch['valid'][i]
+                continue
+            assert batch['valid'][i]
+            assert score_data_at(batch, i) == expected
+            for key, value in expected['detailed_scores'].items():
+                assert np.float64(value).tobytes() == batch[key][i].tobytes()
+
+def test_direction_tables_match_direct_scores():
+    rng = random.Random(11)
+    spots = [_random_case(rng)[1] for _ in range(20)]
+    tables = DirectionTables.for_spots(spots)
+    for spot in spots:
+        prefs, _, profile = _random_case(rng)
+        columns = forecasts_to_columns([_random_forecast(rng) for _ in range(240)])
+        # Off-grid, out-of-range and null directions take the direct path
+        columns['swell_direction_sg'][:4] = [12.345, -10.0, 365.5, np.nan]
+        columns['wind_direction_sg'][:4] = [359.999, 720.0, np.nan, 0.0]
+
+        expected = calculate_overall_scores_batch(columns, prefs, spot, profile)
+        batch = calculate_overall_scores_batch(columns, prefs, spot, profile, tables)
+
+        for key, values in expected.items():
+            assert values.tobytes() == batch[key].tobytes(), key
+    # Spots with the same ideal directions share one table
+    assert len(tables._swell) == len({tuple(map(float, s['ideal_swell_direction'])) for s in spots if s['ideal_swell_direction']})
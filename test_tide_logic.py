@@ -1,12 +1,15 @@
 import json
 import os
+import random
 import sys
+import time
+from collections import defaultdict
 import arrow # Adicione a importação do arrow
 
 # Adiciona o diretório 'src' ao path para que possamos importar os módulos
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), 'src')))
 
-from utils.utils import determine_tide_phase, load_json_data
+from utils.utils import determine_tide_phase, label_tide_phases_from_extremes, load_json_data
 from utils.config import REQUEST_DIR
 
 def run_test():
@@ -52,5 +55,126 @@ def run_test():
         print(f"\nERRO: Falha ao salvar o arquivo de resultado: {e}")
 
 
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tide_phase_analysis_result.json')
+
+def _load_golden_case():
+    """Reconstrói a entrada (timestamps UTC de 2025) e os rótulos esperados do resultado salvo por run_test."""
+    with open(GOLDEN_FILE, 'r', encoding='utf-8') as f:
+        golden = json.load(f)
+    sea_level_data = []
+    for row in golden:
+        day, month = row['timestamp'][:5].split('/')
+        sea_level_data.append({'time': f"2025-{month}-{day}T{row['timestamp'][6:]}:00+00:00", 'sg': row['sea_level']})
+    return sea_level_data, [row['calculated_tide_type'] for row in golden]
+
+def _reference_determine_tide_phase(sea_level_data):
+    """Implementação original (quadrática nos platôs), mantida como referência de equivalência."""
+    def _find_different_level(data, current_index, step):
+        current_level = data[current_index].get('sg')
+        i = current_index + step
+        while 0 <= i < len(data):
+            level = data[i].get('sg')
+            if level is not None and level != current_level:
+                return level
+            i += step
+        return None
+
+    def _classify_tide_point(data, index):
+        current_level = data[index].get('sg')
+        if current_level is None:
+            return 'unknown'
+        prev_level = _find_different_level(data, index, -1)
+        next_level = _find_different_level(data, index, 1)
+        if prev_level is not None and next_level is not None:
+            if current_level > prev_level and current_level > next_level:
+                return 'high'
+            elif current_level < prev_level and current_level < next_level:
+                return 'low'
+            elif current_level >= prev_level:
+                return 'rising'
+            else:
+                return 'falling'
+        elif prev_level is None and next_level is not None:
+            return 'falling' if current_level > next_level else 'rising'
+        elif prev_level is not None and next_level is None:
+            return 'rising' if current_level > prev_level else 'falling'
+        return 'unknown'
+
+    if not sea_level_data:
+        return []
+    daily_groups = defaultdict(list)
+    for entry in sorted(sea_level_data, key=lambda x: x['time']):
+        daily_groups[arrow.get(entry['time']).format('YYYY-MM-DD')].append(entry)
+    result = []
+    for date_str in sorted(daily_groups.keys()):
+        daily_data = sorted(daily_groups[date_str], key=lambda x: x['time'])
+        for i, entry in enumerate(daily_data):
+            entry['tide_type'] = _classify_tide_point(daily_data, i)
+        result.extend(daily_data)
+    return sorted(result, key=lambda x: x['time'])
+
+def _random_sea_level_series(rng, days=10, start_hour=0):
+    """Série horária embaralhada com platôs, lacunas (None) e dias só diurnos."""
+    start = arrow.get('2025-08-28T00:00:00+00:00').shift(hours=start_hour)
+    data, level = [], round(rng.uniform(-1, 1), 2)
+    for h in range(24 * days):
+        if rng.random() < 0.1:
+            continue # hora ausente
+        if rng.random() < 0.6:
+            level = round(level + rng.choice([-0.2, -0.1, 0.1, 0.2]), 2)
+        data.append({'time': start.shift(hours=h).isoformat(), 'sg': None if rng.random() < 0.05 else level})
+    rng.shuffle(data)
+    return data
+
+def test_tide_phase_matches_golden_result():
+    sea_level_data, expected = _load_golden_case()
+    result = determine_tide_phase(sea_level_data)
+    assert [entry['tide_type'] for entry in result] == expected
+
+def test_tide_phase_matches_reference_implementation():
+    rng = random.Random(13)
+    for case in range(200):
+        data = _random_sea_level_series(rng, days=rng.randint(1, 3), start_hour=rng.randint(0, 23))
+        if case % 20 == 0:
+            data = data[:rng.randint(0, 2)] # entradas vazias ou com um único ponto
+        expected = [(e['time'], e['sg'], e['tide_type']) for e in _reference_determine_tide_phase([dict(e) for e in data])]
+        result = [(e['time'], e['sg'], e['tide_type']) for e in determine_tide_phase([dict(e) for e in data])]
+        assert result == expected
+
+def test_tide_phase_from_extremes_crosses_day_boundaries():
+    hours = [f"2025-08-28T{h:02d}:00:00+00:00" for h in range(20, 24)] + [f"2025-08-29T{h:02d}:00:00+00:00" for h in range(0, 4)]
+    sea_level_data = [{'time': t, 'sg': level} for t, level in zip(hours, [0.1, 0.3, 0.5, 0.6, 0.6, 0.4, 0.2, None])]
+    extremes = [
+        {'time': '2025-08-28T17:05:00+00:00', 'type': 'low', 'height': -0.6},
+        {'time': '2025-08-28T23:40:00+00:00', 'type': 'high', 'height': 0.62},
+        {'time': '2025-08-29T05:50:00+00:00', 'type': 'low', 'height': -0.5},
+    ]
+
+    result = label_tide_phases_from_extremes(sea_level_data, extremes)
+
+    assert [e['tide_type'] for e in result] == ['rising', 'rising', 'rising', 'rising', 'high', 'falling', 'falling', 'falling']
+    assert [e['minutes_to_next_extreme'] for e in result] == [220, 160, 100, 40, 350, 290, 230, 170]
+
+def test_tide_phase_from_extremes_falls_back_to_heuristic_outside_extremes():
+    sea_level_data, expected = _load_golden_case()
+    result = label_tide_phases_from_extremes(sea_level_data, [])
+    assert [entry['tide_type'] for entry in result] == expected
+    assert all(entry['minutes_to_next_extreme'] is None for entry in result)
+
+def benchmark_tide_phase(spots=200, days=10):
+    """Compara a implementação atual com a de referência em `spots` séries de `days` dias."""
+    rng = random.Random(0)
+    series = [_random_sea_level_series(rng, days=days) for _ in range(spots)]
+    for label, fn in (("referência", _reference_determine_tide_phase), ("atual", determine_tide_phase)):
+        inputs = [[dict(e) for e in data] for data in series]
+        started = time.perf_counter()
+        for data in inputs:
+            fn(data)
+        print(f"{label:>10}: {time.perf_counter() - started:.3f}s para {spots} spots x {days} dias")
+
+
 if __name__ == "__main__":
-    run_test()
\ No newline at end of file
+    if "--benchmark" in sys.argv:
+        benchmark_tide_phase()
+    else:
+        run_test()
\ No newline at end of file